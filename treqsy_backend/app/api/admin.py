@@ -1,47 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from app.models.user import Role, User
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Response
+from pydantic import ValidationError
+from pymongo import ASCENDING, DESCENDING
+from app.models.user import Principal, Role
 from app.core.dependencies import RoleChecker
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from motor.motor_asyncio import AsyncIOMotorCollection
 from datetime import datetime
+from typing import Optional
 from app.models.coin_transaction import CoinTransaction
+from app.core.database import (
+    get_coin_transactions_collection,
+    get_payout_requests_collection,
+    get_streams_collection,
+    get_users_collection,
+    match_user_id,
+)
+from app.api.streams import directory
+from app.core.analytics import CoinRollups, get_rollups
+from app.core.app_settings import AppSettings, get_app_settings
+from app.core.pagination import Page, paginate
+from app.core.ledger import Ledger, LedgerError, get_ledger
+from app.core.gift_batcher import GIFT_BATCHING, GiftBatcher, get_gift_batcher
+from app.core.stream_directory import STREAM_DIRECTORY
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
-MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGO_URI)
-db = client["treqsy"]
-users_collection = db["users"]
-settings_collection = db["settings"]
-coin_transactions = db["coin_transactions"]
-payout_requests = db["payout_requests"]
+Users = Depends(get_users_collection)
+Settings = Depends(get_app_settings)
+Streams = Depends(get_streams_collection)
+CoinTransactions = Depends(get_coin_transactions_collection)
+PayoutRequests = Depends(get_payout_requests_collection)
+CoinLedger = Depends(get_ledger)
+Gifts = Depends(get_gift_batcher)
+Analytics = Depends(get_rollups)
+
+# List projections: only what the admin screens show (never hashed_password).
+USER_FIELDS = {"email": 1, "role": 1, "is_active": 1, "is_vip": 1, "coins": 1}
+TRANSACTION_FIELDS = {"user_id": 1, "type": 1, "amount": 1, "timestamp": 1, "details": 1}
+PAYOUT_FIELDS = {"user_id": 1, "amount": 1, "timestamp": 1, "status": 1}
+NEWEST_FIRST = [("timestamp", DESCENDING), ("_id", DESCENDING)]
 
 master_admin_only = RoleChecker([Role.MASTER_ADMIN])
 admin_or_master = RoleChecker([Role.ADMIN, Role.MASTER_ADMIN])
 
 # --- User Management ---
 @router.get("/users", dependencies=[Depends(admin_or_master)])
-async def list_users(current_user: User = Depends(admin_or_master)):
+async def list_users(response: Response, page: Page = Depends(), current_user: Principal = Depends(admin_or_master), users_collection: AsyncIOMotorCollection = Users):
     # Master admin sees all, admin sees only their region (dummy: all for now)
-    users = await users_collection.find().to_list(100)
-    return users
+    return await paginate(page, response, users_collection, {}, [("_id", ASCENDING)], USER_FIELDS)
 
 @router.post("/users/{user_id}/role", dependencies=[Depends(master_admin_only)])
-async def change_user_role(user_id: str, new_role: Role = Body(...)):
+async def change_user_role(user_id: str, new_role: Role = Body(...), users_collection: AsyncIOMotorCollection = Users):
     result = await users_collection.update_one({"_id": user_id}, {"$set": {"role": new_role}})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found or role unchanged")
     return {"msg": "Role updated"}
 
 @router.post("/users/{user_id}/activate", dependencies=[Depends(master_admin_only)])
-async def activate_user(user_id: str, active: bool = Body(...)):
+async def activate_user(user_id: str, active: bool = Body(...), users_collection: AsyncIOMotorCollection = Users):
     result = await users_collection.update_one({"_id": user_id}, {"$set": {"is_active": active}})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found or status unchanged")
     return {"msg": "User status updated"}
 
 @router.post("/users/{user_id}/vip", dependencies=[Depends(master_admin_only)])
-async def toggle_vip_status(user_id: str, is_vip: bool = Body(...)):
+async def toggle_vip_status(user_id: str, is_vip: bool = Body(...), users_collection: AsyncIOMotorCollection = Users):
     result = await users_collection.update_one(
         {"_id": user_id},
         {"$set": {"is_vip": is_vip}}
@@ -52,37 +74,35 @@ async def toggle_vip_status(user_id: str, is_vip: bool = Body(...)):
 
 # --- App Settings ---
 @router.get("/settings/app_name", dependencies=[Depends(master_admin_only)])
-async def get_app_name():
-    doc = await settings_collection.find_one({"key": "app_name"})
-    return {"app_name": doc["value"] if doc else "Treqsy"}
+async def get_app_name(settings: AppSettings = Settings):
+    return {"app_name": settings.app_name}
 
 @router.post("/settings/app_name", dependencies=[Depends(master_admin_only)])
-async def set_app_name(name: str = Body(...)):
-    await settings_collection.update_one({"key": "app_name"}, {"$set": {"value": name}}, upsert=True)
+async def set_app_name(name: str = Body(...), settings: AppSettings = Settings):
+    await settings.set("app_name", name)
     return {"msg": "App name updated"}
 
-# --- Wallet Analytics (dummy) ---
+# --- Wallet Analytics ---
+# Served from the materialized rollups (app/core/analytics.py): a handful of
+# point reads regardless of how many transactions exist.
 @router.get("/wallet/analytics", dependencies=[Depends(master_admin_only)])
-async def wallet_analytics():
-    # In a real app, this data would come from complex database queries.
+async def wallet_analytics(analytics: CoinRollups = Analytics, streams_collection: AsyncIOMotorCollection = Streams):
+    totals = await analytics.summary()
+    days = await analytics.days(7)
+    leaders = await analytics.leaders()
+    if STREAM_DIRECTORY:
+        active_streams = len(directory)
+    else:
+        active_streams = await streams_collection.count_documents({"is_active": True})
+    joins = totals.get("viewer_joins", 0)
     return {
-        "total_revenue": 123456.78,
-        "active_streams": 42,
-        "new_users_today": 15,
-        "avg_watch_time_minutes": 28,
-        "revenue_last_7_days": [
-            {"day": "Mon", "revenue": 1200},
-            {"day": "Tue", "revenue": 1800},
-            {"day": "Wed", "revenue": 1500},
-            {"day": "Thu", "revenue": 2200},
-            {"day": "Fri", "revenue": 3000},
-            {"day": "Sat", "revenue": 4500},
-            {"day": "Sun", "revenue": 4000},
-        ],
-        "top_earners": [
-            {"email": "host1@example.com", "earned": 5000},
-            {"email": "host2@example.com", "earned": 4200},
-        ]
+        "total_revenue": totals.get("revenue", 0),
+        "active_streams": active_streams,
+        "new_users_today": days[-1].get("new_users", 0),
+        # Watch time per viewer join, from the presence flushes.
+        "avg_watch_time_minutes": round(totals.get("watch_seconds", 0) / joins / 60, 2) if joins else None,
+        "revenue_last_7_days": [{"day": day["day"], "revenue": day.get("revenue", 0)} for day in days],
+        "top_earners": [{"email": row["email"], "earned": row["coins"]} for row in leaders.get("top_earners", [])],
     }
 
 @router.get("/dashboard")
@@ -91,51 +111,41 @@ async def admin_dashboard(user = Depends(admin_or_master)):
 
 # --- Coin Analytics (Admin) ---
 @router.get("/coins/analytics", dependencies=[Depends(master_admin_only)])
-async def coin_analytics():
-    # Dummy aggregation for now
-    total_coins = await users_collection.aggregate([
-        {"$group": {"_id": None, "total": {"$sum": "$coins"}}}
-    ]).to_list(1)
-    coins_purchased = 100000  # Dummy
-    coins_spent = 80000  # Dummy
-    coins_payout = 20000  # Dummy
-    top_spenders = [
-        {"email": "spender1@demo.com", "coins": 5000},
-        {"email": "spender2@demo.com", "coins": 4200},
-    ]
-    top_earners = [
-        {"email": "host1@demo.com", "coins": 7000},
-        {"email": "host2@demo.com", "coins": 6500},
-    ]
+async def coin_analytics(analytics: CoinRollups = Analytics):
+    totals = await analytics.summary()
+    leaders = await analytics.leaders()
+    strip = lambda rows: [{"email": row["email"], "coins": row["coins"]} for row in rows]
     return {
-        "total_coins": total_coins[0]["total"] if total_coins else 0,
-        "coins_purchased": coins_purchased,
-        "coins_spent": coins_spent,
-        "coins_payout": coins_payout,
-        "top_spenders": top_spenders,
-        "top_earners": top_earners,
+        # Every coin enters through a purchase and leaves through a payout; gifts only move them.
+        "total_coins": totals.get("coins_purchased", 0) - totals.get("coins_payout", 0),
+        "coins_purchased": totals.get("coins_purchased", 0),
+        "coins_spent": totals.get("coins_spent", 0),
+        "coins_payout": totals.get("coins_payout", 0),
+        "top_spenders": strip(leaders.get("top_spenders", [])),
+        "top_earners": strip(leaders.get("top_earners", [])),
     }
 
 # --- Coin Settings (Admin) ---
 @router.get("/coins/settings", dependencies=[Depends(master_admin_only)])
-async def get_coin_settings():
-    doc = await settings_collection.find_one({"key": "coin_settings"})
-    return doc["value"] if doc else {"coin_price": 1, "bonus_rate": 0}
+async def get_coin_settings(settings: AppSettings = Settings):
+    return settings.coin_settings.model_dump()
 
 @router.post("/coins/settings", dependencies=[Depends(master_admin_only)])
-async def set_coin_settings(settings: dict = Body(...)):
-    await settings_collection.update_one({"key": "coin_settings"}, {"$set": {"value": settings}}, upsert=True)
+async def set_coin_settings(settings: dict = Body(...), app_settings: AppSettings = Settings):
+    try:
+        await app_settings.set("coin_settings", settings)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
     return {"msg": "Coin settings updated"}
 
 # --- List Pending Payout Requests (Admin) ---
 @router.get("/coins/payout/requests", dependencies=[Depends(master_admin_only)])
-async def list_payout_requests():
-    requests = await payout_requests.find({"status": "pending"}).sort("timestamp", -1).to_list(100)
-    return requests
+async def list_payout_requests(response: Response, page: Page = Depends(), payout_requests: AsyncIOMotorCollection = PayoutRequests):
+    return await paginate(page, response, payout_requests, {"status": "pending"}, NEWEST_FIRST, PAYOUT_FIELDS)
 
 # --- Request Payout (User/Host/Agency) ---
 @router.post("/coins/payout/request")
-async def request_payout(user_id: str = Body(...), amount: int = Body(...)):
+async def request_payout(user_id: str = Body(...), amount: int = Body(...), coin_transactions: AsyncIOMotorCollection = CoinTransactions, payout_requests: AsyncIOMotorCollection = PayoutRequests):
     req = {
         "user_id": user_id,
         "amount": amount,
@@ -150,43 +160,42 @@ async def request_payout(user_id: str = Body(...), amount: int = Body(...)):
 
 # --- Approve Payout (Admin) ---
 @router.post("/coins/payout/approve", dependencies=[Depends(master_admin_only)])
-async def approve_payout(request_id: str = Body(...)):
-    req = await payout_requests.find_one({"_id": request_id, "status": "pending"})
-    if not req:
-        raise HTTPException(status_code=404, detail="Request not found or already processed")
-    await payout_requests.update_one({"_id": request_id}, {"$set": {"status": "approved", "approved_at": datetime.utcnow()}})
-    await coin_transactions.insert_one(CoinTransaction(
-        user_id=req["user_id"], type="payout_approved", amount=req["amount"], timestamp=datetime.utcnow()
-    ).dict())
-    await users_collection.update_one({"_id": req["user_id"]}, {"$inc": {"coins": -req["amount"]}})
+async def approve_payout(request_id: str = Body(...), idempotency_key: Optional[str] = Header(None), ledger: Ledger = CoinLedger):
+    try:
+        await ledger.approve_payout(request_id, idempotency_key)
+    except LedgerError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     return {"msg": "Payout approved"}
 
 # --- User Coin Endpoints ---
 @router.get("/coins/balance", dependencies=[Depends(admin_or_master)])
-async def get_balance(current_user: User = Depends(admin_or_master)):
-    user = await users_collection.find_one({"_id": current_user.id})
+async def get_balance(current_user: Principal = Depends(admin_or_master), users_collection: AsyncIOMotorCollection = Users):
+    user = await users_collection.find_one({"_id": match_user_id(current_user.id)})
     return {"coins": user.get("coins", 0) if user else 0}
 
 @router.post("/coins/purchase")
-async def purchase_coins(user_id: str = Body(...), amount: int = Body(...)):
+async def purchase_coins(user_id: str = Body(...), amount: int = Body(...), idempotency_key: Optional[str] = Header(None), ledger: Ledger = CoinLedger, settings: AppSettings = Settings):
     # Simulate payment
-    await users_collection.update_one({"_id": user_id}, {"$inc": {"coins": amount}})
-    await coin_transactions.insert_one(CoinTransaction(
-        user_id=user_id, type="purchase", amount=amount, timestamp=datetime.utcnow()
-    ).dict())
+    try:
+        await ledger.purchase(user_id, amount, idempotency_key, price=settings.coin_settings.coin_price)
+    except LedgerError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     return {"msg": "Coins purchased"}
 
 @router.post("/coins/gift")
-async def gift_coins(from_user: str = Body(...), to_user: str = Body(...), amount: int = Body(...)):
-    await users_collection.update_one({"_id": from_user}, {"$inc": {"coins": -amount}})
-    await users_collection.update_one({"_id": to_user}, {"$inc": {"coins": amount}})
-    await coin_transactions.insert_many([
-        CoinTransaction(user_id=from_user, type="gift_sent", amount=-amount, timestamp=datetime.utcnow(), details=f"to {to_user}").dict(),
-        CoinTransaction(user_id=to_user, type="gift_received", amount=amount, timestamp=datetime.utcnow(), details=f"from {from_user}").dict(),
-    ])
+async def gift_coins(response: Response, from_user: str = Body(...), to_user: str = Body(...), amount: int = Body(...), stream_id: Optional[str] = Body(None), idempotency_key: Optional[str] = Header(None), ledger: Ledger = CoinLedger, gifts: GiftBatcher = Gifts):
+    try:
+        if GIFT_BATCHING:
+            if not await gifts.gift(from_user, to_user, amount, stream_id, idempotency_key):
+                # Debited, but the batch write kept failing; recovery completes it.
+                response.status_code = 202
+                return {"msg": "Gift accepted", "status": "pending"}
+        else:
+            await ledger.gift(from_user, to_user, amount, idempotency_key)
+    except LedgerError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     return {"msg": "Coins gifted"}
 
 @router.get("/coins/transactions/{user_id}")
-async def get_transactions(user_id: str):
-    txs = await coin_transactions.find({"user_id": user_id}).sort("timestamp", -1).to_list(100)
-    return txs 
\ No newline at end of file
+async def get_transactions(user_id: str, response: Response, page: Page = Depends(), coin_transactions: AsyncIOMotorCollection = CoinTransactions):
+    return await paginate(page, response, coin_transactions, {"user_id": user_id, "pending": {"$exists": False}}, NEWEST_FIRST, TRANSACTION_FIELDS) 
\ No newline at end of file
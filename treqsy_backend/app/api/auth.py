@@ -1,29 +1,28 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+import math
+from datetime import datetime
+
+from fastapi import APIRouter, HTTPException, Depends, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
-from motor.motor_asyncio import AsyncIOMotorClient
-from app.models.user import User, Role
+from motor.motor_asyncio import AsyncIOMotorCollection
+from app.models.user import User
 from app.models.requests import RegisterRequest
-from app.core.security import get_password_hash, verify_password, create_access_token
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from app.core.analytics import rollups
+from app.core.database import get_users_collection
+from app.core.rate_limit import client_ip, login_account
+from app.core.security import create_access_token, password_hasher
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGO_URI)
-db = client["treqsy"]
-users_collection = db["users"]
+Users = Depends(get_users_collection)
 
 # Registration endpoint: expects JSON body, always hashes password, stores correct fields
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-async def register(request: RegisterRequest):
+async def register(request: RegisterRequest, users_collection: AsyncIOMotorCollection = Users):
     try:
         existing = await users_collection.find_one({"email": request.email})
         if existing:
             raise HTTPException(status_code=400, detail="Email already registered")
-        hashed_password = get_password_hash(request.password)
+        hashed_password = await password_hasher.hash(request.password)
         user_data = {
             "email": request.email,
             "hashed_password": hashed_password,
@@ -34,7 +33,9 @@ async def register(request: RegisterRequest):
         user_dict = user.dict(by_alias=True)
         if user_dict.get("_id") is None:
             user_dict.pop("_id", None) # Use pop with default to avoid key error
+        user_dict["created_at"] = datetime.utcnow()
         await users_collection.insert_one(user_dict)
+        rollups.record_signup(user_dict["created_at"])
         return {"msg": "User registered successfully"}
     except Exception as e:
         print("Registration error:", str(e))
@@ -42,13 +43,23 @@ async def register(request: RegisterRequest):
 
 # Login endpoint: expects form data (username and password), looks up user by email, verifies password hash
 @router.post("/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    print("Login attempt:", form_data.username, form_data.password)
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), users_collection: AsyncIOMotorCollection = Users):
+    # Per account and address, on top of the per-IP limit: guessing one password
+    # is slowed down, but nobody can lock an account out from elsewhere.
+    retry_after = await login_account.hit(f"{form_data.username.lower()}|{client_ip(request.scope)}")
+    if retry_after:
+        raise HTTPException(status_code=429, detail="Too many login attempts",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
     user_data = await users_collection.find_one({"email": form_data.username})
-    print("User from DB:", user_data)
-    if not user_data or not verify_password(form_data.password, user_data["hashed_password"]):
+    valid, new_hash = False, None
+    if user_data:
+        valid, new_hash = await password_hasher.verify_and_update(form_data.password, user_data["hashed_password"])
+    if not valid:
         print("Login failed: invalid credentials or password mismatch")
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash used deprecated settings; upgrade it while we have the plaintext.
+        await users_collection.update_one({"_id": user_data["_id"]}, {"$set": {"hashed_password": new_hash}})
     token_data = {
         "sub": str(user_data["_id"]),
         "role": user_data.get("role", "user"),
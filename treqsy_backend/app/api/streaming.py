@@ -1,35 +1,239 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import List
+import asyncio
+import heapq
+import json
+import time
+from typing import Dict, Iterator, Optional
+
+from app.core.analytics import rollups
+from app.core.broker import Broker, InMemoryBroker, create_broker
+from app.core.chat_history import ChatHistory
+from app.core.dependencies import principal_from_token
+from app.core.events import TopicError, events, resolve_topic
+from app.core.fanout import WS_TRY_AGAIN_LATER, Connection, encode_text_frame
+from app.core.heartbeat import PONG, WS_IDLE_CLOSE, Heartbeat
+from app.core.metrics import FANOUT_SECONDS, METRICS_MAX_ROOMS, WS_EVICTIONS, Gauge, registry
+from app.core.presence import Presence
+from app.core.rate_limit import CHAT_MESSAGE_RATE, WS_POLICY_VIOLATION, MessageThrottle, Rate
+
+chat_rate = Rate.parse(CHAT_MESSAGE_RATE)
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, List[WebSocket]] = {}
+    def __init__(self, broker: Optional[Broker] = None, history: Optional[ChatHistory] = None,
+                 presence: Optional[Presence] = None, **connection_options):
+        # room_id -> {websocket: Connection}; dict membership keeps joins/leaves O(1).
+        self.active_connections: Dict[str, Dict[WebSocket, Connection]] = {}
+        self.broker = broker or InMemoryBroker()
+        self.history = history or ChatHistory()
+        self.presence = presence or Presence()
+        self.connection_options = connection_options
+        self._backfills = set()
+        self.heartbeat = Heartbeat(self.connections, self._idle)
+
+    async def start(self):
+        await self.broker.start(self._relay)
+        self.history.start()
+        self.presence.start()
+        self.heartbeat.start()
 
-    async def connect(self, websocket: WebSocket, room_id: str):
+    async def stop(self):
+        self.heartbeat.close()
+        await self.broker.stop()
+        for task in list(self._backfills):
+            task.cancel()
+        await self.history.close()
+        await self.presence.close()
+
+    async def connect(self, websocket: WebSocket, room_id: str, after: Optional[int] = None) -> Connection:
         await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        self.active_connections[room_id].append(websocket)
+        room = self.active_connections.get(room_id)
+        if room is None:
+            room = self.active_connections[room_id] = {}
+            self.broker.subscribe(room_id)
+        connection = room[websocket] = Connection(websocket, room_id, self._drop, **self.connection_options)
+        self.presence.join(room_id)
+        # Recent chat comes from memory ahead of any live message; whatever only
+        # the database has follows in the background, so joining never waits on it.
+        frames, gap = self.history.replay(room_id, after)
+        for _, frame in frames:
+            connection.offer(encode_text_frame(frame))
+        if gap and self.history.running:
+            before = frames[0][0] if frames else self.history.next_seq(room_id)
+            task = asyncio.create_task(self._backfill(connection, after, before))
+            self._backfills.add(task)
+            task.add_done_callback(self._backfills.discard)
+        return connection
+
+    async def _backfill(self, connection: Connection, after: Optional[int], before: int):
+        try:
+            if after is None:
+                frames = await self.history.recent(connection.room_id)
+            else:
+                frames = await self.history.since(connection.room_id, after)
+        except Exception as e:
+            print("Chat history load failed:", str(e))
+            return
+        if connection.websocket not in self.active_connections.get(connection.room_id, ()):
+            return
+        for seq, frame in frames:
+            if seq < before and not connection.offer(encode_text_frame(frame)):
+                break
+
+    def disconnect(self, websocket: WebSocket, room_id: str, code: Optional[int] = None):
+        # Safe to repeat: the endpoint calls it on its way out whatever else already did.
+        room = self.active_connections.get(room_id)
+        if room is None:
+            return
+        connection = room.pop(websocket, None)
+        if connection is not None:
+            connection.close(code)
+            self.presence.leave(room_id)
+        if not room:
+            self._remove_room(room_id)
 
-    def disconnect(self, websocket: WebSocket, room_id: str):
-        if room_id in self.active_connections:
-            self.active_connections[room_id].remove(websocket)
+    def viewer_count(self, room_id: str) -> int:
+        return len(self.active_connections.get(room_id, ()))
+
+    def connections(self) -> Iterator[Connection]:
+        for room in self.active_connections.values():
+            yield from room.values()
+
+    def _remove_room(self, room_id: str):
+        del self.active_connections[room_id]
+        self.broker.unsubscribe(room_id)
+        self.history.forget(room_id)
+
+    def _drop(self, connection: Connection):
+        self.disconnect(connection.websocket, connection.room_id)
+
+    def _idle(self, connection: Connection):
+        self.disconnect(connection.websocket, connection.room_id, WS_IDLE_CLOSE)
 
     async def broadcast(self, message: str, room_id: str):
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]:
-                await connection.send_text(message)
+        self._fan_out(room_id, message)
+        self.broker.publish(room_id, message)
+
+    async def chat(self, message: str, room_id: str):
+        # Sequenced, kept for replay and queued for persistence before it goes out.
+        await self.broadcast(self.history.publish(room_id, message), room_id)
 
-manager = ConnectionManager()
+    def _relay(self, room_id: str, message: str):
+        self.history.relayed(room_id, message)
+        self._fan_out(room_id, message)
+
+    def _fan_out(self, room_id: str, message: str):
+        # Local delivery only; called for our own broadcasts and for ones relayed by the broker.
+        room = self.active_connections.get(room_id)
+        if not room:
+            return
+        started = time.perf_counter()
+        frame = encode_text_frame(message)
+        slow = [connection for connection in room.values() if not connection.offer(frame)]
+        for connection in slow:
+            room.pop(connection.websocket, None)
+            connection.close(WS_TRY_AGAIN_LATER)
+            self.presence.leave(room_id)
+        if slow:
+            WS_EVICTIONS.inc(amount=len(slow))
+        if not room:
+            self._remove_room(room_id)
+        FANOUT_SECONDS.observe(time.perf_counter() - started)
+
+    # --- Metrics, read at scrape time ---
+    def room_sizes(self):
+        largest = heapq.nlargest(METRICS_MAX_ROOMS, self.active_connections.items(), key=lambda item: len(item[1]))
+        return [((room_id,), len(room)) for room_id, room in largest]
+
+    def queue_depths(self):
+        depths = [len(c.queue) for room in self.active_connections.values() for c in room.values()]
+        return [(("total",), sum(depths)), (("max",), max(depths, default=0))]
+
+manager = ConnectionManager(create_broker(), presence=Presence(on_flush=rollups.record_watch))
+registry.register(Gauge("ws_connections", "Open chat sockets per room (largest rooms only).", ("room",),
+                        lambda: manager.room_sizes()))
+registry.register(Gauge("ws_connections_total", "Open chat sockets on this worker.",
+                        collect=lambda: [((), sum(map(len, manager.active_connections.values())))]))
+registry.register(Gauge("ws_rooms", "Rooms with at least one open chat socket.",
+                        collect=lambda: [((), len(manager.active_connections))]))
+registry.register(Gauge("ws_send_queue_depth", "Chat frames waiting in viewers' send queues.", ("stat",),
+                        lambda: manager.queue_depths()))
+registry.register(Gauge("chat_history_pending", "Chat messages waiting to be persisted.",
+                        collect=lambda: [((), manager.history.pending)]))
 router = APIRouter(prefix="/ws", tags=["websockets"])
 
 @router.websocket("/chat/{stream_id}")
-async def websocket_endpoint(websocket: WebSocket, stream_id: str):
-    await manager.connect(websocket, stream_id)
+async def websocket_endpoint(websocket: WebSocket, stream_id: str, after: Optional[int] = None):
+    # `after`: the last seq a reconnecting client saw; it is sent what followed.
+    # Clients answer the heartbeat's {"op":"ping"} with {"op":"pong"}, which is not chat.
+    connection = await manager.connect(websocket, stream_id, after)
+    throttle = MessageThrottle(chat_rate)
     try:
         while True:
             data = await websocket.receive_text()
-            await manager.broadcast(f"Client message: {data}", stream_id)
+            connection.seen()
+            if data == PONG or connection.closed:
+                # A closed connection was dropped (reaped, evicted, failed send) with
+                # this in flight; the disconnect follows.
+                continue
+            if throttle.allow():
+                await manager.chat(f"Client message: {data}", stream_id)
+            elif throttle.flooding:
+                manager.disconnect(websocket, stream_id)
+                await websocket.close(code=WS_POLICY_VIOLATION)
+                return
     except WebSocketDisconnect:
         manager.disconnect(websocket, stream_id)
-        await manager.broadcast(f"A client left the chat", stream_id) 
\ No newline at end of file
+        await manager.broadcast('{"text":"A client left the chat"}', stream_id)
+    finally:
+        # Also when the loop died some other way (a failed receive, a cancelled task).
+        manager.disconnect(websocket, stream_id)
+
+EVENT_OPS = {"subscribe": "subscribed", "unsubscribe": "unsubscribed"}
+EVENT_REQUEST_HINT = 'Expected {"op": "subscribe" | "unsubscribe", "topics": [...]}'
+
+@router.websocket("/events")
+async def events_endpoint(websocket: WebSocket, token: Optional[str] = None):
+    # One socket for every pushed topic (see app/core/events.py). Clients send
+    # {"op": "subscribe" | "unsubscribe", "topics": [...]}, and {"op":"pong"} to
+    # heartbeat pings; `token` is an access token, needed for wallet topics. The
+    # socket is closed with 4001 once the token expires.
+    principal = principal_from_token(token) if token else None
+    if token and principal is None:
+        await websocket.close(code=WS_POLICY_VIOLATION)
+        return
+    connection = await events.connect(websocket, principal.expires_at if principal else None)
+    throttle = MessageThrottle(chat_rate)
+    try:
+        while True:
+            data = await websocket.receive_text()
+            connection.seen()
+            if data == PONG or connection.closed:
+                continue
+            if not throttle.allow():
+                if throttle.flooding:
+                    events.disconnect(websocket)
+                    await websocket.close(code=WS_POLICY_VIOLATION)
+                    return
+                continue
+            try:
+                request = json.loads(data)
+                op, names = request["op"], request["topics"]
+                if op not in EVENT_OPS or not isinstance(names, list):
+                    raise KeyError(op)
+                topics = [resolve_topic(str(name), principal) for name in names]
+                for topic in topics:
+                    if op == "subscribe":
+                        events.subscribe(websocket, topic)
+                    else:
+                        events.unsubscribe(websocket, topic)
+            except TopicError as e:
+                events.send(websocket, {"op": "error", "detail": str(e)})
+                continue
+            except (ValueError, KeyError, TypeError):
+                events.send(websocket, {"op": "error", "detail": EVENT_REQUEST_HINT})
+                continue
+            events.send(websocket, {"op": EVENT_OPS[op], "topics": topics})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        events.disconnect(websocket)
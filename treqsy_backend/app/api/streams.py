@@ -1,29 +1,32 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
 from datetime import datetime
-from typing import List
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from typing import List, Optional
+from motor.motor_asyncio import AsyncIOMotorCollection
 
-from app.models.stream import StreamSession
+from app.api.streaming import manager
+from app.models.stream import ActiveStream, StreamSession
+from app.core.database import get_streams_collection
+from app.core.events import events
 from app.core.dependencies import RoleChecker
-from app.models.user import Role, User
+from app.core.pagination import Page, paginate
+from app.core.stream_directory import ACTIVE_SORT, STREAM_DIRECTORY, StreamDirectory
+from app.models.user import Principal, Role
 
 # This dependency ensures only users with 'host' or 'master_admin' roles can access endpoints.
 host_access = Depends(RoleChecker(allowed_roles=[Role.HOST, Role.MASTER_ADMIN]))
 
 router = APIRouter(prefix="/streams", tags=["streams"])
 
-MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGO_URI)
-db = client["treqsy"]
-streams_collection = db["streams"]
+Streams = Depends(get_streams_collection)
+
+directory = StreamDirectory(manager.viewer_count)
 
 
 @router.post("/start", response_model=StreamSession, dependencies=[host_access])
-async def start_stream(title: str, user: dict = host_access):
+async def start_stream(title: str, user: Principal = host_access, streams_collection: AsyncIOMotorCollection = Streams):
     # The user's info (including email) is now securely taken from the JWT payload
     # provided by the 'host_access' dependency.
-    host_email = user.get("sub")
+    host_email = user.email
     session = StreamSession(host_email=host_email, title=title)
     
     session_dict = session.dict(by_alias=True)
@@ -31,10 +34,12 @@ async def start_stream(title: str, user: dict = host_access):
         session_dict.pop("_id")
 
     await streams_collection.insert_one(session_dict)
+    directory.started(session)
+    events.stream_started(session_dict)
     return session
 
 @router.post("/{stream_id}/end", response_model=StreamSession)
-async def end_stream(stream_id: str):
+async def end_stream(stream_id: str, streams_collection: AsyncIOMotorCollection = Streams):
     session = await streams_collection.find_one_and_update(
         {"_id": stream_id, "is_active": True},
         {"$set": {"is_active": False, "end_time": datetime.utcnow()}},
@@ -42,9 +47,22 @@ async def end_stream(stream_id: str):
     )
     if not session:
         raise HTTPException(status_code=404, detail="Active stream not found")
+    directory.ended(stream_id)
+    events.stream_ended(stream_id)
     return session
 
-@router.get("/active", response_model=List[StreamSession])
-async def get_active_streams():
-    streams = await streams_collection.find({"is_active": True}).to_list(100)
-    return streams 
\ No newline at end of file
+@router.get("/active", response_model=List[ActiveStream])
+async def get_active_streams(response: Response, page: Page = Depends(), if_none_match: Optional[str] = Header(None), streams_collection: AsyncIOMotorCollection = Streams):
+    if not STREAM_DIRECTORY:
+        return await paginate(page, response, streams_collection, {"is_active": True}, ACTIVE_SORT)
+    # The whole directory is one pre-serialized body; paging parameters do not apply.
+    body, etag = directory.snapshot()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers) 
+
+@router.get("/{stream_id}/presence")
+async def get_stream_presence(stream_id: str):
+    # Live counters from this worker's memory; the stream document has the flushed totals.
+    return manager.presence.snapshot(stream_id)
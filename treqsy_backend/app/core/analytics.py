@@ -0,0 +1,311 @@
+import asyncio
+import heapq
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from app.core import database
+from app.core.database import match_user_ids
+from app.core.app_settings import app_settings
+
+# Coin and wallet analytics, maintained incrementally from the ledger entries as
+# they are committed instead of aggregated on every admin request.
+#
+# coin_rollups holds one document per UTC day ("day:YYYY-MM-DD"), a running
+# "totals" document and a "leaders" document with the top spenders/earners.
+# coin_user_totals keeps each user's lifetime coins spent and earned. Workers
+# accumulate deltas in memory and flush them as $inc updates every
+# ANALYTICS_FLUSH_INTERVAL, so the write cost is fixed per interval rather than
+# per transaction; $inc is additive, so any number of workers can flush.
+# Deltas whose write fails are kept and retried on the next flush.
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "5"))
+ANALYTICS_TOP_N = int(os.getenv("ANALYTICS_TOP_N", "10"))
+ANALYTICS_BACKFILL_BATCH = int(os.getenv("ANALYTICS_BACKFILL_BATCH", "5000"))
+# Rollup counters backfill can rebuild from coin_transactions and users. The
+# others (viewer_joins, watch_seconds) come from presence flushes, which leave
+# nothing behind to rebuild from, so backfill keeps them.
+REBUILT_COUNTERS = ("coins_purchased", "revenue", "coins_spent", "coins_payout", "new_users")
+
+def day_key(day: date) -> str:
+    return f"day:{day.isoformat()}"
+
+
+class CoinRollups:
+    def __init__(self, rollups: Optional[AsyncIOMotorCollection] = None,
+                 user_totals: Optional[AsyncIOMotorCollection] = None,
+                 users: Optional[AsyncIOMotorCollection] = None,
+                 coin_price: Callable[[], float] = lambda: app_settings.coin_settings.coin_price,
+                 top_n: int = ANALYTICS_TOP_N, flush_interval: float = ANALYTICS_FLUSH_INTERVAL):
+        self._rollups = rollups
+        self._user_totals = user_totals
+        self._users = users
+        self.coin_price = coin_price
+        self.top_n = top_n
+        self.flush_interval = flush_interval
+        self._days: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(int))
+        self._users_delta: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # Rollup document deltas ("totals" included) from failed writes, applied as they are.
+        self._unflushed: Dict[str, Dict[str, float]] = {}
+        # Users whose leaderboard merge lost every retry, merged again with the next flush.
+        self._unranked: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Future] = None
+
+    # Collections are resolved lazily so the module-level instance can exist before the DB is connected.
+    @property
+    def rollups(self) -> AsyncIOMotorCollection:
+        return self._rollups if self._rollups is not None else database.collection("coin_rollups")
+
+    @property
+    def user_totals(self) -> AsyncIOMotorCollection:
+        return self._user_totals if self._user_totals is not None else database.collection("coin_user_totals")
+
+    @property
+    def users(self) -> AsyncIOMotorCollection:
+        return self._users if self._users is not None else database.collection("users")
+
+    # --- Feed ---
+    def record(self, entries: Iterable[dict]):
+        for entry in entries:
+            kind, amount = entry["type"], entry["amount"]
+            day = self._days[day_key(entry["timestamp"].date())]
+            if kind == "purchase":
+                day["coins_purchased"] += amount
+                # Purchases carry the price they were charged at; older entries do not.
+                day["revenue"] += amount * entry.get("price", self.coin_price())
+            elif kind == "gift_sent":
+                day["coins_spent"] += -amount
+                self._users_delta[entry["user_id"]]["spent"] += -amount
+            elif kind == "gift_received":
+                self._users_delta[entry["user_id"]]["earned"] += amount
+            elif kind == "payout_approved":
+                day["coins_payout"] += amount
+
+    def record_signup(self, when: Optional[datetime] = None):
+        self._days[day_key((when or datetime.utcnow()).date())]["new_users"] += 1
+
+    def record_watch(self, viewer_joins: int, watch_seconds: float, when: Optional[datetime] = None):
+        # Fed by presence flushes; avg watch time is watch_seconds / viewer_joins.
+        day = self._days[day_key((when or datetime.utcnow()).date())]
+        day["viewer_joins"] += viewer_joins
+        day["watch_seconds"] += round(watch_seconds, 3)
+
+    # --- Flush ---
+    async def flush(self):
+        days, self._days = self._days, defaultdict(lambda: defaultdict(int))
+        users_delta, self._users_delta = self._users_delta, defaultdict(lambda: defaultdict(int))
+        pending, self._unflushed = self._unflushed, {}
+        if days:
+            totals = pending.setdefault("totals", {})
+            for key, counters in days.items():
+                doc = pending.setdefault(key, {})
+                for name, value in counters.items():
+                    doc[name] = doc.get(name, 0) + value
+                    totals[name] = totals.get(name, 0) + value
+        failed = None
+        if pending:
+            keys = list(pending)
+            results = await asyncio.gather(*(self.rollups.update_one(
+                {"_id": key}, {"$inc": pending[key], "$setOnInsert": {"day": key[4:]}} if key != "totals"
+                else {"$inc": pending[key]}, upsert=True
+            ) for key in keys), return_exceptions=True)
+            for key, result in zip(keys, results):
+                if isinstance(result, Exception):
+                    failed = failed or result
+                    self._restore(key, pending[key])
+        if users_delta:
+            failed = await self._add_user_totals(users_delta, retry=True) or failed
+        changed, self._unranked = set(users_delta) | self._unranked, set()
+        if changed:
+            await self._merge_leaders(list(changed))
+        if failed is not None:
+            raise failed
+
+    def _restore(self, key: str, counters: Dict[str, float]):
+        doc = self._unflushed.setdefault(key, {})
+        for name, value in counters.items():
+            doc[name] = doc.get(name, 0) + value
+
+    async def _add_user_totals(self, users_delta: Dict[str, Dict[str, int]], retry: bool = False):
+        users = list(users_delta)
+        results = await asyncio.gather(*(
+            self.user_totals.update_one({"_id": user_id}, {"$inc": dict(users_delta[user_id])}, upsert=True)
+            for user_id in users
+        ), return_exceptions=True)
+        failed = None
+        for user_id, result in zip(users, results):
+            if isinstance(result, Exception):
+                if not retry:
+                    raise result
+                failed = failed or result
+                for name, value in users_delta[user_id].items():
+                    self._users_delta[user_id][name] += value
+        return failed
+
+    async def _merge_leaders(self, changed: List[str]):
+        # Candidates are the current leaders plus every user whose totals just moved;
+        # heapq.nlargest keeps the board at top_n. The version check stops two
+        # workers from overwriting each other's merge.
+        fresh = {doc["_id"]: doc async for doc in self.user_totals.find({"_id": {"$in": changed}})}
+        for _ in range(5):
+            leaders = await self.rollups.find_one({"_id": "leaders"}) or {"version": 0}
+            boards = {}
+            for board, field in (("top_spenders", "spent"), ("top_earners", "earned")):
+                candidates = {row["user_id"]: row for row in leaders.get(board, [])}
+                for user_id, doc in fresh.items():
+                    if doc.get(field):
+                        candidates[user_id] = {"user_id": user_id, "coins": doc[field]}
+                boards[board] = heapq.nlargest(self.top_n, candidates.values(), key=lambda row: row["coins"])
+            missing = {row["user_id"] for rows in boards.values() for row in rows if "email" not in row}
+            if missing:
+                emails = {str(doc["_id"]): doc.get("email") async for doc in
+                          self.users.find({"_id": match_user_ids(missing)}, {"email": 1})}
+                for rows in boards.values():
+                    for row in rows:
+                        row.setdefault("email", emails.get(row["user_id"]))
+            try:
+                result = await self.rollups.update_one(
+                    {"_id": "leaders", "version": leaders["version"]},
+                    {"$set": boards, "$inc": {"version": 1}},
+                    upsert=leaders["version"] == 0,
+                )
+            except DuplicateKeyError:
+                # Another worker created the board first; merge into theirs.
+                continue
+            if result.matched_count or result.upserted_id is not None:
+                return
+        print("Analytics leaderboard merge gave up after 5 conflicts; retrying with the next flush:", len(changed))
+        self._unranked.update(changed)
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            print("Analytics rollup flush failed:", str(e))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Shielded so close() cannot cut a flush off after it has taken the deltas.
+            self._flushing = asyncio.ensure_future(self._flush_logged())
+            await asyncio.shield(self._flushing)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+        await self.flush()
+
+    # --- Reads ---
+    async def summary(self) -> dict:
+        return await self.rollups.find_one({"_id": "totals"}) or {}
+
+    async def leaders(self) -> dict:
+        return await self.rollups.find_one({"_id": "leaders"}) or {}
+
+    async def days(self, last: int = 7) -> List[dict]:
+        today = datetime.utcnow().date()
+        keys = [day_key(today - timedelta(days=n)) for n in range(last - 1, -1, -1)]
+        docs = {doc["_id"]: doc async for doc in self.rollups.find({"_id": {"$in": keys}})}
+        return [docs.get(key, {"_id": key, "day": key[4:]}) for key in keys]
+
+    # --- Backfill ---
+    async def backfill(self, transactions: AsyncIOMotorCollection, users: AsyncIOMotorCollection,
+                       batch_size: int = ANALYTICS_BACKFILL_BATCH, until: Optional[datetime] = None):
+        """Rebuild the ledger and signup rollups from the full coin_transactions history.
+
+        Streams the ledger in batches, flushing after each so memory stays bounded.
+        Entries newer than ``until`` (default: now) are left to the live feed;
+        run it with writes paused to avoid counting in-flight deltas twice, and
+        after ``python -m app.core.ledger reconcile``: entries still marked
+        pending are skipped.
+        """
+        until = until or datetime.utcnow()
+        await self.rollups.delete_many({"_id": "leaders"})
+        await self.rollups.update_many({}, {"$unset": dict.fromkeys(REBUILT_COUNTERS, "")})
+        await self.user_totals.delete_many({})
+        self._days.clear()
+        self._users_delta.clear()
+        self._unflushed.clear()
+        self._unranked.clear()
+        processed = 0
+        batch = []
+        cursor = transactions.find({"timestamp": {"$lt": until}, "pending": {"$exists": False}},
+                                   {"type": 1, "amount": 1, "user_id": 1, "timestamp": 1, "price": 1})
+        async for entry in cursor.batch_size(batch_size):
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                self.record(batch)
+                await self._flush_backfill()
+                processed += len(batch)
+                batch = []
+        self.record(batch)
+        processed += len(batch)
+        undated = 0
+        async for user in users.find({}, {"_id": 1, "created_at": 1}).batch_size(batch_size):
+            if user.get("created_at") is not None:
+                self.record_signup(user["created_at"])
+            elif hasattr(user["_id"], "generation_time"):
+                self.record_signup(user["_id"].generation_time.replace(tzinfo=None))
+            else:
+                undated += 1
+        await self._flush_backfill()
+        if undated:
+            # String ids without created_at carry no signup date: counted in the totals only.
+            await self.rollups.update_one({"_id": "totals"}, {"$inc": {"new_users": undated}}, upsert=True)
+        await self._rebuild_leaders()
+        return processed
+
+    async def _flush_backfill(self):
+        # Same as flush(), minus the incremental leaderboard merge (rebuilt once at the end).
+        users_delta, self._users_delta = self._users_delta, defaultdict(lambda: defaultdict(int))
+        await self.flush()
+        if users_delta:
+            await self._add_user_totals(users_delta)
+
+    async def _rebuild_leaders(self):
+        boards = {}
+        for board, field in (("top_spenders", "spent"), ("top_earners", "earned")):
+            rows = [{"user_id": doc["_id"], "coins": doc[field]} async for doc in
+                    self.user_totals.find({field: {"$gt": 0}}).sort(field, -1).limit(self.top_n)]
+            boards[board] = rows
+        ids = [row["user_id"] for rows in boards.values() for row in rows]
+        emails = {str(doc["_id"]): doc.get("email") async for doc in
+                  self.users.find({"_id": match_user_ids(ids)}, {"email": 1})}
+        for rows in boards.values():
+            for row in rows:
+                row["email"] = emails.get(row["user_id"])
+        await self.rollups.update_one({"_id": "leaders"}, {"$set": boards, "$inc": {"version": 1}}, upsert=True)
+
+
+rollups = CoinRollups()
+
+
+async def get_rollups() -> CoinRollups:
+    return rollups
+
+
+async def _backfill_main():
+    db: AsyncIOMotorDatabase = database.get_database()
+    started = datetime.utcnow()
+    processed = await rollups.backfill(db["coin_transactions"], db["users"])
+    print(f"Rebuilt coin rollups from {processed} ledger entries in {(datetime.utcnow() - started).total_seconds():.1f}s")
+    database.close()
+
+
+if __name__ == "__main__":
+    # python -m app.core.analytics backfill
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("usage: python -m app.core.analytics backfill")
+    asyncio.run(_backfill_main())
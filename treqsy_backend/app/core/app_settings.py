@@ -0,0 +1,122 @@
+import asyncio
+import os
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pydantic import BaseModel, ConfigDict
+
+from app.core import database
+
+# Admin-editable settings, loaded once at startup and read from memory.
+# Every write bumps a version counter stored alongside the settings; each
+# worker checks that counter every SETTINGS_POLL_INTERVAL (one point read, off
+# the request path) and reloads when it moved, so a change made on one worker
+# is visible on all of them within that interval. The writing worker sees its
+# own change immediately.
+SETTINGS_POLL_INTERVAL = float(os.getenv("SETTINGS_POLL_INTERVAL", "1"))
+
+VERSION_KEY = "settings_version"
+
+
+class CoinSettings(BaseModel):
+    # Admins may store extra keys; keep them.
+    model_config = ConfigDict(extra="allow")
+
+    coin_price: float = 1
+    bonus_rate: float = 0
+
+
+class Settings(BaseModel):
+    app_name: str = "Treqsy"
+    coin_settings: CoinSettings = CoinSettings()
+
+
+class AppSettings:
+    def __init__(self, collection: Optional[AsyncIOMotorCollection] = None,
+                 poll_interval: float = SETTINGS_POLL_INTERVAL):
+        self._collection = collection
+        self.poll_interval = poll_interval
+        self.current = Settings()
+        self.version = 0
+        self.reloads = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def collection(self) -> AsyncIOMotorCollection:
+        return self._collection if self._collection is not None else database.collection("settings")
+
+    # --- Reads (memory only) ---
+    @property
+    def app_name(self) -> str:
+        return self.current.app_name
+
+    @property
+    def coin_settings(self) -> CoinSettings:
+        return self.current.coin_settings
+
+    # --- Loading ---
+    async def load(self):
+        values = {}
+        version = 0
+        async for doc in self.collection.find({}):
+            if doc["key"] == VERSION_KEY:
+                version = doc["value"]
+            elif doc["key"] in Settings.model_fields:
+                values[doc["key"]] = doc["value"]
+        self.current = Settings(**values)
+        self.version = version
+        self.reloads += 1
+
+    async def _remote_version(self) -> int:
+        doc = await self.collection.find_one({"key": VERSION_KEY})
+        return doc["value"] if doc else 0
+
+    async def refresh(self):
+        if await self._remote_version() != self.version:
+            await self.load()
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print("Settings refresh failed:", str(e))
+
+    async def start(self):
+        try:
+            await self.load()
+        except Exception as e:
+            print("Settings load failed, using defaults:", str(e))
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # --- Writes ---
+    async def set(self, key: str, value):
+        if key not in Settings.model_fields:
+            raise KeyError(key)
+        # Validate before writing so a bad value never reaches the other workers.
+        current = Settings(**{**self.current.model_dump(), key: value})
+        previous = self.version
+        await self.collection.update_one({"key": key}, {"$set": {"value": value}}, upsert=True)
+        doc = await self.collection.find_one_and_update(
+            {"key": VERSION_KEY}, {"$inc": {"value": 1}}, upsert=True, return_document=True
+        )
+        if doc["value"] == previous + 1:
+            self.current = current
+            self.version = doc["value"]
+        else:
+            # Someone else wrote in between; take the whole picture from the database.
+            await self.load()
+
+
+app_settings = AppSettings()
+
+
+async def get_app_settings() -> AppSettings:
+    return app_settings
@@ -0,0 +1,264 @@
+import asyncio
+import json
+import os
+import uuid
+from collections import defaultdict
+from typing import Callable, Optional
+
+# Chat pub/sub between workers. Every node delivers to its own viewers first and
+# hands the message to the broker, which relays it to the other nodes that have
+# viewers in the same room. /ws/events topics travel the same way, on a
+# channel prefix of their own.
+
+CHAT_BROKER_URL = os.getenv("CHAT_BROKER_URL", "")
+CHAT_CHANNEL_PREFIX = os.getenv("CHAT_CHANNEL_PREFIX", "treqsy:chat:")
+PUBLISH_BATCH_SIZE = int(os.getenv("CHAT_PUBLISH_BATCH_SIZE", "512"))
+PUBLISH_FLUSH_INTERVAL = float(os.getenv("CHAT_PUBLISH_FLUSH_INTERVAL", "0.002"))
+# Unpublished messages kept while Redis is unreachable; the oldest are dropped beyond this.
+PUBLISH_MAX_PENDING = int(os.getenv("CHAT_PUBLISH_MAX_PENDING", "10000"))
+
+Deliver = Callable[[str, str], None]
+
+
+class Broker:
+    """Interface used by ConnectionManager.
+
+    subscribe/unsubscribe/publish are called from synchronous code paths and
+    must not block; implementations apply them in the background.
+    """
+
+    node_id: str
+
+    async def start(self, deliver: Deliver):
+        raise NotImplementedError
+
+    async def stop(self):
+        raise NotImplementedError
+
+    def subscribe(self, room_id: str):
+        raise NotImplementedError
+
+    def unsubscribe(self, room_id: str):
+        raise NotImplementedError
+
+    def publish(self, room_id: str, message: str):
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """Relays between brokers that share a hub inside one process.
+
+    With the default private hub there are no peers, so a single worker pays
+    nothing beyond its local fan-out.
+    """
+
+    def __init__(self, hub: Optional[dict] = None):
+        self.node_id = uuid.uuid4().hex
+        self.hub = hub if hub is not None else defaultdict(set)
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def stop(self):
+        for peers in self.hub.values():
+            peers.discard(self)
+        self._deliver = None
+
+    def subscribe(self, room_id: str):
+        self.hub[room_id].add(self)
+
+    def unsubscribe(self, room_id: str):
+        peers = self.hub.get(room_id)
+        if peers is not None:
+            peers.discard(self)
+            if not peers:
+                del self.hub[room_id]
+
+    def publish(self, room_id: str, message: str):
+        for peer in self.hub.get(room_id, ()):
+            if peer is not self and peer._deliver is not None:
+                peer._deliver(room_id, message)
+
+
+class RedisBroker(Broker):
+    """Redis pub/sub relay, one channel per room.
+
+    Publishes are buffered and flushed as one PUBLISH per room per batch (the
+    payload carries every message queued for that room), pipelined into a
+    single round trip. A batch that fails is queued again, so a peer can see
+    a message twice if the pipeline got partway. Subscriptions follow local
+    room membership and are reconciled in the background, so a node only
+    receives rooms it serves.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        channel_prefix: str = CHAT_CHANNEL_PREFIX,
+        batch_size: int = PUBLISH_BATCH_SIZE,
+        flush_interval: float = PUBLISH_FLUSH_INTERVAL,
+        max_pending: int = PUBLISH_MAX_PENDING,
+    ):
+        self.node_id = uuid.uuid4().hex
+        self.url = url
+        self.channel_prefix = channel_prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.published = 0
+        self.dropped = 0
+        self._outbound: dict[str, list] = {}
+        self._pending = 0
+        self._wanted: set[str] = set()
+        self._subscribed: set[str] = set()
+        self._outbound_ready = asyncio.Event()
+        self._membership_changed = asyncio.Event()
+        self._has_subscriptions = asyncio.Event()
+        self._deliver: Optional[Deliver] = None
+        self._redis = None
+        self._pubsub = None
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, deliver: Deliver):
+        import redis.asyncio as redis  # optional dependency, only needed with CHAT_BROKER_URL
+
+        self._deliver = deliver
+        self._redis = redis.from_url(self.url)
+        self._pubsub = self._redis.pubsub()
+        self._tasks = [
+            asyncio.create_task(self._publish_loop()),
+            asyncio.create_task(self._membership_loop()),
+            asyncio.create_task(self._receive_loop()),
+        ]
+        if self._wanted:
+            self._membership_changed.set()
+
+    async def stop(self):
+        try:
+            await self._flush()
+        except Exception as e:
+            print("Chat broker publish error:", str(e))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
+        self._deliver = None
+
+    def subscribe(self, room_id: str):
+        self._wanted.add(room_id)
+        self._membership_changed.set()
+
+    def unsubscribe(self, room_id: str):
+        self._wanted.discard(room_id)
+        self._membership_changed.set()
+
+    def publish(self, room_id: str, message: str):
+        self._outbound.setdefault(room_id, []).append(message)
+        self._pending += 1
+        self._outbound_ready.set()
+
+    def _channel(self, room_id: str) -> str:
+        return self.channel_prefix + room_id
+
+    async def _flush(self):
+        if not self._outbound or self._redis is None:
+            return
+        outbound, self._outbound = self._outbound, {}
+        sent, self._pending = self._pending, 0
+        pipe = self._redis.pipeline(transaction=False)
+        for room_id, messages in outbound.items():
+            pipe.publish(self._channel(room_id), json.dumps([self.node_id, messages]))
+        try:
+            await pipe.execute()
+        except Exception:
+            self._requeue(outbound, sent)
+            raise
+        self.published += sent
+
+    def _requeue(self, outbound: dict, count: int):
+        # Ahead of anything published since, then trimmed to max_pending from the oldest.
+        for room_id, messages in outbound.items():
+            self._outbound[room_id] = messages + self._outbound.get(room_id, [])
+        self._pending += count
+        for messages in self._outbound.values():
+            excess = self._pending - self.max_pending
+            if excess <= 0:
+                break
+            cut = min(excess, len(messages))
+            del messages[:cut]
+            self._pending -= cut
+            self.dropped += cut
+        self._outbound = {room_id: messages for room_id, messages in self._outbound.items() if messages}
+
+    async def _publish_loop(self):
+        while True:
+            await self._outbound_ready.wait()
+            # Linger briefly so bursts leave in one pipeline, unless the batch is already full.
+            if self._pending < self.batch_size and self.flush_interval:
+                await asyncio.sleep(self.flush_interval)
+            self._outbound_ready.clear()
+            try:
+                await self._flush()
+            except Exception as e:
+                print("Chat broker publish error:", str(e))
+                await asyncio.sleep(1)
+                self._outbound_ready.set()
+
+    async def _membership_loop(self):
+        while True:
+            await self._membership_changed.wait()
+            self._membership_changed.clear()
+            added = self._wanted - self._subscribed
+            removed = self._subscribed - self._wanted
+            try:
+                if added:
+                    await self._pubsub.subscribe(*(self._channel(r) for r in added))
+                    self._subscribed |= added
+                    self._has_subscriptions.set()
+                if removed:
+                    await self._pubsub.unsubscribe(*(self._channel(r) for r in removed))
+                    self._subscribed -= removed
+            except Exception as e:
+                print("Chat broker subscription error:", str(e))
+                await asyncio.sleep(1)
+                self._membership_changed.set()
+
+    async def _receive_loop(self):
+        # The pubsub connection only exists once the first SUBSCRIBE has gone out.
+        await self._has_subscriptions.wait()
+        prefix_len = len(self.channel_prefix)
+        while True:
+            try:
+                msg = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                print("Chat broker receive error:", str(e))
+                await asyncio.sleep(1)
+                continue
+            if msg is None or msg["type"] != "message":
+                continue
+            # One bad payload, or one failing delivery, must not end the loop for every room.
+            try:
+                origin, messages = json.loads(msg["data"])
+                if origin == self.node_id:
+                    continue
+                channel = msg["channel"]
+                room_id = (channel.decode() if isinstance(channel, bytes) else channel)[prefix_len:]
+            except Exception as e:
+                print("Chat broker dropped a malformed message:", str(e))
+                continue
+            for message in messages:
+                try:
+                    self._deliver(room_id, message)
+                except Exception as e:
+                    print("Chat broker delivery error:", str(e))
+
+
+def create_broker(channel_prefix: str = CHAT_CHANNEL_PREFIX) -> Broker:
+    if CHAT_BROKER_URL:
+        return RedisBroker(CHAT_BROKER_URL, channel_prefix)
+    return InMemoryBroker()
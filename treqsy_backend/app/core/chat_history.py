@@ -0,0 +1,253 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+from app.core import database
+from app.core.responses import dumps
+
+# Chat history. Every chat message gets a sequence number and goes out as a
+# JSON frame {"seq", "text", "at"}. Each worker keeps the last
+# CHAT_HISTORY_SIZE frames of every room it has viewers in, so a joining viewer
+# is replayed recent chat from memory, and a reconnecting one (?after=<seq>)
+# gets what it missed. The worker a message was sent to also persists it,
+# write-behind: messages are buffered and saved with insert_many once
+# CHAT_PERSIST_BATCH_SIZE are pending or every CHAT_PERSIST_FLUSH_INTERVAL,
+# never on the broadcast path. The collection expires them after
+# CHAT_MESSAGE_TTL (see indexes.py).
+#
+# The database is only read in the background: for the first viewer of a room
+# on this worker, and for resumes older than the ring. Messages this worker has
+# not saved yet are merged into what the first viewer gets, since the room's
+# ring is dropped when its last viewer leaves. Frames found that way can reach
+# the client after live ones; clients order by seq.
+#
+# Sequence numbers are a hybrid clock, max(last seen + 1, now in ms << 10), and
+# relayed messages advance a room's clock, so they increase per room on every
+# worker. Two workers sequencing a message in the same room within the same
+# millisecond can produce the same number; treat seq as an ordering and resume
+# position, not a unique id.
+CHAT_HISTORY = os.getenv("CHAT_HISTORY", "1") == "1"
+CHAT_HISTORY_SIZE = int(os.getenv("CHAT_HISTORY_SIZE", "50"))
+CHAT_PERSIST_BATCH_SIZE = int(os.getenv("CHAT_PERSIST_BATCH_SIZE", "500"))
+CHAT_PERSIST_FLUSH_INTERVAL = float(os.getenv("CHAT_PERSIST_FLUSH_INTERVAL", "0.5"))
+# Unsaved messages kept while the database is unreachable; the oldest are dropped beyond this.
+CHAT_PERSIST_MAX_PENDING = int(os.getenv("CHAT_PERSIST_MAX_PENDING", "100000"))
+# Most messages replayed to a client resuming from further back than the ring.
+CHAT_RESUME_LIMIT = int(os.getenv("CHAT_RESUME_LIMIT", "200"))
+
+SEQ_PREFIX = '{"seq":'
+
+Frames = List[Tuple[int, str]]
+
+
+def encode_frame(seq: int, text: str, at_ms: int) -> str:
+    # "seq" first, so relays read it back with frame_seq() without parsing the JSON.
+    return dumps({"seq": seq, "text": text, "at": at_ms}).decode()
+
+
+def frame_seq(frame: str) -> Optional[int]:
+    if not frame.startswith(SEQ_PREFIX):
+        return None
+    return int(frame[len(SEQ_PREFIX):frame.index(",", len(SEQ_PREFIX))])
+
+
+def next_seq(last_seq: int) -> int:
+    return max(last_seq + 1, int(time.time() * 1000) << 10)
+
+
+class RoomHistory:
+    __slots__ = ("frames", "last_seq", "complete")
+
+    def __init__(self, size: int):
+        self.frames: Deque[Tuple[int, str]] = deque(maxlen=size)
+        self.last_seq = 0
+        # Whether the ring also holds what was said before this worker's first
+        # viewer joined, i.e. the room's tail has been loaded from the database.
+        self.complete = False
+
+
+class ChatHistory:
+    def __init__(self, collection: Optional[AsyncIOMotorCollection] = None, size: int = CHAT_HISTORY_SIZE,
+                 batch_size: int = CHAT_PERSIST_BATCH_SIZE, flush_interval: float = CHAT_PERSIST_FLUSH_INTERVAL,
+                 max_pending: int = CHAT_PERSIST_MAX_PENDING, enabled: bool = CHAT_HISTORY):
+        self._collection = collection
+        self.size = size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enabled = enabled
+        self.persisted = 0
+        self.dropped = 0
+        self.batches = 0
+        self.loads = 0
+        self._rooms: Dict[str, RoomHistory] = {}
+        self._pending: Deque[dict] = deque()
+        self._flushing: List[dict] = []
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def collection(self) -> AsyncIOMotorCollection:
+        return self._collection if self._collection is not None else database.collection("chat_messages")
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def forget(self, room_id: str):
+        # Called when a room's last local viewer leaves: relays for it stop
+        # arriving, so its ring would silently go stale.
+        self._rooms.pop(room_id, None)
+
+    def next_seq(self, room_id: str) -> int:
+        room = self._rooms.get(room_id)
+        return next_seq(room.last_seq if room is not None else 0)
+
+    # --- Writes ---
+    def publish(self, room_id: str, text: str) -> str:
+        """Sequences a message sent by a client of this worker and returns its frame."""
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = RoomHistory(self.size)
+        now = time.time()
+        seq = room.last_seq = next_seq(room.last_seq)
+        frame = encode_frame(seq, text, int(now * 1000))
+        if not self.enabled:
+            return frame
+        room.frames.append((seq, frame))
+        self._pending.append({"room_id": room_id, "seq": seq, "text": text, "at": datetime.utcfromtimestamp(now)})
+        if len(self._pending) > self.max_pending:
+            self._pending.popleft()
+            self.dropped += 1
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+        return frame
+
+    def relayed(self, room_id: str, frame: str):
+        """Records a frame sequenced, and persisted, by another worker."""
+        room = self._rooms.get(room_id)
+        seq = frame_seq(frame)
+        if room is None or seq is None or not self.enabled:
+            return
+        if seq > room.last_seq:
+            room.last_seq = seq
+        room.frames.append((seq, frame))
+
+    # --- Replay ---
+    def replay(self, room_id: str, after: Optional[int] = None) -> Tuple[Frames, bool]:
+        """Frames a joining client gets first, from memory, and whether older
+        ones may only be in the database."""
+        if not self.enabled:
+            return [], False
+        room = self._rooms.get(room_id)
+        if room is None:
+            self._rooms[room_id] = RoomHistory(self.size)
+            return [], True
+        full = len(room.frames) == self.size
+        if after is None:
+            return list(room.frames), not (room.complete or full)
+        if after >= room.last_seq and room.complete:
+            return [], False
+        frames = [item for item in room.frames if item[0] > after]
+        return frames, (not room.complete or full) and (not room.frames or after < room.frames[0][0])
+
+    async def recent(self, room_id: str) -> Frames:
+        """The room's last messages from the database; concurrent callers share one query."""
+        future = self._loading.get(room_id)
+        if future is None:
+            future = self._loading[room_id] = asyncio.ensure_future(self._load_recent(room_id))
+            future.add_done_callback(lambda _: self._loading.pop(room_id, None))
+        return await asyncio.shield(future)
+
+    async def _load_recent(self, room_id: str) -> Frames:
+        # Taken before the query: whatever is saved in the meantime is in its result.
+        unsaved = [doc for doc in (*self._flushing, *self._pending) if doc["room_id"] == room_id]
+        docs = await self.collection.find({"room_id": room_id}).sort("seq", DESCENDING) \
+            .limit(self.size).to_list(None)
+        self.loads += 1
+        if unsaved:
+            docs = sorted({doc["seq"]: doc for doc in (*docs, *unsaved)}.values(),
+                          key=lambda doc: doc["seq"], reverse=True)[:self.size]
+        frames = [self._frame(doc) for doc in reversed(docs)]
+        room = self._rooms.get(room_id)
+        if room is not None:
+            # Merge with what arrived live while the query ran.
+            merged = dict(frames)
+            merged.update(room.frames)
+            room.frames.clear()
+            room.frames.extend(sorted(merged.items())[-self.size:])
+            if room.frames:
+                room.last_seq = max(room.last_seq, room.frames[-1][0])
+            room.complete = True
+        return frames
+
+    async def since(self, room_id: str, after: int, limit: int = CHAT_RESUME_LIMIT) -> Frames:
+        docs = await self.collection.find({"room_id": room_id, "seq": {"$gt": after}}) \
+            .sort("seq", ASCENDING).limit(limit).to_list(None)
+        self.loads += 1
+        return [self._frame(doc) for doc in docs]
+
+    @staticmethod
+    def _frame(doc: dict) -> Tuple[int, str]:
+        return doc["seq"], encode_frame(doc["seq"], doc["text"], int(doc["at"].timestamp() * 1000))
+
+    # --- Write-behind ---
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._pending:
+            # Taken off the queue while in flight, so publish() trimming it to
+            # max_pending cannot shift what this batch covers.
+            batch = self._flushing = [self._pending.popleft() for _ in range(min(len(self._pending), self.batch_size))]
+            saved = len(batch)
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Duplicates are messages a failed earlier attempt saved after all;
+                # anything else is about the document itself and would fail again.
+                rejected = [error for error in e.details["writeErrors"] if error["code"] != 11000]
+                if rejected:
+                    print("Chat history messages dropped:", len(rejected), rejected[0].get("errmsg"))
+                    self.dropped += len(rejected)
+                    saved -= len(rejected)
+            except Exception as e:
+                # They go back to the front of the queue for the next flush, up to max_pending.
+                print("Chat history flush failed:", str(e))
+                self._pending.extendleft(reversed(batch))
+                while len(self._pending) > self.max_pending:
+                    self._pending.popleft()
+                    self.dropped += 1
+                return
+            finally:
+                self._flushing = []
+            self.persisted += saved
+            self.batches += 1
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
@@ -0,0 +1,120 @@
+import os
+from typing import Dict, Optional
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+
+from app.core.metrics import METRICS_ENABLED, command_metrics
+
+load_dotenv()
+
+# One Motor client (and so one connection pool) per worker process, opened and
+# closed by the FastAPI lifespan in app.main.
+MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+MONGO_DB_NAME = os.getenv("MONGODB_DB", "treqsy")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+# Comma separated, e.g. "zstd,snappy,zlib"; zstd and snappy need their optional packages.
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+
+_client: Optional[AsyncIOMotorClient] = None
+_collections: Dict[str, AsyncIOMotorCollection] = {}
+
+
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "appname": "treqsy-backend",
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    if METRICS_ENABLED:
+        options["event_listeners"] = [command_metrics]
+    return options
+
+
+def connect(uri: str = MONGO_URI, **overrides) -> AsyncIOMotorClient:
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(uri, **{**client_options(), **overrides})
+    return _client
+
+
+def close():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+        _collections.clear()
+
+
+def get_client() -> AsyncIOMotorClient:
+    # Scripts that skip the lifespan still get the shared pool.
+    return _client or connect()
+
+
+def get_database() -> AsyncIOMotorDatabase:
+    return get_client()[MONGO_DB_NAME]
+
+
+def collection(name: str) -> AsyncIOMotorCollection:
+    coll = _collections.get(name)
+    if coll is None:
+        coll = _collections[name] = get_database()[name]
+    return coll
+
+
+async def ping() -> bool:
+    try:
+        await get_client().admin.command("ping")
+        return True
+    except Exception as e:
+        print("Database readiness check failed:", str(e))
+        return False
+
+
+# --- User ids ---
+# Users registered through /auth/register have ObjectId ids; ones created by
+# the seeder or load tests have strings. Requests, tokens and ledger entries
+# carry ids as strings, so user queries match either form.
+def match_user_id(user_id):
+    if isinstance(user_id, str) and ObjectId.is_valid(user_id):
+        return {"$in": [ObjectId(user_id), user_id]}
+    return user_id
+
+
+def match_user_ids(user_ids) -> dict:
+    ids = []
+    for user_id in user_ids:
+        ids.append(user_id)
+        if isinstance(user_id, str) and ObjectId.is_valid(user_id):
+            ids.append(ObjectId(user_id))
+    return {"$in": ids}
+
+
+# --- Router dependencies ---
+# Declared async so FastAPI resolves them inline instead of in the threadpool.
+async def get_users_collection() -> AsyncIOMotorCollection:
+    return collection("users")
+
+async def get_streams_collection() -> AsyncIOMotorCollection:
+    return collection("streams")
+
+async def get_settings_collection() -> AsyncIOMotorCollection:
+    return collection("settings")
+
+async def get_coin_transactions_collection() -> AsyncIOMotorCollection:
+    return collection("coin_transactions")
+
+async def get_payout_requests_collection() -> AsyncIOMotorCollection:
+    return collection("payout_requests")
@@ -1,32 +1,55 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from typing import List
-from app.core.security import decode_access_token
-from app.models.user import Role, User
+from typing import List, Optional
+from app.core.security import decode_access_token, token_cache
+from app.models.user import Principal, Role
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+def _invalid_token() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def principal_from_token(token: str) -> Optional[Principal]:
+    # The token cache means the signature is only verified once per token.
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
     payload = decode_access_token(token)
     if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        return None
+    try:
+        role = Role(payload.get("role", Role.USER))
+    except ValueError:
+        return None
     # In a real app, you might want to fetch the user from the DB
     # to ensure they still exist and are active.
     # For now, we'll trust the token payload.
-    return User(id=payload.get("sub"), email=payload.get("email"), role=payload.get("role"), hashed_password="")
+    principal = Principal(id=payload.get("sub"), email=payload.get("email"), role=role,
+                          expires_at=payload.get("exp"))
+    if "exp" in payload:
+        token_cache.put(token, principal, payload["exp"])
+    return principal
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
+    # FastAPI resolves this once per request however many RoleCheckers depend on it.
+    principal = principal_from_token(token)
+    if principal is None:
+        raise _invalid_token()
+    return principal
 
 class RoleChecker:
     def __init__(self, allowed_roles: List[Role]):
-        self.allowed_roles = allowed_roles
+        self.allowed_roles = frozenset(allowed_roles)
 
-    def __call__(self, user: User = Depends(get_current_user)):
+    # async so FastAPI calls it inline rather than through the threadpool
+    async def __call__(self, user: Principal = Depends(get_current_user)):
         if user.role not in self.allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You do not have permission to access this resource",
             )
-        return user 
\ No newline at end of file
+        return user
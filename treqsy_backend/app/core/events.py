@@ -0,0 +1,191 @@
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from starlette.websockets import WebSocket
+
+from app.core.broker import Broker, InMemoryBroker, create_broker
+from app.core.fanout import WS_TRY_AGAIN_LATER, Connection, encode_text_frame
+from app.core.heartbeat import WS_IDLE_CLOSE, WS_TOKEN_EXPIRED, Heartbeat
+from app.core.metrics import WS_EVICTIONS, Gauge, registry
+from app.core.responses import dumps
+from app.models.coin_transaction import DEBIT_TYPES
+from app.models.user import Principal, Role
+
+# Server-pushed events on /ws/events, in place of polling /streams/active and
+# /admin/coins/balance. A socket subscribes to topics and is sent compact
+# deltas as they happen:
+#
+#   streams            {"topic":"streams","event":"started","stream":{...}}
+#                      {"topic":"streams","event":"ended","_id":"..."}
+#   wallet:<user_id>   {"topic":"wallet:<id>","delta":-50,"count":1}
+#
+# "wallet" subscribes to the caller's own wallet; admins may name any user's.
+# Deltas are net balance changes per ledger commit, so a client fetches the
+# full state once, after subscribing, and applies deltas from then on.
+#
+# Topics are relayed between workers by the same broker as chat rooms, on
+# their own channel prefix, and each socket gets one bounded send queue and
+# the same heartbeat as a chat viewer. A socket opened with a token is closed
+# with WS_TOKEN_EXPIRED by the first heartbeat sweep after the token's exp.
+EVENTS_CHANNEL_PREFIX = os.getenv("EVENTS_CHANNEL_PREFIX", "treqsy:events:")
+# Topics one socket may hold at once.
+EVENTS_MAX_TOPICS = int(os.getenv("EVENTS_MAX_TOPICS", "16"))
+
+STREAMS_TOPIC = "streams"
+WALLET_TOPIC = "wallet"
+WALLET_ADMINS = frozenset((Role.ADMIN, Role.MASTER_ADMIN))
+
+
+class TopicError(ValueError):
+    pass
+
+
+def wallet_topic(user_id: str) -> str:
+    return f"{WALLET_TOPIC}:{user_id}"
+
+
+def resolve_topic(name: str, principal: Optional[Principal]) -> str:
+    """The topic a client asked for, as the hub names it; raises TopicError if it may not have it."""
+    if name == STREAMS_TOPIC:
+        return name
+    if name == WALLET_TOPIC or name.startswith(WALLET_TOPIC + ":"):
+        if principal is None:
+            raise TopicError("Sign in to follow a wallet")
+        user_id = name[len(WALLET_TOPIC) + 1:] or principal.id
+        if user_id != principal.id and principal.role not in WALLET_ADMINS:
+            raise TopicError("Not allowed to follow this wallet")
+        return wallet_topic(user_id)
+    raise TopicError(f"Unknown topic: {name}")
+
+
+class EventHub:
+    def __init__(self, broker: Optional[Broker] = None, max_topics: int = EVENTS_MAX_TOPICS, **connection_options):
+        # topic -> {websocket: Connection}; a socket's one Connection is shared by all its topics.
+        self.topics: Dict[str, Dict[WebSocket, Connection]] = {}
+        self.broker = broker or InMemoryBroker()
+        self.max_topics = max_topics
+        self.connection_options = connection_options
+        self.published = 0
+        self._connections: Dict[WebSocket, Connection] = {}
+        self._subscriptions: Dict[WebSocket, Set[str]] = {}
+        self.heartbeat = Heartbeat(self._connections.values, self._idle, on_expired=self._expired)
+
+    async def start(self):
+        await self.broker.start(self._fan_out)
+        self.heartbeat.start()
+
+    async def stop(self):
+        self.heartbeat.close()
+        await self.broker.stop()
+
+    # --- Sockets ---
+    async def connect(self, websocket: WebSocket, expires_at: Optional[float] = None) -> Connection:
+        await websocket.accept()
+        connection = self._connections[websocket] = Connection(websocket, "events", self._drop,
+                                                               **self.connection_options)
+        connection.expires_at = expires_at
+        self._subscriptions[websocket] = set()
+        return connection
+
+    def disconnect(self, websocket: WebSocket, code: Optional[int] = None):
+        connection = self._connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.close(code)
+        for topic in self._subscriptions.pop(websocket, ()):
+            self._leave(websocket, topic)
+
+    def _drop(self, connection: Connection):
+        self.disconnect(connection.websocket)
+
+    def _idle(self, connection: Connection):
+        self.disconnect(connection.websocket, WS_IDLE_CLOSE)
+
+    def _expired(self, connection: Connection):
+        self.disconnect(connection.websocket, WS_TOKEN_EXPIRED)
+
+    def subscribe(self, websocket: WebSocket, topic: str):
+        subscriptions = self._subscriptions[websocket]
+        if topic in subscriptions:
+            return
+        if len(subscriptions) >= self.max_topics:
+            raise TopicError(f"At most {self.max_topics} topics per connection")
+        subscriptions.add(topic)
+        subscribers = self.topics.get(topic)
+        if subscribers is None:
+            subscribers = self.topics[topic] = {}
+            self.broker.subscribe(topic)
+        subscribers[websocket] = self._connections[websocket]
+
+    def unsubscribe(self, websocket: WebSocket, topic: str):
+        subscriptions = self._subscriptions.get(websocket)
+        if subscriptions is not None and topic in subscriptions:
+            subscriptions.discard(topic)
+            self._leave(websocket, topic)
+
+    def _leave(self, websocket: WebSocket, topic: str):
+        subscribers = self.topics.get(topic)
+        if subscribers is None:
+            return
+        subscribers.pop(websocket, None)
+        if not subscribers:
+            del self.topics[topic]
+            self.broker.unsubscribe(topic)
+
+    def send(self, websocket: WebSocket, message: dict):
+        # Replies to one socket (acks, errors), queued behind its events.
+        connection = self._connections.get(websocket)
+        if connection is not None:
+            connection.offer(encode_text_frame(dumps(message).decode()))
+
+    def subscriber_count(self, topic: str) -> int:
+        return len(self.topics.get(topic, ()))
+
+    def connection_count(self) -> int:
+        return len(self._connections)
+
+    # --- Publishing ---
+    def publish(self, topic: str, event: dict):
+        message = dumps(event).decode()
+        self.published += 1
+        self._fan_out(topic, message)
+        self.broker.publish(topic, message)
+
+    def _fan_out(self, topic: str, message: str):
+        # Local delivery only; called for our own events and for ones relayed by the broker.
+        subscribers = self.topics.get(topic)
+        if not subscribers:
+            return
+        frame = encode_text_frame(message)
+        slow = [connection for connection in subscribers.values() if not connection.offer(frame)]
+        for connection in slow:
+            self.disconnect(connection.websocket, WS_TRY_AGAIN_LATER)
+        if slow:
+            WS_EVICTIONS.inc(amount=len(slow))
+
+    def stream_started(self, session: dict):
+        stream = {key: session.get(key) for key in ("_id", "host_email", "title", "start_time")}
+        self.publish(STREAMS_TOPIC, {"topic": STREAMS_TOPIC, "event": "started", "stream": stream})
+
+    def stream_ended(self, stream_id: str):
+        self.publish(STREAMS_TOPIC, {"topic": STREAMS_TOPIC, "event": "ended", "_id": stream_id})
+
+    def ledger_committed(self, entries: Iterable[dict]):
+        # One event per wallet per commit, however many entries touched it.
+        deltas: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        for entry in entries:
+            amount = entry["amount"]
+            delta = deltas[entry["user_id"]]
+            delta[0] += -amount if entry["type"] in DEBIT_TYPES else amount
+            delta[1] += 1
+        for user_id, (delta, count) in deltas.items():
+            topic = wallet_topic(user_id)
+            self.publish(topic, {"topic": topic, "delta": delta, "count": count})
+
+
+events = EventHub(create_broker(EVENTS_CHANNEL_PREFIX))
+registry.register(Gauge("events_connections", "Open /ws/events sockets on this worker.",
+                        collect=lambda: [((), events.connection_count())]))
+registry.register(Gauge("events_topics", "Event topics with at least one subscriber on this worker.",
+                        collect=lambda: [((), len(events.topics))]))
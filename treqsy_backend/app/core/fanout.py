@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+from collections import deque
+from enum import Enum
+from typing import Callable, Optional
+
+from starlette.websockets import WebSocket
+
+
+class SlowConsumerPolicy(str, Enum):
+    DROP_OLDEST = "drop_oldest"
+    DISCONNECT = "disconnect"
+
+
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+SLOW_CONSUMER_POLICY = SlowConsumerPolicy(os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest"))
+
+# Close code sent to viewers evicted under the DISCONNECT policy.
+WS_TRY_AGAIN_LATER = 1013
+
+
+def encode_text_frame(message: str) -> dict:
+    # The ASGI send event is built once per broadcast and shared by every writer.
+    return {"type": "websocket.send", "text": message}
+
+
+class Connection:
+    """A viewer socket with its own bounded send queue and writer task.
+
+    Broadcasts only append to the queue, so a slow socket never holds up the
+    rest of the room; the writer drains it in the background. Slotted: a
+    worker holds one per open socket.
+    """
+
+    __slots__ = ("websocket", "room_id", "queue_size", "policy", "queue", "dropped", "closed", "last_seen",
+                 "expires_at", "_on_error", "_waiter", "_writer")
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        room_id: str,
+        on_error: Callable[["Connection"], None],
+        queue_size: int = SEND_QUEUE_SIZE,
+        policy: SlowConsumerPolicy = SLOW_CONSUMER_POLICY,
+    ):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.queue_size = queue_size
+        self.policy = policy
+        self.queue = deque()
+        self.dropped = 0
+        self.closed = False
+        # When the client last sent anything; the heartbeat pings and reaps on this.
+        self.last_seen = time.monotonic()
+        # Epoch seconds after which the heartbeat closes it (the access token's exp), if any.
+        self.expires_at: Optional[float] = None
+        self._on_error = on_error
+        self._waiter = None
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def offer(self, frame: dict) -> bool:
+        # Returns False when the connection should be evicted as a slow consumer.
+        if len(self.queue) >= self.queue_size:
+            if self.policy is SlowConsumerPolicy.DISCONNECT:
+                return False
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(frame)
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            self._waiter = None
+            waiter.set_result(None)
+        return True
+
+    def seen(self):
+        self.last_seen = time.monotonic()
+
+    def close(self, code: Optional[int] = None):
+        # With a code the socket is closed too (evictions, idle reaping); without,
+        # it is already gone or its endpoint closes it.
+        self.closed = True
+        self.queue.clear()
+        self._writer.cancel()
+        if code is not None:
+            # Once the writer has stopped, so a close frame never cuts into a send.
+            # (A writer cancelled before it first ran never reaches its own handlers.)
+            self._writer.add_done_callback(lambda _: asyncio.ensure_future(self._close_socket(code)))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _write_loop(self):
+        send = self.websocket.send
+        queue = self.queue
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                while queue:
+                    await send(queue.popleft())
+                # Park on a bare future rather than an Event; waking it is a single call.
+                self._waiter = loop.create_future()
+                await self._waiter
+        except Exception:
+            # The socket went away mid-write; let the manager forget it.
+            self._on_error(self)
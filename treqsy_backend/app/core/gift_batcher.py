@@ -0,0 +1,343 @@
+import asyncio
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.core import database
+from app.core.database import match_user_id, match_user_ids
+from app.core.ledger import AccountNotFound, InsufficientFunds, InvalidAmount, Ledger, get_ledger
+from app.models.coin_transaction import CoinTransaction
+
+# Live-stream gifts arrive in bursts, mostly to the same host. Instead of four
+# writes per gift, each gift costs one guarded debit on the sender, which also
+# records the gift as a pending marker on the sender document. Gifts are then
+# coalesced per (stream, recipient) over a short window and flushed as one $inc
+# per recipient plus one insert_many of ledger entries; senders get their
+# response once the flush that carries their gift has landed.
+#
+# Crash safety: a flush first journals its batch id and gift ids in
+# gift_batches, credits each recipient only if the recipient does not already
+# carry that batch id, then clears the sender markers and finally the batch id
+# tags. Every step is idempotent for the worker running it, so markers left
+# behind by a crashed worker are replayed by recover(). Two workers replaying
+# one batch at once could still interleave and credit it twice, so a journal
+# carries a lease (lease_until, GIFT_RECOVERY_GRACE from when it was written):
+# recover() only replays a journal whose lease has run out, after taking the
+# lease over atomically, and skips it when another worker got there first.
+# Markers no journal lists are first claimed one by one for a new, leased batch
+# (tagged with its id), so two workers recovering at once never flush the same
+# gift under two batch ids.
+#
+# A gift whose flush keeps failing has already left the sender and will be
+# completed by recovery, so gift() reports it as pending rather than failed.
+GIFT_BATCHING = os.getenv("GIFT_BATCHING", "1") == "1"
+GIFT_BATCH_WINDOW = float(os.getenv("GIFT_BATCH_WINDOW", "0.05"))
+GIFT_BATCH_SIZE = int(os.getenv("GIFT_BATCH_SIZE", "1000"))
+GIFT_FLUSH_RETRIES = int(os.getenv("GIFT_FLUSH_RETRIES", "3"))
+# Pending gifts older than this are considered abandoned and replayed.
+GIFT_RECOVERY_GRACE = float(os.getenv("GIFT_RECOVERY_GRACE", "60"))
+
+
+class PendingGift(NamedTuple):
+    gift_id: str
+    from_user: str
+    to_user: str
+    amount: int
+    stream_id: Optional[str]
+    future: Optional[asyncio.Future] = None
+
+
+def _ledger_entries(gift: PendingGift) -> List[dict]:
+    # Deterministic _ids make re-inserting a replayed batch harmless.
+    now = datetime.utcnow()
+    where = f" in {gift.stream_id}" if gift.stream_id else ""
+    sent = CoinTransaction(user_id=gift.from_user, type="gift_sent", amount=-gift.amount, timestamp=now,
+                           details=f"to {gift.to_user}{where}").dict()
+    received = CoinTransaction(user_id=gift.to_user, type="gift_received", amount=gift.amount, timestamp=now,
+                               details=f"from {gift.from_user}{where}").dict()
+    sent["_id"] = f"{gift.gift_id}:sent"
+    received["_id"] = f"{gift.gift_id}:received"
+    return [sent, received]
+
+
+class GiftBatcher:
+    def __init__(self, ledger: Ledger, batches: AsyncIOMotorCollection, window: float = GIFT_BATCH_WINDOW,
+                 batch_size: int = GIFT_BATCH_SIZE, recovery_grace: float = GIFT_RECOVERY_GRACE):
+        self.ledger = ledger
+        self.users = ledger.users
+        self.transactions = ledger.transactions
+        self.batches = batches
+        self.window = window
+        self.batch_size = batch_size
+        self.recovery_grace = recovery_grace
+        self.db_ops = 0
+        self.flushes = 0
+        self.gifts = 0
+        self._pending: Dict[Tuple[Optional[str], str], List[PendingGift]] = defaultdict(list)
+        self._count = 0
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._flusher: Optional[asyncio.Task] = None
+        self._recovery: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._recovery is None:
+            self._recovery = asyncio.create_task(self._recovery_loop())
+
+    async def gift(self, from_user: str, to_user: str, amount: int, stream_id: Optional[str] = None,
+                   idempotency_key: Optional[str] = None) -> bool:
+        """True once the gift has been delivered; False if it is pending recovery."""
+        if amount <= 0:
+            raise InvalidAmount("Amount must be positive")
+        if from_user == to_user:
+            raise InvalidAmount("Cannot gift coins to yourself")
+        await self.ledger._claim(idempotency_key, "gift")
+        gift_id = idempotency_key or uuid.uuid4().hex
+        marker = {"id": gift_id, "to": to_user, "amount": amount, "stream": stream_id, "at": datetime.utcnow()}
+        result = await self.users.update_one(
+            {"_id": match_user_id(from_user), "coins": {"$gte": amount}},
+            {"$inc": {"coins": -amount}, "$push": {"pending_gifts": marker}},
+        )
+        self.db_ops += 1
+        if result.matched_count == 0:
+            await self.ledger._release(idempotency_key)
+            if await self.users.count_documents({"_id": match_user_id(from_user)}, limit=1):
+                raise InsufficientFunds("Insufficient coins")
+            raise AccountNotFound("User not found")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[(stream_id, to_user)].append(
+            PendingGift(gift_id, from_user, to_user, amount, stream_id, future)
+        )
+        self._count += 1
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        self._wake.set()
+        return await future
+
+    async def _flush_loop(self):
+        while True:
+            await self._wake.wait()
+            if self._count < self.batch_size and self.window and not self._closing:
+                await asyncio.sleep(self.window)
+            self._wake.clear()
+            await self.flush_pending()
+            if self._closing:
+                return
+
+    async def flush_pending(self):
+        while self._count:
+            gifts: List[PendingGift] = []
+            while self._pending and len(gifts) < self.batch_size:
+                gifts.extend(self._pending.pop(next(iter(self._pending))))
+            self._count -= len(gifts)
+            await self._flush_with_retry(gifts)
+
+    async def _flush_with_retry(self, gifts: List[PendingGift]):
+        batch_id = uuid.uuid4().hex
+        for attempt in range(GIFT_FLUSH_RETRIES):
+            try:
+                missing = await self._flush(gifts, batch_id)
+                break
+            except Exception as e:
+                print("Gift batch flush failed:", str(e))
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        else:
+            # The markers stay on the senders; recover() will finish the batch.
+            for gift in gifts:
+                if gift.future is not None and not gift.future.done():
+                    gift.future.set_result(False)
+            return
+        for gift in gifts:
+            if gift.future is None or gift.future.done():
+                continue
+            if gift.to_user in missing:
+                gift.future.set_exception(AccountNotFound("Recipient not found"))
+            else:
+                gift.future.set_result(True)
+
+    async def _flush(self, gifts: List[PendingGift], batch_id: str) -> set:
+        totals: Dict[str, int] = defaultdict(int)
+        for gift in gifts:
+            totals[gift.to_user] += gift.amount
+        gift_ids = [gift.gift_id for gift in gifts]
+        senders = list({gift.from_user for gift in gifts})
+
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=self.recovery_grace)
+        try:
+            await self.batches.insert_one({
+                "_id": batch_id, "gift_ids": gift_ids, "recipients": list(totals), "created_at": now,
+                "lease_until": lease_until,
+            })
+        except DuplicateKeyError:
+            # A retry, or a replay under a lease just taken: keep the journal leased to us.
+            await self.batches.update_one({"_id": batch_id}, {"$set": {"lease_until": lease_until}})
+        self.db_ops += 1
+
+        credits = await asyncio.gather(*(
+            self.users.update_one(
+                {"_id": match_user_id(user_id), "gift_batches": {"$ne": batch_id}},
+                {"$inc": {"coins": total}, "$push": {"gift_batches": batch_id}},
+            )
+            for user_id, total in totals.items()
+        ))
+        self.db_ops += len(credits)
+        missing = set()
+        for user_id, result in zip(totals, credits):
+            # No match means either already credited by an earlier attempt or no such user.
+            if result.matched_count == 0 and not await self.users.count_documents({"_id": match_user_id(user_id)}, limit=1):
+                missing.add(user_id)
+        for gift in gifts:
+            if gift.to_user in missing:
+                await self.users.update_one(
+                    {"_id": match_user_id(gift.from_user), "pending_gifts.id": gift.gift_id},
+                    {"$inc": {"coins": gift.amount}, "$pull": {"pending_gifts": {"id": gift.gift_id}}},
+                )
+                self.db_ops += 1
+
+        entries = [entry for gift in gifts if gift.to_user not in missing for entry in _ledger_entries(gift)]
+        if entries:
+            try:
+                await self.transactions.insert_many(entries, ordered=False)
+                inserted = entries
+            except BulkWriteError as e:
+                if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                    raise
+                # Entries already written by an earlier attempt were already reported.
+                duplicates = {err["index"] for err in e.details["writeErrors"]}
+                inserted = [entry for i, entry in enumerate(entries) if i not in duplicates]
+            self.db_ops += 1
+            if inserted:
+                self.ledger._committed(inserted)
+
+        await self.users.update_many(
+            {"_id": match_user_ids(senders)}, {"$pull": {"pending_gifts": {"id": {"$in": gift_ids}}}}
+        )
+        await self.users.update_many({"_id": match_user_ids(totals)}, {"$pull": {"gift_batches": batch_id}})
+        await self.batches.delete_one({"_id": batch_id})
+        self.db_ops += 3
+        self.flushes += 1
+        self.gifts += len(gifts)
+        return missing
+
+    # --- Recovery ---
+    async def _markers(self, query: dict, wanted=None, cutoff: Optional[datetime] = None,
+                       batch_id: Optional[str] = None) -> List[PendingGift]:
+        # Only markers claimed by batch_id, or by no batch when it is None.
+        gifts = []
+        async for doc in self.users.find(query, {"pending_gifts": 1}):
+            for marker in doc.get("pending_gifts", []):
+                if wanted is not None and marker["id"] not in wanted:
+                    continue
+                if cutoff is not None and marker["at"] >= cutoff:
+                    continue
+                if marker.get("batch") != batch_id:
+                    continue
+                gifts.append(PendingGift(marker["id"], str(doc["_id"]), marker["to"], marker["amount"], marker.get("stream")))
+        return gifts
+
+    async def _lease(self, journal: dict) -> bool:
+        """Takes over an abandoned journal's lease; False if it is live, or another worker took it."""
+        now = datetime.utcnow()
+        claimed = await self.batches.find_one_and_update(
+            {"_id": journal["_id"], "$or": [
+                {"lease_until": {"$lt": now}},
+                {"lease_until": {"$exists": False}, "created_at": {"$lt": now - timedelta(seconds=self.recovery_grace)}},
+            ]},
+            {"$set": {"lease_until": now + timedelta(seconds=self.recovery_grace)}},
+        )
+        return claimed is not None
+
+    async def recover(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.recovery_grace)
+        journaled = set()
+        async for journal in self.batches.find({}):
+            journaled.update(journal["gift_ids"])
+            if not await self._lease(journal):
+                continue
+            wanted = set(journal["gift_ids"])
+            claimed = journal["_id"] if journal.get("claimed") else None
+            gifts = await self._markers({"pending_gifts.id": {"$in": journal["gift_ids"]}}, wanted, batch_id=claimed)
+            if gifts:
+                await self._flush(gifts, journal["_id"])
+            else:
+                await self.users.update_many(
+                    {"_id": match_user_ids(journal["recipients"])}, {"$pull": {"gift_batches": journal["_id"]}}
+                )
+                await self.batches.delete_one({"_id": journal["_id"]})
+        gifts = [
+            gift for gift in await self._markers({"pending_gifts.at": {"$lt": cutoff}}, cutoff=cutoff)
+            if gift.gift_id not in journaled
+        ]
+        recovered = 0
+        for start in range(0, len(gifts), self.batch_size):
+            recovered += await self._recover_unjournaled(gifts[start:start + self.batch_size])
+        if recovered:
+            print(f"Recovered {recovered} pending gifts")
+
+    async def _recover_unjournaled(self, gifts: List[PendingGift]) -> int:
+        # Journal first, so a crash after claiming leaves the claimed markers findable.
+        batch_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        await self.batches.insert_one({
+            "_id": batch_id, "gift_ids": [gift.gift_id for gift in gifts],
+            "recipients": list({gift.to_user for gift in gifts}), "created_at": now, "claimed": True,
+            "lease_until": now + timedelta(seconds=self.recovery_grace),
+        })
+        claimed = []
+        for gift in gifts:
+            result = await self.users.update_one(
+                {"_id": match_user_id(gift.from_user),
+                 "pending_gifts": {"$elemMatch": {"id": gift.gift_id, "batch": {"$exists": False}}}},
+                {"$set": {"pending_gifts.$.batch": batch_id}},
+            )
+            if result.modified_count:
+                claimed.append(gift)
+        if claimed:
+            await self._flush(claimed, batch_id)
+        else:
+            await self.batches.delete_one({"_id": batch_id})
+        return len(claimed)
+
+    async def _recovery_loop(self):
+        while True:
+            try:
+                await self.recover()
+            except Exception as e:
+                print("Gift recovery failed:", str(e))
+            await asyncio.sleep(self.recovery_grace)
+
+    async def close(self):
+        if self._recovery is not None:
+            self._recovery.cancel()
+            self._recovery = None
+        # Let an in-progress flush finish rather than cutting it off mid-batch.
+        self._closing = True
+        if self._flusher is not None and not self._flusher.done():
+            self._wake.set()
+            await self._flusher
+        await self.flush_pending()
+
+
+_batcher: Optional[GiftBatcher] = None
+
+
+async def get_gift_batcher() -> GiftBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = GiftBatcher(await get_ledger(), database.collection("gift_batches"))
+        _batcher.start()
+    return _batcher
+
+
+async def close_gift_batcher():
+    global _batcher
+    if _batcher is not None:
+        await _batcher.close()
+        _batcher = None
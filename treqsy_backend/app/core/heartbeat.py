@@ -0,0 +1,98 @@
+import asyncio
+import os
+import time
+from typing import Callable, Iterable, Optional
+
+from app.core.fanout import Connection, encode_text_frame
+from app.core.metrics import WS_IDLE_CLOSED
+
+# Application-level heartbeats for the chat and event sockets. Every
+# WS_HEARTBEAT_INTERVAL a sweep sends {"op":"ping"} to each socket that has
+# sent nothing for that long; clients answer {"op":"pong"} (any message
+# counts). Sockets silent for WS_IDLE_TIMEOUT are closed with WS_IDLE_CLOSE
+# and forgotten, which is what catches half-open connections whose sends
+# still succeed into a dead TCP buffer, and clients that hang around without
+# reading. uvicorn's protocol pings (--ws-ping-interval, websockets
+# implementation only) close dead sockets too, but never reach the app.
+#
+# The same sweep closes sockets whose access token has expired (a Connection
+# with expires_at set) with WS_TOKEN_EXPIRED, when given an on_expired handler.
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "25"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "75"))
+# Connections checked between yields to the loop, so a sweep over a large
+# registry never stalls broadcasts.
+WS_HEARTBEAT_SLICE = int(os.getenv("WS_HEARTBEAT_SLICE", "5000"))
+
+PING = '{"op":"ping"}'
+PONG = '{"op":"pong"}'
+PING_FRAME = encode_text_frame(PING)
+
+# Close code for sockets reaped as idle (4000-4999 are for applications).
+WS_IDLE_CLOSE = 4000
+# Close code for sockets whose access token expired; the client reconnects with a fresh one.
+WS_TOKEN_EXPIRED = 4001
+
+
+class Heartbeat:
+    def __init__(self, connections: Callable[[], Iterable[Connection]], on_idle: Callable[[Connection], None],
+                 interval: float = WS_HEARTBEAT_INTERVAL, idle_timeout: float = WS_IDLE_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic,
+                 on_expired: Optional[Callable[[Connection], None]] = None,
+                 wall_clock: Callable[[], float] = time.time):
+        self.connections = connections
+        self.on_idle = on_idle
+        self.on_expired = on_expired
+        self.wall_clock = wall_clock
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.pings = 0
+        self.reaped = 0
+        self.expired = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self):
+        now = self.clock()
+        ping_before, idle_before = now - self.interval, now - self.idle_timeout
+        wall = self.wall_clock()
+        idle, expired = [], []
+        # A snapshot: sockets come and go while the sweep yields.
+        for i, connection in enumerate(list(self.connections())):
+            if i and i % WS_HEARTBEAT_SLICE == 0:
+                await asyncio.sleep(0)
+            if connection.closed:
+                continue
+            if self.on_expired is not None and connection.expires_at is not None and connection.expires_at <= wall:
+                expired.append(connection)
+            elif connection.last_seen < idle_before:
+                idle.append(connection)
+            elif connection.last_seen < ping_before:
+                if connection.offer(PING_FRAME):
+                    self.pings += 1
+                else:
+                    idle.append(connection)  # a slow consumer under the disconnect policy
+        for connection in expired:
+            self.on_expired(connection)
+        self.expired += len(expired)
+        for connection in idle:
+            self.on_idle(connection)
+        if idle:
+            self.reaped += len(idle)
+            WS_IDLE_CLOSED.inc(amount=len(idle))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print("Heartbeat sweep failed:", str(e))
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
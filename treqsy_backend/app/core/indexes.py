@@ -0,0 +1,126 @@
+import os
+from typing import Dict, List, NamedTuple, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "1") == "1"
+# How long a ledger idempotency key is remembered.
+LEDGER_IDEMPOTENCY_TTL = int(os.getenv("LEDGER_IDEMPOTENCY_TTL", "86400"))
+# How long chat messages are kept for history replay.
+CHAT_MESSAGE_TTL = int(os.getenv("CHAT_MESSAGE_TTL", str(7 * 86400)))
+
+# Every index the routers rely on. Applied at startup; create_indexes is a no-op
+# for indexes that already exist with the same spec.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        # Gift batching markers; sparse since almost no user has one at any moment.
+        IndexModel([("pending_gifts.at", ASCENDING)], sparse=True, name="pending_gifts_at"),
+        IndexModel([("pending_gifts.id", ASCENDING)], sparse=True, name="pending_gifts_id"),
+        # Transfers in flight without LEDGER_TRANSACTIONS; found again by reconcile().
+        IndexModel([("ledger_pending", ASCENDING)], sparse=True, name="ledger_pending"),
+    ],
+    "streams": [
+        IndexModel([("is_active", ASCENDING), ("start_time", DESCENDING), ("_id", DESCENDING)],
+                   name="is_active_start_time_id"),
+    ],
+    "coin_transactions": [
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+                   name="user_id_timestamp_id"),
+        IndexModel([("pending", ASCENDING)], sparse=True, name="pending"),
+    ],
+    "payout_requests": [
+        IndexModel([("status", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+                   name="status_timestamp_id"),
+    ],
+    "settings": [
+        IndexModel([("key", ASCENDING)], unique=True, name="key_unique"),
+    ],
+    "gift_batches": [
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    # Analytics rollups: the backfill rebuilds the leaderboards from these.
+    "coin_user_totals": [
+        IndexModel([("spent", DESCENDING)], name="spent"),
+        IndexModel([("earned", DESCENDING)], name="earned"),
+    ],
+    "ledger_idempotency": [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=LEDGER_IDEMPOTENCY_TTL, name="created_at_ttl"),
+    ],
+    "chat_messages": [
+        IndexModel([("room_id", ASCENDING), ("seq", DESCENDING)], name="room_id_seq"),
+        IndexModel([("at", ASCENDING)], expireAfterSeconds=CHAT_MESSAGE_TTL, name="at_ttl"),
+    ],
+}
+
+
+class HotQuery(NamedTuple):
+    name: str
+    collection: str
+    filter: dict
+    sort: Optional[list] = None
+
+
+# The queries issued by the routers, in the shape they are sent. Keep in step
+# with app/api when a query changes; benchmarks/query_plans.py explains each one.
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery("auth.login / auth.register", "users", {"email": "user@example.com"}),
+    HotQuery("admin.get_balance", "users", {"_id": "user-id"}),
+    HotQuery("streams.get_active_streams", "streams", {"is_active": True},
+             [("start_time", DESCENDING), ("_id", DESCENDING)]),
+    HotQuery("streams.end_stream", "streams", {"_id": "stream-id", "is_active": True}),
+    HotQuery("admin.list_users", "users", {}, [("_id", ASCENDING)]),
+    HotQuery("admin.get_transactions", "coin_transactions",
+             {"user_id": "user-id", "pending": {"$exists": False}},
+             [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    HotQuery("admin.list_payout_requests", "payout_requests", {"status": "pending"},
+             [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    HotQuery("admin.approve_payout", "payout_requests", {"_id": "request-id", "status": "pending"}),
+    HotQuery("app_settings.refresh", "settings", {"key": "settings_version"}),
+    HotQuery("chat_history.recent", "chat_messages", {"room_id": "stream-id"}, [("seq", DESCENDING)]),
+    HotQuery("chat_history.since", "chat_messages", {"room_id": "stream-id", "seq": {"$gt": 0}},
+             [("seq", ASCENDING)]),
+    HotQuery("analytics.backfill leaders", "coin_user_totals", {"spent": {"$gt": 0}}, [("spent", DESCENDING)]),
+]
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    for name, models in INDEXES.items():
+        try:
+            await db[name].create_indexes(models)
+        except Exception as e:
+            # A duplicate email, for instance, blocks the unique index; keep serving.
+            print(f"Index creation failed for {name}:", str(e))
+
+
+def plan_stages(plan) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+async def explain_stages(db: AsyncIOMotorDatabase, query: HotQuery) -> List[str]:
+    find = {"find": query.collection, "filter": query.filter}
+    if query.sort:
+        find["sort"] = dict(query.sort)
+    result = await db.command({"explain": find, "verbosity": "queryPlanner"})
+    return plan_stages(result["queryPlanner"]["winningPlan"])
+
+
+def static_stages(index_information: dict, query: HotQuery) -> List[str]:
+    # Planner stand-in for backends without explain (mongomock): an index serves
+    # the query when its leading key is an equality field of the filter, or, for
+    # an unfiltered query, the leading sort key.
+    fields = set(query.filter) or {field for field, _ in (query.sort or [])[:1]}
+    for spec in index_information.values():
+        if next(iter(dict(spec["key"]))) in fields:
+            return ["IXSCAN"]
+    return ["COLLSCAN"]
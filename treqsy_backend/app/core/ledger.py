@@ -0,0 +1,441 @@
+import asyncio
+import os
+import sys
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core import database
+from app.core.database import match_user_id
+from app.core.analytics import rollups
+from app.core.events import events
+from app.models.coin_transaction import DEBIT_TYPES, CoinTransaction
+
+# Coin movements. Each balance change is a single conditional $inc (debits carry
+# a "coins >= amount" guard, so concurrent gifts can never overdraw), and the
+# coin_transactions writes are group-committed: callers wait for the
+# insert_many that carries their entries, which many requests share.
+#
+# With LEDGER_TRANSACTIONS=1 (replica set required) the balance updates and the
+# ledger entries of a transfer commit together in one multi-document transaction.
+#
+# Without it (the default) a transfer is not atomic, only recoverable. Its
+# entries are written first, marked "pending" with a transfer id; every balance
+# change pushes that id onto the user's ledger_pending (and is skipped if it is
+# already there); a second group commit then clears both marks. A failure before
+# any balance moved deletes the entries and releases the idempotency key; one
+# after is undone balance by balance. A crash in between leaves marked entries,
+# which reconcile() finishes when the debit went through and rolls back when
+# nothing did. The app runs it every LEDGER_RECONCILE_INTERVAL seconds (0 turns
+# that off); python -m app.core.ledger reconcile runs it once.
+#
+# Transfers are handed to an optional on_commit callback (the analytics rollups
+# and wallet events in the app) once their balances have moved; the callback
+# failing is logged, never reported to the caller.
+LEDGER_BATCH_SIZE = int(os.getenv("LEDGER_BATCH_SIZE", "500"))
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", "0.005"))
+LEDGER_TRANSACTIONS = os.getenv("LEDGER_TRANSACTIONS", "0") == "1"
+LEDGER_RECONCILE_INTERVAL = float(os.getenv("LEDGER_RECONCILE_INTERVAL", "60"))
+
+
+class LedgerError(Exception):
+    status_code = 400
+
+
+class InvalidAmount(LedgerError):
+    pass
+
+
+class AccountNotFound(LedgerError):
+    status_code = 404
+
+
+class InsufficientFunds(LedgerError):
+    status_code = 409
+
+
+class DuplicateRequest(LedgerError):
+    status_code = 409
+
+
+class PayoutNotPending(LedgerError):
+    status_code = 404
+
+
+class LedgerWriter:
+    """Group commit for ledger entries: one insert_many per batch of callers, and
+    one pair of update_many calls per batch of transfers whose pending marks are
+    cleared."""
+
+    def __init__(self, collection: AsyncIOMotorCollection, users: Optional[AsyncIOMotorCollection] = None,
+                 batch_size: int = LEDGER_BATCH_SIZE, flush_interval: float = LEDGER_FLUSH_INTERVAL):
+        self.collection = collection
+        self.users = users
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batches = 0
+        self.entries = 0
+        self._buffer: List[dict] = []
+        self._waiters: List[asyncio.Future] = []
+        self._settled: List[str] = []
+        self._settle_waiters: List[asyncio.Future] = []
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def write(self, entries: List[dict]):
+        await self._enqueue(self._buffer, entries, self._waiters)
+
+    async def settle(self, transfer: str):
+        await self._enqueue(self._settled, [transfer], self._settle_waiters)
+
+    async def _enqueue(self, buffer: list, items: list, waiters: List[asyncio.Future]):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        waiter = asyncio.get_running_loop().create_future()
+        buffer.extend(items)
+        waiters.append(waiter)
+        self._wake.set()
+        await waiter
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            if len(self._buffer) < self.batch_size and self.flush_interval:
+                await asyncio.sleep(self.flush_interval)
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        if self._waiters:
+            buffer, self._buffer = self._buffer, []
+            waiters, self._waiters = self._waiters, []
+            await _resolve(waiters, self._insert(buffer))
+        if self._settle_waiters:
+            settled, self._settled = self._settled, []
+            waiters, self._settle_waiters = self._settle_waiters, []
+            await _resolve(waiters, self.clear(settled))
+
+    async def _insert(self, buffer: List[dict]):
+        for start in range(0, len(buffer), self.batch_size):
+            await self.collection.insert_many(buffer[start:start + self.batch_size], ordered=False)
+            self.batches += 1
+        self.entries += len(buffer)
+
+    async def clear(self, transfers: List[str]):
+        # Entries first: an entry without its mark but a user still carrying the id is harmless.
+        await self.collection.update_many({"pending": {"$in": transfers}}, {"$unset": {"pending": ""}})
+        await self.users.update_many({"ledger_pending": {"$in": transfers}},
+                                     {"$pull": {"ledger_pending": {"$in": transfers}}})
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+async def _resolve(waiters: List[asyncio.Future], write):
+    try:
+        await write
+    except Exception as e:
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(e)
+        return
+    for waiter in waiters:
+        if not waiter.done():
+            waiter.set_result(None)
+
+
+def _delta(entry: dict) -> int:
+    return -entry["amount"] if entry["type"] in DEBIT_TYPES else entry["amount"]
+
+
+def _entry(user_id: str, type: str, amount: int, idempotency_key: Optional[str] = None,
+           details: Optional[str] = None) -> dict:
+    entry = CoinTransaction(user_id=user_id, type=type, amount=amount, timestamp=datetime.utcnow(),
+                            details=details).dict()
+    if idempotency_key:
+        entry["idempotency_key"] = idempotency_key
+    return entry
+
+
+class Ledger:
+    def __init__(self, users: AsyncIOMotorCollection, transactions: AsyncIOMotorCollection,
+                 payouts: AsyncIOMotorCollection, idempotency: AsyncIOMotorCollection,
+                 use_transactions: bool = LEDGER_TRANSACTIONS,
+                 on_commit: Optional[Callable[[List[dict]], None]] = None, **writer_options):
+        self.users = users
+        self.transactions = transactions
+        self.payouts = payouts
+        self.idempotency = idempotency
+        self.use_transactions = use_transactions
+        self.on_commit = on_commit
+        self.writer = LedgerWriter(transactions, users, **writer_options)
+        self._reconciler: Optional[asyncio.Task] = None
+
+    def start(self, interval: float = LEDGER_RECONCILE_INTERVAL):
+        if self._reconciler is None and interval > 0:
+            self._reconciler = asyncio.create_task(self._reconcile_loop(interval))
+
+    async def _reconcile_loop(self, interval: float):
+        while True:
+            try:
+                count = await self.reconcile()
+                if count:
+                    print(f"Reconciled {count} pending transfers")
+            except Exception as e:
+                print("Ledger reconcile failed:", str(e))
+            await asyncio.sleep(interval)
+
+    def _committed(self, entries: List[dict]):
+        if self.on_commit is None:
+            return
+        try:
+            self.on_commit(entries)
+        except Exception as e:
+            print("Ledger on_commit failed:", str(e))
+
+    # --- Idempotency ---
+    # A key is claimed by inserting it; a second request with the same key hits
+    # the unique _id and is rejected. Failed operations release their claim so
+    # the client may retry.
+    async def _claim(self, key: Optional[str], operation: str, session=None):
+        if not key:
+            return
+        try:
+            await self.idempotency.insert_one(
+                {"_id": key, "operation": operation, "created_at": datetime.utcnow()}, session=session
+            )
+        except DuplicateKeyError:
+            raise DuplicateRequest("Request already processed")
+
+    async def _release(self, key: Optional[str]):
+        if key:
+            await self.idempotency.delete_one({"_id": key})
+
+    # --- Balance primitives ---
+    async def _debit(self, user_id: str, amount: int, session=None):
+        result = await self.users.update_one(
+            {"_id": match_user_id(user_id), "coins": {"$gte": amount}}, {"$inc": {"coins": -amount}}, session=session
+        )
+        if result.matched_count == 0:
+            if await self.users.count_documents({"_id": match_user_id(user_id)}, limit=1, session=session):
+                raise InsufficientFunds("Insufficient coins")
+            raise AccountNotFound("User not found")
+
+    async def _credit(self, user_id: str, amount: int, session=None):
+        result = await self.users.update_one({"_id": match_user_id(user_id)}, {"$inc": {"coins": amount}}, session=session)
+        if result.matched_count == 0:
+            raise AccountNotFound("User not found")
+
+    async def _in_transaction(self, operation, entries: List[dict]):
+        async with await self.users.database.client.start_session() as session:
+            await session.with_transaction(operation)
+        self._committed(entries)
+
+    # --- Without transactions ---
+    async def _apply(self, entry: dict, transfer: str, undo: bool = False):
+        user_id, delta = entry["user_id"], _delta(entry)
+        if undo:
+            await self.users.update_one({"_id": match_user_id(user_id), "ledger_pending": transfer},
+                                        {"$inc": {"coins": -delta}, "$pull": {"ledger_pending": transfer}})
+            return
+        query = {"_id": match_user_id(user_id), "ledger_pending": {"$ne": transfer}}
+        if delta < 0:
+            query["coins"] = {"$gte": -delta}
+        result = await self.users.update_one(query, {"$inc": {"coins": delta}, "$push": {"ledger_pending": transfer}})
+        if result.matched_count == 0:
+            if delta < 0 and await self.users.count_documents({"_id": match_user_id(user_id)}, limit=1):
+                raise InsufficientFunds("Insufficient coins")
+            raise AccountNotFound("User not found")
+
+    async def _transfer(self, entries: List[dict], idempotency_key: Optional[str]):
+        # Debits come first in `entries`, so a failed credit only has debits to undo.
+        transfer = uuid.uuid4().hex
+        for entry in entries:
+            entry["pending"] = transfer
+        try:
+            await self.writer.write(entries)
+        except Exception:
+            await self._release(idempotency_key)
+            raise
+        applied = []
+        try:
+            for entry in entries:
+                await self._apply(entry, transfer)
+                applied.append(entry)
+        except Exception:
+            for entry in reversed(applied):
+                await self._apply(entry, transfer, undo=True)
+            await self.transactions.delete_many({"pending": transfer})
+            await self._release(idempotency_key)
+            raise
+        self._committed(entries)
+        try:
+            await self.writer.settle(transfer)
+        except Exception as e:
+            # The transfer stands; reconcile() clears the marks later.
+            print("Ledger settle failed:", str(e))
+
+    async def reconcile(self, older_than: float = 60) -> int:
+        """Finishes or rolls back transfers a crash left pending; returns how many."""
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+        transfers = defaultdict(list)
+        async for entry in self.transactions.find({"pending": {"$exists": True}, "timestamp": {"$lt": cutoff}}):
+            transfers[entry["pending"]].append(entry)
+        for transfer, entries in transfers.items():
+            entries.sort(key=_delta)
+            applied = [entry for entry in entries
+                       if await self.users.count_documents({"_id": match_user_id(entry["user_id"]), "ledger_pending": transfer}, limit=1)]
+            if applied:
+                # The debit went through: finish the rest, or undo it if that cannot be done.
+                try:
+                    for entry in entries:
+                        if entry not in applied:
+                            await self._apply(entry, transfer)
+                            applied.append(entry)
+                except LedgerError:
+                    for entry in reversed(applied):
+                        await self._apply(entry, transfer, undo=True)
+                    applied = []
+            if applied:
+                await self.writer.clear([transfer])
+                continue
+            await self.transactions.delete_many({"pending": transfer})
+            for entry in entries:
+                if entry.get("payout_id") is not None:
+                    await self.payouts.update_one({"_id": entry["payout_id"], "status": "approved"},
+                                                  {"$set": {"status": "pending"}, "$unset": {"approved_at": ""}})
+        return len(transfers)
+
+    # --- Operations ---
+    async def purchase(self, user_id: str, amount: int, idempotency_key: Optional[str] = None,
+                       price: Optional[float] = None):
+        _check_amount(amount)
+        entries = [_entry(user_id, "purchase", amount, idempotency_key)]
+        if price is not None:
+            entries[0]["price"] = price
+        if self.use_transactions:
+            async def operation(session):
+                await self._claim(idempotency_key, "purchase", session)
+                await self._credit(user_id, amount, session)
+                await self.transactions.insert_many(entries, session=session)
+            return await self._in_transaction(operation, entries)
+
+        await self._claim(idempotency_key, "purchase")
+        await self._transfer(entries, idempotency_key)
+
+    async def gift(self, from_user: str, to_user: str, amount: int, idempotency_key: Optional[str] = None):
+        _check_amount(amount)
+        if from_user == to_user:
+            raise InvalidAmount("Cannot gift coins to yourself")
+        entries = [
+            _entry(from_user, "gift_sent", -amount, idempotency_key, f"to {to_user}"),
+            _entry(to_user, "gift_received", amount, idempotency_key, f"from {from_user}"),
+        ]
+        if self.use_transactions:
+            async def operation(session):
+                await self._claim(idempotency_key, "gift", session)
+                await self._debit(from_user, amount, session)
+                await self._credit(to_user, amount, session)
+                await self.transactions.insert_many(entries, session=session)
+            return await self._in_transaction(operation, entries)
+
+        await self._claim(idempotency_key, "gift")
+        await self._transfer(entries, idempotency_key)
+
+    async def approve_payout(self, request_id, idempotency_key: Optional[str] = None):
+        update = {"$set": {"status": "approved", "approved_at": datetime.utcnow()}}
+        if self.use_transactions:
+            entries = []
+
+            async def operation(session):
+                await self._claim(idempotency_key, "payout", session)
+                req = await self.payouts.find_one_and_update(
+                    {"_id": request_id, "status": "pending"}, update, session=session
+                )
+                if not req:
+                    raise PayoutNotPending("Request not found or already processed")
+                await self._debit(req["user_id"], req["amount"], session)
+                # with_transaction may retry the callback; keep only the attempt that commits.
+                entries[:] = [_entry(req["user_id"], "payout_approved", req["amount"], idempotency_key)]
+                await self.transactions.insert_many(entries, session=session)
+            return await self._in_transaction(operation, entries)
+
+        await self._claim(idempotency_key, "payout")
+        # Flipping the status first means only one approver can ever debit.
+        req = await self.payouts.find_one_and_update(
+            {"_id": request_id, "status": "pending"}, update, return_document=ReturnDocument.BEFORE
+        )
+        if not req:
+            await self._release(idempotency_key)
+            raise PayoutNotPending("Request not found or already processed")
+        entry = _entry(req["user_id"], "payout_approved", req["amount"], idempotency_key)
+        entry["payout_id"] = request_id
+        try:
+            await self._transfer([entry], idempotency_key)
+        except Exception:
+            await self.payouts.update_one(
+                {"_id": request_id}, {"$set": {"status": "pending"}, "$unset": {"approved_at": ""}}
+            )
+            raise
+
+    async def close(self):
+        if self._reconciler is not None:
+            self._reconciler.cancel()
+            self._reconciler = None
+        await self.writer.close()
+
+
+def _check_amount(amount: int):
+    if amount <= 0:
+        raise InvalidAmount("Amount must be positive")
+
+
+_ledger: Optional[Ledger] = None
+
+
+async def get_ledger() -> Ledger:
+    global _ledger
+    if _ledger is None:
+        _ledger = Ledger(
+            database.collection("users"),
+            database.collection("coin_transactions"),
+            database.collection("payout_requests"),
+            database.collection("ledger_idempotency"),
+            on_commit=_committed,
+        )
+    return _ledger
+
+
+def _committed(entries: List[dict]):
+    rollups.record(entries)
+    events.ledger_committed(entries)
+
+
+async def close_ledger():
+    global _ledger
+    if _ledger is not None:
+        await _ledger.close()
+        _ledger = None
+
+
+async def _reconcile_main():
+    ledger = await get_ledger()
+    count = await ledger.reconcile()
+    await ledger.close()
+    print(f"Reconciled {count} pending transfers")
+    database.close()
+
+
+if __name__ == "__main__":
+    # python -m app.core.ledger reconcile
+    if sys.argv[1:] != ["reconcile"]:
+        sys.exit("usage: python -m app.core.ledger reconcile")
+    asyncio.run(_reconcile_main())
@@ -0,0 +1,265 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Prometheus metrics, rendered in the text exposition format on GET /metrics.
+# Hot paths only bump in-process counters (a dict lookup and a few adds per
+# observation); gauges that mirror state kept elsewhere (room sizes, queue
+# depths, executor backlog) are read by collectors at scrape time instead.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# /metrics carries per-room labels, so scrapers must send
+# "Authorization: Bearer <METRICS_TOKEN>"; with no token set the endpoint is
+# not served at all (the counters are still kept).
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+# Rooms beyond this many (largest first) are only counted in the totals.
+METRICS_MAX_ROOMS = int(os.getenv("METRICS_MAX_ROOMS", "100"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    # Exact: "%g" keeps six significant digits, which rounds counters past 999999.
+    value = float(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _format(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        pairs = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+        return f"{name}{{{pairs}}} {_number(value)}"
+    return f"{name} {_number(value)}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Observations arrive from pymongo's and the executors' threads as well as the loop.
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, value in list(self._values.items()):
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Gauge(Metric):
+    """A gauge whose (labels, value) pairs are produced by ``collect`` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Callable[[], Iterable[Tuple[tuple, float]]] = lambda: ()):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, value in self.collect():
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]; cumulated only when rendered.
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in snapshot:
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", {**base, "le": f"{bound:g}"}, cumulative
+            cumulative += series[-2]
+            yield f"{self.name}_bucket", {**base, "le": "+Inf"}, cumulative
+            yield f"{self.name}_sum", base, series[-1]
+            yield f"{self.name}_count", base, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print("Metrics collection failed:", metric.name, str(e))
+                continue
+            lines.extend(metric.header())
+            lines.extend(_format(name, labels, value) for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status")))
+MONGO_COMMAND_SECONDS = registry.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency by collection.", ("collection", "command"),
+    FAST_BUCKETS))
+MONGO_COMMAND_FAILURES = registry.register(Counter(
+    "mongo_command_failures_total", "Failed MongoDB commands by collection.", ("collection", "command")))
+BCRYPT_SECONDS = registry.register(Histogram(
+    "bcrypt_duration_seconds", "Password hash/verify time, excluding the wait for a worker.", ("operation",)))
+FANOUT_SECONDS = registry.register(Histogram(
+    "ws_fanout_duration_seconds", "Time to queue one chat message for every viewer in a room.",
+    buckets=FAST_BUCKETS))
+WS_EVICTIONS = registry.register(Counter(
+    "ws_slow_consumer_evictions_total", "Viewers disconnected for not keeping up."))
+WS_IDLE_CLOSED = registry.register(Counter(
+    "ws_idle_closed_total", "Sockets closed by the heartbeat for sending nothing, not even a pong."))
+LOOP_LAG_SECONDS = registry.register(Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer.", buckets=FAST_BUCKETS))
+
+
+# --- HTTP ---
+class MetricsMiddleware:
+    """Times every HTTP request under its route template (e.g. /streams/{stream_id}/end)."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners can't blow up the series count.
+            template = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], template, str(status))
+
+
+# --- MongoDB ---
+class CommandMetrics(monitoring.CommandListener):
+    """pymongo command listener; pass it in the client's event_listeners."""
+
+    def __init__(self):
+        self._collections: Dict[Tuple[int, object], str] = {}
+
+    @staticmethod
+    def _key(event) -> Tuple[int, object]:
+        return event.request_id, event.connection_id
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        name = event.command.get(event.command_name) if event.command else None
+        if event.command_name == "getMore":
+            name = event.command.get("collection")
+        self._collections[self._key(event)] = name if isinstance(name, str) else ""
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        collection = self._collections.pop(self._key(event), "")
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection = self._collections.pop(self._key(event), "")
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, collection, event.command_name)
+        MONGO_COMMAND_FAILURES.inc(collection, event.command_name)
+
+
+command_metrics = CommandMetrics()
+
+
+# --- Event loop ---
+class LoopLagMonitor:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            due = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, time.perf_counter() - due)
+            LOOP_LAG_SECONDS.observe(self.last)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+loop_lag = LoopLagMonitor()
+registry.register(Gauge("event_loop_lag_last_seconds", "Lag of the most recent loop lag probe.",
+                        collect=lambda: [((), loop_lag.last)]))
+
+
+def render() -> str:
+    return registry.render()
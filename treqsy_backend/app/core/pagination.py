@@ -0,0 +1,123 @@
+import base64
+import os
+from typing import List, Literal, Optional, Tuple
+
+from bson import ObjectId, json_util
+from fastapi import HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from app.core.responses import FAST_JSON, FastJSONResponse, dumps
+
+# Keyset pagination for the list endpoints. A page is the next `limit` documents
+# after the cursor in a fixed sort order that always ends with _id, so the
+# query is a range scan on an index that carries the sort keys and the cost of a
+# page does not depend on how deep into the result it is. The cursor is the
+# sort-key values of the last document handed out, and is returned in the
+# X-Next-Cursor header so the response body stays a plain JSON list.
+#
+# format=ndjson instead streams every matching document from the cursor as
+# newline-delimited JSON, one chunk per driver batch, so exports of any size
+# run in constant memory.
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Users have ObjectId ids when they register and string ids when the ledger or
+# the seeder creates them. $gt/$lt only match values of the same BSON type, and
+# ObjectIds sort after strings, so a cursor left on one type also has to take in
+# every value of the type that follows it in the sort direction.
+NEXT_BRACKET = {(str, 1): "objectId", (ObjectId, -1): "string"}
+
+Sort = List[Tuple[str, int]]
+
+
+class Page:
+    """Query parameters shared by the paginated endpoints."""
+
+    def __init__(self, limit: int = Query(PAGE_SIZE, ge=1, le=PAGE_SIZE_MAX), cursor: Optional[str] = None,
+                 format: Literal["json", "ndjson"] = "json"):
+        self.limit = limit
+        self.cursor = cursor
+        self.format = format
+
+
+def encode_cursor(doc: dict, sort: Sort) -> str:
+    values = [doc[field] for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, sort: Sort) -> list:
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def after(sort: Sort, values: list) -> dict:
+    # (a, b, c) > (x, y, z) in sort order, spelled out for the query planner:
+    # a > x  or  a = x and b > y  or  a = x and b = y and c > z.
+    branches = []
+    for i, (field, direction) in enumerate(sort):
+        branch = {sort[j][0]: values[j] for j in range(i)}
+        beyond = {field: {"$gt" if direction > 0 else "$lt": values[i]}}
+        bracket = NEXT_BRACKET.get((type(values[i]), direction))
+        if bracket is None:
+            branch.update(beyond)
+        else:
+            branch["$or"] = [beyond, {field: {"$type": bracket}}]
+        branches.append(branch)
+    return branches[0] if len(branches) == 1 else {"$or": branches}
+
+
+def _apply_cursor(filter: dict, sort: Sort, cursor: Optional[str]) -> dict:
+    if not cursor:
+        return filter
+    return {"$and": [filter, after(sort, decode_cursor(cursor, sort))]}
+
+
+async def fetch_page(collection: AsyncIOMotorCollection, filter: dict, sort: Sort, projection: Optional[dict],
+                     limit: int, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    # One extra document tells us whether there is a next page.
+    docs = await collection.find(_apply_cursor(filter, sort, cursor), projection).sort(sort).limit(limit + 1) \
+        .to_list(limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1], sort) if len(docs) > limit else None
+    docs = docs[:limit]
+    for doc in docs:
+        if isinstance(doc.get("_id"), ObjectId):
+            doc["_id"] = str(doc["_id"])
+    return docs, next_cursor
+
+
+async def _ndjson(cursor):
+    lines = []
+    async for doc in cursor:
+        lines.append(dumps(doc))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+def export_ndjson(collection: AsyncIOMotorCollection, filter: dict, sort: Sort, projection: Optional[dict],
+                  cursor: Optional[str] = None) -> StreamingResponse:
+    docs = collection.find(_apply_cursor(filter, sort, cursor), projection).sort(sort).batch_size(EXPORT_BATCH_SIZE)
+    return StreamingResponse(_ndjson(docs), media_type="application/x-ndjson")
+
+
+async def paginate(page: Page, response: Response, collection: AsyncIOMotorCollection, filter: dict, sort: Sort,
+                   projection: Optional[dict] = None):
+    if page.format == "ndjson":
+        return export_ndjson(collection, filter, sort, projection, page.cursor)
+    docs, next_cursor = await fetch_page(collection, filter, sort, projection, page.limit, page.cursor)
+    if FAST_JSON:
+        return FastJSONResponse(docs, headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return docs
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from app.core import database
+
+# Viewer presence per stream, driven by chat socket joins and leaves in
+# ConnectionManager: concurrent viewers, peak viewers, joins and watch time
+# (viewer-seconds, integrated on every change, so no per-viewer state). All in
+# memory; every PRESENCE_FLUSH_INTERVAL the change since the last flush is
+# written onto each stream document with one $inc/$max update, and the totals
+# are handed to an optional on_flush callback (the analytics rollups in the
+# app). Writes per flush scale with the streams being watched, not with how
+# many viewers come and go.
+#
+# Counts are this worker's. viewer_joins and watch_seconds add up across
+# workers; peak_viewers is the highest any single worker saw.
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "10"))
+
+
+class StreamPresence:
+    __slots__ = ("viewers", "peak", "joins", "watch_seconds", "since", "flushed_joins", "flushed_watch",
+                 "flushed_peak")
+
+    def __init__(self, now: float):
+        self.viewers = 0
+        self.peak = 0
+        self.joins = 0
+        self.watch_seconds = 0.0
+        self.since = now
+        self.flushed_joins = 0
+        self.flushed_watch = 0.0
+        self.flushed_peak = 0
+
+    def accrue(self, now: float):
+        self.watch_seconds += self.viewers * (now - self.since)
+        self.since = now
+
+
+class Presence:
+    def __init__(self, streams: Optional[AsyncIOMotorCollection] = None,
+                 flush_interval: float = PRESENCE_FLUSH_INTERVAL, clock: Callable[[], float] = time.monotonic,
+                 on_flush: Optional[Callable[[int, float], None]] = None):
+        self._streams = streams
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.flushes = 0
+        self.writes = 0
+        self._presence: Dict[str, StreamPresence] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Future] = None
+
+    @property
+    def streams(self) -> AsyncIOMotorCollection:
+        return self._streams if self._streams is not None else database.collection("streams")
+
+    # --- Events ---
+    def join(self, stream_id: str):
+        now = self.clock()
+        presence = self._presence.get(stream_id)
+        if presence is None:
+            presence = self._presence[stream_id] = StreamPresence(now)
+        else:
+            presence.accrue(now)
+        presence.viewers += 1
+        presence.joins += 1
+        if presence.viewers > presence.peak:
+            presence.peak = presence.viewers
+
+    def leave(self, stream_id: str):
+        presence = self._presence.get(stream_id)
+        if presence is None or not presence.viewers:
+            return
+        presence.accrue(self.clock())
+        presence.viewers -= 1
+
+    # --- Reads ---
+    def viewers(self, stream_id: str) -> int:
+        presence = self._presence.get(stream_id)
+        return presence.viewers if presence is not None else 0
+
+    def snapshot(self, stream_id: str) -> dict:
+        """This worker's live counters for a stream, open sessions included; no I/O."""
+        presence = self._presence.get(stream_id)
+        if presence is None:
+            return {"viewers": 0, "peak_viewers": 0, "viewer_joins": 0, "watch_seconds": 0.0}
+        watch = presence.watch_seconds + presence.viewers * (self.clock() - presence.since)
+        return {"viewers": presence.viewers, "peak_viewers": presence.peak, "viewer_joins": presence.joins,
+                "watch_seconds": round(watch, 3)}
+
+    # --- Flush ---
+    async def flush(self):
+        now = self.clock()
+        flushing, updates = [], []
+        for stream_id, presence in list(self._presence.items()):
+            presence.accrue(now)
+            joins = presence.joins - presence.flushed_joins
+            watch = presence.watch_seconds - presence.flushed_watch
+            update = {}
+            if joins or watch:
+                update["$inc"] = {"viewer_joins": joins, "watch_seconds": round(watch, 3)}
+            if presence.peak > presence.flushed_peak:
+                update["$max"] = {"peak_viewers": presence.peak}
+            if update:
+                # The marks are taken now, so an event during the write counts towards the next flush.
+                flushing.append((stream_id, presence, presence.joins, presence.watch_seconds, presence.peak))
+                updates.append(self.streams.update_one({"_id": stream_id}, update))
+            elif not presence.viewers:
+                del self._presence[stream_id]
+        if not updates:
+            self.flushes += 1
+            return
+        self.writes += len(updates)
+        results = await asyncio.gather(*updates, return_exceptions=True)
+        # Only the writes that landed move their stream's marks; the rest are retried next flush.
+        total_joins, total_watch, failed = 0, 0.0, None
+        for (stream_id, presence, joins, watch, peak), result in zip(flushing, results):
+            if isinstance(result, Exception):
+                failed = failed or result
+                continue
+            total_joins += joins - presence.flushed_joins
+            total_watch += watch - presence.flushed_watch
+            presence.flushed_joins, presence.flushed_watch, presence.flushed_peak = joins, watch, peak
+            if not presence.viewers and presence.joins == joins and self._presence.get(stream_id) is presence:
+                del self._presence[stream_id]
+        if self.on_flush is not None and (total_joins or total_watch):
+            self.on_flush(total_joins, total_watch)
+        if failed is not None:
+            raise failed
+        self.flushes += 1
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            print("Presence flush failed:", str(e))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Shielded so close() cannot cut a flush off after it has taken the deltas.
+            self._flushing = asyncio.ensure_future(self._flush_logged())
+            await asyncio.shield(self._flushing)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+        await self._flush_logged()
@@ -0,0 +1,286 @@
+import hashlib
+import math
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Request admission: per-key rate limits (GCRA, one timestamp per key) and a
+# global cap on in-flight HTTP requests. Limits live in process memory unless
+# RATE_LIMIT_URL points at Redis, in which case every worker shares them.
+# Rates are "<count>/<seconds>" and allow a burst of <count>.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "")
+RATE_LIMIT_PREFIX = os.getenv("RATE_LIMIT_PREFIX", "treqsy:rl:")
+LOGIN_IP_RATE = os.getenv("LOGIN_IP_RATE", "20/60")
+# Per (username, client IP): a tighter limit for one client working on one account.
+LOGIN_ACCOUNT_RATE = os.getenv("LOGIN_ACCOUNT_RATE", "10/60")
+REGISTER_IP_RATE = os.getenv("REGISTER_IP_RATE", "5/60")
+CHAT_MESSAGE_RATE = os.getenv("CHAT_MESSAGE_RATE", "5/1")
+# Consecutive rejected chat messages after which the socket is closed.
+CHAT_FLOOD_CLOSE_AFTER = int(os.getenv("CHAT_FLOOD_CLOSE_AFTER", "20"))
+# In-flight HTTP requests per worker beyond which new ones get a 503; 0 disables.
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "512"))
+
+# Close code for chat sockets that keep sending past their limit.
+WS_POLICY_VIOLATION = 1008
+
+
+class Rate:
+    def __init__(self, count: int, period: float, burst: Optional[int] = None):
+        self.count = count
+        self.period = period
+        self.burst = burst or count
+        # GCRA: one request is admitted every `interval`, with up to `tolerance`
+        # of credit saved up (the burst).
+        self.interval = period / count
+        self.tolerance = self.interval * self.burst
+
+    @classmethod
+    def parse(cls, value: str) -> "Rate":
+        count, period = value.split("/")
+        return cls(int(count), float(period))
+
+    def __repr__(self):
+        return f"Rate({self.count}/{self.period:g}s, burst={self.burst})"
+
+
+def gcra(tat: Optional[float], now: float, interval: float, tolerance: float, cost: int = 1) -> Tuple[bool, float]:
+    """One GCRA step.
+
+    ``tat`` is the key's theoretical arrival time (None for an unseen key).
+    Returns (allowed, new_tat) when allowed, (False, retry_after) otherwise.
+    """
+    tat = now if tat is None or tat < now else tat
+    new_tat = tat + interval * cost
+    allow_at = new_tat - tolerance
+    if now < allow_at:
+        return False, allow_at - now
+    return True, new_tat
+
+
+# Same step as gcra() on the Redis server, in milliseconds of server time, so
+# workers agree on the clock. The key expires once its bucket is full again.
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + tonumber(t[2]) / 1000
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if tat == nil or tat < now then tat = now end
+local new_tat = tat + interval * cost
+local allow_at = new_tat - tolerance
+if now < allow_at then
+  return {0, tostring(allow_at - now)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.max(1, math.ceil(new_tat - now)))
+return {1, '0'}
+"""
+GCRA_SCRIPT_SHA = hashlib.sha1(GCRA_SCRIPT.encode()).hexdigest()
+
+
+class MemoryStore:
+    """Per-process limits: one float per key, swept once keys have refilled."""
+
+    def __init__(self):
+        self._tat: Dict[str, float] = {}
+        self._sweep_at = 1024
+
+    async def hit(self, key: str, rate: Rate, cost: int = 1) -> float:
+        return self.hit_now(key, rate, cost)
+
+    def hit_now(self, key: str, rate: Rate, cost: int = 1) -> float:
+        now = time.monotonic()
+        allowed, value = gcra(self._tat.get(key), now, rate.interval, rate.tolerance, cost)
+        if not allowed:
+            return value
+        self._tat[key] = value
+        if len(self._tat) >= self._sweep_at:
+            self._sweep(now)
+        return 0.0
+
+    def _sweep(self, now: float):
+        # A key whose TAT has passed is indistinguishable from an unseen one.
+        self._tat = {key: tat for key, tat in self._tat.items() if tat > now}
+        self._sweep_at = max(1024, len(self._tat) * 2)
+
+    def __len__(self):
+        return len(self._tat)
+
+    async def close(self):
+        pass
+
+
+class RedisStore:
+    """Limits shared by every worker, one GCRA script call per check."""
+
+    def __init__(self, url: str, prefix: str = RATE_LIMIT_PREFIX):
+        import redis.asyncio as redis  # optional dependency, only needed with RATE_LIMIT_URL
+
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(GCRA_SCRIPT)
+
+    async def hit(self, key: str, rate: Rate, cost: int = 1) -> float:
+        interval = rate.interval * 1000
+        allowed, retry_ms = await self._script(
+            keys=[self.prefix + key], args=[interval, interval * rate.burst, cost]
+        )
+        return 0.0 if allowed else float(retry_ms) / 1000
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+class RateLimiter:
+    def __init__(self, name: str, rate: Rate, store=None):
+        self.name = name
+        self.rate = rate
+        self._store = store
+        self.allowed = 0
+        self.rejected = 0
+
+    @property
+    def store(self):
+        return self._store if self._store is not None else get_store()
+
+    async def hit(self, key: str, cost: int = 1) -> float:
+        """Records a request for ``key``; returns 0 if allowed, else seconds until it would be."""
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+        try:
+            retry_after = await self.store.hit(f"{self.name}:{key}", self.rate, cost)
+        except Exception as e:
+            # Fail open: an unreachable limiter store must not take logins down with it.
+            print("Rate limiter error:", str(e))
+            return 0.0
+        if retry_after:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+
+class MessageThrottle:
+    """Per-connection chat limit, kept on the connection itself (no store lookup)."""
+
+    __slots__ = ("rate", "tat", "consecutive_rejects", "rejected")
+
+    def __init__(self, rate: Rate):
+        self.rate = rate
+        self.tat: Optional[float] = None
+        self.consecutive_rejects = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if not RATE_LIMIT_ENABLED:
+            return True
+        allowed, value = gcra(self.tat, time.monotonic(), self.rate.interval, self.rate.tolerance)
+        if allowed:
+            self.tat = value
+            self.consecutive_rejects = 0
+            return True
+        self.consecutive_rejects += 1
+        self.rejected += 1
+        return False
+
+    @property
+    def flooding(self) -> bool:
+        return self.consecutive_rejects >= CHAT_FLOOD_CLOSE_AFTER
+
+
+def client_ip(scope: Scope) -> str:
+    # Behind a proxy, run uvicorn with --proxy-headers so this is the real client.
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+async def send_error(send: Send, status: int, detail: bytes, retry_after: float):
+    body = b'{"detail":"' + detail + b'"}'
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """Per-client-IP limits on selected routes, checked before the body is read."""
+
+    def __init__(self, app: ASGIApp, rules: Dict[Tuple[str, str], RateLimiter]):
+        self.app = app
+        self.rules = rules
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            limiter = self.rules.get((scope["method"], scope["path"]))
+            if limiter is not None:
+                retry_after = await limiter.hit(client_ip(scope))
+                if retry_after:
+                    return await send_error(send, 429, b"Too many requests", retry_after)
+        await self.app(scope, receive, send)
+
+
+class LoadSheddingMiddleware:
+    """Rejects HTTP requests with a 503 while `limit` are already in flight.
+
+    Refusing early keeps latency bounded for the requests already admitted
+    instead of letting every one of them queue behind an overload. Health
+    checks and metric scrapes are never shed.
+    """
+
+    def __init__(self, app: ASGIApp, limit: int = MAX_CONCURRENT_REQUESTS,
+                 exempt: Tuple[str, ...] = ("/health", "/metrics")):
+        self.app = app
+        self.limit = limit
+        self.exempt = exempt
+        self.in_flight = 0
+        self.peak = 0
+        self.shed = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.limit or scope["path"].startswith(self.exempt):
+            return await self.app(scope, receive, send)
+        if self.in_flight >= self.limit:
+            self.shed += 1
+            return await send_error(send, 503, b"Server busy", 1)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = RedisStore(RATE_LIMIT_URL) if RATE_LIMIT_URL else MemoryStore()
+    return _store
+
+
+async def close_store():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+
+login_ip = RateLimiter("login-ip", Rate.parse(LOGIN_IP_RATE))
+login_account = RateLimiter("login-account", Rate.parse(LOGIN_ACCOUNT_RATE))
+register_ip = RateLimiter("register-ip", Rate.parse(REGISTER_IP_RATE))
+
+HTTP_RULES = {
+    ("POST", "/auth/login"): login_ip,
+    ("POST", "/auth/register"): register_ip,
+}
@@ -0,0 +1,42 @@
+import json
+import os
+from datetime import datetime
+from typing import Any
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# Opt-in fast path for large JSON responses. FastAPI normally walks the whole
+# payload through jsonable_encoder (and the response_model) before the
+# response class renders it; endpoints that return FastJSONResponse skip both
+# and hand documents straight to orjson, which encodes datetime natively and
+# ObjectId/models through json_default. Without orjson installed the standard
+# library does the encoding.
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1"
+
+
+def json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return value.model_dump(by_alias=True)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default)
+    return json.dumps(content, default=json_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
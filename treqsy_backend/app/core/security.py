@@ -1,15 +1,31 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Any, Optional, Tuple
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 import os
 from dotenv import load_dotenv
 
+from app.core.metrics import BCRYPT_SECONDS, Gauge, registry
+
 load_dotenv()
 
 SECRET_KEY = os.getenv("JWT_SECRET", "secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# bcrypt work runs off the event loop: "thread" (bcrypt releases the GIL),
+# "process", or "inline" to run on the loop as before (scripts, comparisons).
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+# Verified tokens kept in memory until they expire; 0 disables the cache.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password, hashed_password):
@@ -18,6 +34,86 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def verify_and_update_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    # The second item is a fresh hash when the stored one uses deprecated settings.
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded pool so logins never stall the event loop.
+
+    At most ``workers`` jobs are handed to the executor at once; the rest wait
+    on a semaphore, which keeps the backlog observable through ``stats()``.
+    """
+
+    def __init__(self, executor: str = PASSWORD_HASH_EXECUTOR, workers: int = PASSWORD_HASH_WORKERS):
+        self.executor_kind = executor
+        self.workers = max(1, workers)
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.peak_waiting = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+
+    def _get_executor(self) -> Optional[Executor]:
+        if self._executor is None and self.executor_kind != "inline":
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, operation: str, fn, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            executor = self._get_executor()
+            if executor is None:
+                return fn(*args)
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.busy_seconds += elapsed
+            BCRYPT_SECONDS.observe(elapsed, operation)
+            self.completed += 1
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_password_hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run("verify", verify_and_update_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "peak_waiting": self.peak_waiting,
+            "completed": self.completed,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher()
+registry.register(Gauge("bcrypt_jobs", "Password hashing jobs waiting for or holding a worker.", ("state",),
+                        lambda: [(("waiting",), password_hasher.waiting), (("running",), password_hasher.in_flight)]))
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -29,4 +125,47 @@ def decode_access_token(token: str):
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
     except JWTError:
-        return None 
\ No newline at end of file
+        return None 
+
+class TokenCache:
+    """LRU of values derived from verified tokens, each kept until the token's exp.
+
+    Keys are digests so raw bearer tokens are not retained in memory.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str) -> Optional[Any]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, token: str, value: Any, expires_at: float):
+        if self.maxsize <= 0:
+            return
+        self._entries[self._key(token)] = (expires_at, value)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+token_cache = TokenCache()
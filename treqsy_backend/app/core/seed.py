@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError
+from pymongo.uri_parser import parse_uri
+
+from app.core import database
+from app.core.indexes import ensure_indexes
+from app.core.security import get_password_hash
+
+# Bulk data for development and load tests: the demo admins plus any number of
+# generated users and coin transactions. Every generated user shares one
+# password, so bcrypt runs once for all of them rather than once per user, and all
+# writes are unordered insert_many batches, several in flight at once.
+# Balances are the sum of each user's ledger entries, as the ledger keeps them.
+# Re-running without --drop keeps existing users but appends transactions.
+#
+# MONGODB_URI from .env may well point at production, so the CLI only writes
+# to a local server unless the target is named with --uri or --yes is given,
+# and --drop always needs one of the two.
+#
+#   python -m app.core.seed --uri mongodb://localhost:27017 --users 1000000 --transactions 5000000 --drop --backfill
+
+DEMO_ADMINS = [
+    ("masteradmin@demo.com", "Master@123", "master_admin"),
+    ("admin@demo.com", "Admin@123", "admin"),
+]
+LOAD_PASSWORD = "Load@1234"
+LOAD_EMAIL_DOMAIN = "example.com"
+# Every HOST_EVERY-th generated user is a host, so load tests know who may stream.
+HOST_EVERY = 50
+VIP_EVERY = 20
+HISTORY_DAYS = 90
+# Hosts the CLI writes to without --uri or --yes ("mongo" is the docker-compose service).
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1", "mongo"}
+
+
+def user_id(index: int) -> str:
+    # Ledger entries refer to users by string id.
+    return f"load-{index:08d}"
+
+
+def user_email(index: int, domain: str = LOAD_EMAIL_DOMAIN) -> str:
+    return f"load{index}@{domain}"
+
+
+class Seeder:
+    def __init__(self, db: AsyncIOMotorDatabase, batch_size: int = 10000, concurrency: int = 4):
+        self.db = db
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.inserted = 0
+
+    async def _insert(self, name: str, docs: Iterator[dict]):
+        collection = self.db[name]
+        slots = asyncio.Semaphore(self.concurrency)
+        pending = set()
+
+        def reap():
+            # Surface a failed batch now rather than after everything else has been written.
+            nonlocal pending
+            done = {task for task in pending if task.done()}
+            pending -= done
+            for task in done:
+                task.result()
+
+        async def write(batch: List[dict]):
+            try:
+                await collection.insert_many(batch, ordered=False)
+                self.inserted += len(batch)
+            except BulkWriteError as e:
+                # Users already seeded by an earlier run keep their documents.
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                    raise
+                self.inserted += e.details["nInserted"]
+            finally:
+                slots.release()
+
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                await slots.acquire()
+                reap()
+                pending.add(asyncio.create_task(write(batch)))
+                batch = []
+        if batch:
+            await slots.acquire()
+            reap()
+            pending.add(asyncio.create_task(write(batch)))
+        try:
+            await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def admins(self):
+        for email, password, role in DEMO_ADMINS:
+            await self.db.users.update_one(
+                {"email": email},
+                {"$set": {"email": email, "hashed_password": get_password_hash(password), "role": role,
+                          "is_active": True}},
+                upsert=True,
+            )
+
+    def _transactions(self, users: int, count: int, balances: List[int]) -> Iterator[dict]:
+        now = datetime.utcnow()
+        span = HISTORY_DAYS * 86400
+        rand = random.random
+        randint = random.randrange
+        for n in range(count):
+            timestamp = now - timedelta(seconds=span * (1 - n / count))
+            buyer = randint(users)
+            # A third of entries are gifts out of an existing balance, the rest purchases.
+            if rand() < 0.33 and balances[buyer] > 0 and users > 1:
+                receiver = (buyer + 1 + randint(users - 1)) % users
+                amount = 1 + randint(min(balances[buyer], 500))
+                balances[buyer] -= amount
+                balances[receiver] += amount
+                yield {"user_id": user_id(buyer), "type": "gift_sent", "amount": -amount, "timestamp": timestamp,
+                       "details": f"to {user_id(receiver)}"}
+                yield {"user_id": user_id(receiver), "type": "gift_received", "amount": amount,
+                       "timestamp": timestamp, "details": f"from {user_id(buyer)}"}
+            else:
+                amount = random.choice((10, 50, 100, 500, 1000))
+                balances[buyer] += amount
+                yield {"user_id": user_id(buyer), "type": "purchase", "amount": amount, "timestamp": timestamp,
+                       "details": None, "price": 1.0}
+
+    def _users(self, users: int, balances: List[int], password: str, domain: str) -> Iterator[dict]:
+        # One hash shared by every generated user; fine for test accounts.
+        hashed = get_password_hash(password)
+        now = datetime.utcnow()
+        span = HISTORY_DAYS * 86400
+        for i in range(users):
+            # Signed up over the same window as the transactions, oldest first.
+            yield {"_id": user_id(i), "email": user_email(i, domain), "hashed_password": hashed,
+                   "role": "host" if i % HOST_EVERY == 0 else "user", "is_active": True,
+                   "is_vip": i % VIP_EVERY == 1, "coins": balances[i],
+                   "created_at": now - timedelta(seconds=span * (1 - i / users))}
+
+    async def run(self, users: int, transactions: int, password: str = LOAD_PASSWORD,
+                  domain: str = LOAD_EMAIL_DOMAIN, admins: bool = True):
+        balances = [0] * users
+        if admins:
+            await self.admins()
+        if users:
+            # Transactions first: they decide the balances the users are written with.
+            await self._insert("coin_transactions", self._transactions(users, transactions, balances))
+            await self._insert("users", self._users(users, balances, password, domain))
+
+
+async def seed(db: AsyncIOMotorDatabase, users: int = 0, transactions: int = 0, drop: bool = False,
+               indexes: bool = True, batch_size: int = 10000, concurrency: int = 4, password: str = LOAD_PASSWORD,
+               admins: bool = True) -> int:
+    if drop:
+        for name in ("users", "coin_transactions", "streams", "coin_rollups", "coin_user_totals"):
+            await db[name].drop()
+    seeder = Seeder(db, batch_size, concurrency)
+    await seeder.run(users, transactions, password, admins=admins)
+    # Building indexes once after the load is cheaper than maintaining them per insert.
+    if indexes:
+        await ensure_indexes(db)
+    return seeder.inserted
+
+
+def is_local(uri: str) -> bool:
+    if uri.startswith("mongodb+srv://"):
+        return False
+    return all(host in LOCAL_HOSTS for host, _ in parse_uri(uri)["nodelist"])
+
+
+def check_target(args) -> str:
+    """The URI to seed, or exit if the target was not confirmed."""
+    uri = args.uri or database.MONGO_URI
+    if args.uri or args.yes:
+        return uri
+    if args.drop:
+        sys.exit("Refusing to --drop collections on MONGODB_URI: name the server with --uri, or pass --yes.")
+    if not is_local(uri):
+        sys.exit("Refusing to seed the non-local MONGODB_URI: name the server with --uri, or pass --yes.")
+    return uri
+
+
+async def _main(args):
+    database.connect(check_target(args))
+    db = database.get_database()
+    started = time.perf_counter()
+    inserted = await seed(db, args.users, args.transactions, drop=args.drop, batch_size=args.batch_size,
+                          concurrency=args.concurrency, password=args.password, admins=not args.no_admins)
+    elapsed = time.perf_counter() - started
+    print(f"Inserted {inserted} documents in {elapsed:.1f}s ({inserted / max(elapsed, 1e-9):.0f}/s)")
+    if args.backfill:
+        from app.core.analytics import rollups
+
+        processed = await rollups.backfill(db["coin_transactions"], db["users"])
+        print(f"Rebuilt coin rollups from {processed} ledger entries")
+    print("Demo admins: " + ", ".join(f"{email} / {password}" for email, password, _ in DEMO_ADMINS))
+    if args.users:
+        print(f"Generated users: {user_email(0)} .. {user_email(args.users - 1)} / {args.password}")
+    database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed demo admins and bulk users/transactions.")
+    parser.add_argument("--uri", help="server to seed (default: MONGODB_URI, local servers only)")
+    parser.add_argument("--yes", action="store_true", help="seed or --drop MONGODB_URI wherever it points")
+    parser.add_argument("--users", type=int, default=0)
+    parser.add_argument("--transactions", type=int, default=0, help="ledger operations; gifts write two entries")
+    parser.add_argument("--password", default=LOAD_PASSWORD, help="password of every generated user")
+    parser.add_argument("--drop", action="store_true", help="drop users, transactions, streams and rollups first")
+    parser.add_argument("--no-admins", action="store_true")
+    parser.add_argument("--backfill", action="store_true", help="rebuild the analytics rollups afterwards")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import DESCENDING
+from pymongo.errors import OperationFailure
+
+from app.core import database
+from app.core.responses import dumps
+from app.models.stream import StreamSession
+
+# In-memory directory of active streams behind GET /streams/active, which the
+# app's home screen polls. start/end on this worker update it directly; other
+# workers' changes arrive through a change stream on streams, or, where change
+# streams are unavailable (standalone mongod), a reload every
+# STREAM_DIRECTORY_POLL_INTERVAL. Reads are served from a pre-serialized JSON
+# snapshot with an ETag. Viewer counts come live from the ConnectionManager, so
+# the snapshot is also rebuilt at most every STREAM_VIEWERS_TTL.
+STREAM_DIRECTORY = os.getenv("STREAM_DIRECTORY", "1") == "1"
+STREAM_DIRECTORY_POLL_INTERVAL = float(os.getenv("STREAM_DIRECTORY_POLL_INTERVAL", "2"))
+STREAM_VIEWERS_TTL = float(os.getenv("STREAM_VIEWERS_TTL", "1"))
+
+ACTIVE_SORT = [("start_time", DESCENDING), ("_id", DESCENDING)]
+# Change stream resume token no longer in the oplog.
+CHANGE_STREAM_HISTORY_LOST = 286
+# Updates touching none of these are not delivered by the change stream; the
+# presence flushes, which $inc every watched stream's totals every few seconds,
+# would otherwise arrive as a full document lookup each. Those totals are as
+# fresh as the last insert, replace or reload.
+DIRECTORY_FIELDS = ("is_active", "host_email", "title", "start_time", "end_time")
+CHANGE_FILTER = {"$or": [
+    {"operationType": {"$in": ["insert", "replace", "delete"]}},
+    {"operationType": "update", "$or": [
+        *({f"updateDescription.updatedFields.{field}": {"$exists": True}} for field in DIRECTORY_FIELDS),
+        {"updateDescription.removedFields": {"$in": list(DIRECTORY_FIELDS)}},
+    ]},
+]}
+
+
+class StreamDirectory:
+    def __init__(self, viewer_count: Callable[[str], int] = lambda stream_id: 0,
+                 streams: Optional[AsyncIOMotorCollection] = None,
+                 poll_interval: float = STREAM_DIRECTORY_POLL_INTERVAL, viewers_ttl: float = STREAM_VIEWERS_TTL):
+        self.viewer_count = viewer_count
+        self._streams = streams
+        self.poll_interval = poll_interval
+        self.viewers_ttl = viewers_ttl
+        self.mode: Optional[str] = None  # "change_stream" or "polling" once started
+        self.reloads = 0
+        self.events = 0
+        self._sessions: Dict[str, dict] = {}
+        self._body: Optional[bytes] = None
+        self._etag = ""
+        self._built_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def streams(self) -> AsyncIOMotorCollection:
+        return self._streams if self._streams is not None else database.collection("streams")
+
+    # --- Updates ---
+    def _put(self, doc: dict):
+        session = StreamSession(**doc).dict(by_alias=True)
+        self._sessions[session["_id"]] = session
+        self._body = None
+
+    def _drop(self, stream_id):
+        if self._sessions.pop(stream_id, None) is not None:
+            self._body = None
+
+    def started(self, session: StreamSession):
+        self._put(session.dict(by_alias=True))
+
+    def ended(self, stream_id: str):
+        self._drop(stream_id)
+
+    def _apply(self, change: dict):
+        self.events += 1
+        doc = change.get("fullDocument")
+        if change["operationType"] != "delete" and doc and doc.get("is_active"):
+            self._put(doc)
+        else:
+            self._drop(change["documentKey"]["_id"])
+
+    async def reload(self):
+        docs = await self.streams.find({"is_active": True}).sort(ACTIVE_SORT).to_list(None)
+        sessions = {}
+        for doc in docs:
+            session = StreamSession(**doc).dict(by_alias=True)
+            sessions[session["_id"]] = session
+        self._sessions = sessions
+        self._body = None
+        self.reloads += 1
+
+    # --- Reads ---
+    def __len__(self):
+        return len(self._sessions)
+
+    def snapshot(self) -> Tuple[bytes, str]:
+        now = time.monotonic()
+        if self._body is None or now - self._built_at >= self.viewers_ttl:
+            ordered = sorted(self._sessions.values(), key=lambda s: (s["start_time"], s["_id"]), reverse=True)
+            rows = [{**session, "viewers": self.viewer_count(session["_id"])} for session in ordered]
+            body = dumps(rows)
+            if body != self._body:
+                self._etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+            self._body = body
+            self._built_at = now
+        return self._body, self._etag
+
+    # --- Sync ---
+    async def _sync(self):
+        resume = None
+        opened = False
+        while True:
+            try:
+                async with self.streams.watch(
+                    [{"$match": CHANGE_FILTER}],
+                    full_document="updateLookup", resume_after=resume,
+                ) as changes:
+                    opened = True
+                    self.mode = "change_stream"
+                    # Anything that changed before the stream opened.
+                    await self.reload()
+                    async for change in changes:
+                        resume = change["_id"]
+                        self._apply(change)
+            except Exception as e:
+                if isinstance(e, OperationFailure) and e.code == CHANGE_STREAM_HISTORY_LOST:
+                    resume = None
+                    continue
+                # Never opened: not a replica set (or no watch support at all).
+                if not opened:
+                    return await self._poll(e)
+                print("Stream directory change stream failed:", str(e))
+                await asyncio.sleep(self.poll_interval)
+
+    async def _poll(self, reason: Exception):
+        print("Stream directory polling, change streams unavailable:", str(reason))
+        self.mode = "polling"
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                print("Stream directory reload failed:", str(e))
+
+    async def start(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            print("Stream directory load failed:", str(e))
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -1,8 +1,54 @@
-from fastapi import FastAPI
+import hmac
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.api import auth, admin, users, streams, streaming
+from app.core import database
+from app.core.analytics import rollups
+from app.core.app_settings import app_settings
+from app.core.events import events
+from app.core.responses import FAST_JSON, FastJSONResponse
+from app.core.indexes import MONGO_ENSURE_INDEXES, ensure_indexes
+from app.core.gift_batcher import close_gift_batcher
+from app.core.ledger import close_ledger, get_ledger
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.core.metrics import METRICS_ENABLED, METRICS_TOKEN, MetricsMiddleware, loop_lag, render
+from app.core.rate_limit import HTTP_RULES, LoadSheddingMiddleware, RateLimitMiddleware, close_store
+from app.core.security import password_hasher
 
-app = FastAPI(title="Treqsy Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.connect()
+    if MONGO_ENSURE_INDEXES:
+        await ensure_indexes(database.get_database())
+    await app_settings.start()
+    await streaming.manager.start()
+    await events.start()
+    await streams.directory.start()
+    rollups.start()
+    (await get_ledger()).start()
+    if METRICS_ENABLED:
+        loop_lag.start()
+    yield
+    await loop_lag.stop()
+    await streams.directory.stop()
+    await app_settings.stop()
+    await streaming.manager.stop()
+    await events.stop()
+    await close_gift_batcher()
+    await close_ledger()
+    await rollups.close()
+    await close_store()
+    password_hasher.shutdown()
+    database.close()
+
+app = FastAPI(title="Treqsy Backend", lifespan=lifespan,
+              default_response_class=FastJSONResponse if FAST_JSON else JSONResponse)
+
+# Admission control, inside CORS so rejections still carry CORS headers.
+app.add_middleware(RateLimitMiddleware, rules=HTTP_RULES)
+app.add_middleware(LoadSheddingMiddleware)
 
 # CORS (Cross-Origin Resource Sharing)
 app.add_middleware(
@@ -11,8 +57,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=[NEXT_CURSOR_HEADER],  # Lets browsers read the pagination cursor
 )
 
+if METRICS_ENABLED:
+    # Outermost, so rate-limited and shed requests are timed too.
+    app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth.router)
 app.include_router(admin.router)
 app.include_router(users.router)
@@ -21,4 +72,18 @@ app.include_router(streaming.router)
 
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to the Treqsy API"} 
\ No newline at end of file
+    return {"message": "Welcome to the Treqsy API"}
+
+if METRICS_ENABLED and METRICS_TOKEN:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics(request: Request):
+        supplied = request.headers.get("authorization", "").encode()
+        if not hmac.compare_digest(supplied, f"Bearer {METRICS_TOKEN}".encode()):
+            return PlainTextResponse("Unauthorized", status_code=401, headers={"WWW-Authenticate": "Bearer"})
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/ready")
+async def readiness():
+    if not await database.ping():
+        return JSONResponse(status_code=503, content={"status": "unavailable"})
+    return {"status": "ok"} 
\ No newline at end of file
@@ -2,6 +2,9 @@ from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
 
+# Types whose amount is stored positive but leaves the balance.
+DEBIT_TYPES = frozenset(("payout_approved",))
+
 class CoinTransaction(BaseModel):
     user_id: str
     type: str  # purchase, gift, payout, etc.
@@ -9,4 +9,11 @@ class StreamSession(BaseModel):
     title: Optional[str] = None
     start_time: datetime = Field(default_factory=datetime.utcnow)
     end_time: Optional[datetime] = None
-    is_active: bool = True 
\ No newline at end of file
+    is_active: bool = True 
+    # Presence totals, flushed periodically while the stream is watched (app/core/presence.py).
+    peak_viewers: int = 0
+    viewer_joins: int = 0
+    watch_seconds: float = 0
+
+class ActiveStream(StreamSession):
+    viewers: int = 0
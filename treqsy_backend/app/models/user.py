@@ -15,4 +15,28 @@ class User(BaseModel):
     role: Role = Role.USER
     is_active: bool = True
     is_vip: bool = False
-    coins: int = 0 
\ No newline at end of file
+    coins: int = 0 
+
+class Principal:
+    """The caller as described by a verified access token.
+
+    Built once per token and cached, so authenticated requests skip pydantic
+    validation. Exposes the User attributes the routers read.
+    """
+
+    __slots__ = ("id", "email", "role", "expires_at")
+
+    hashed_password = ""
+    is_active = True
+    is_vip = False
+    coins = 0
+
+    def __init__(self, id: Optional[str], email: Optional[str], role: Role, expires_at: Optional[float] = None):
+        self.id = id
+        self.email = email
+        self.role = role
+        # The token's exp (epoch seconds); long-lived sockets are closed past it.
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f"Principal(id={self.id!r}, email={self.email!r}, role={self.role.value!r})"
@@ -0,0 +1,152 @@
+"""Coin analytics: materialized rollups vs. aggregating on request.
+
+Drives purchases, gifts (direct and batched) and payouts through the ledger
+with the rollups attached, then checks that the live rollups, a backfill from
+the ledger history and a full scan of coin_transactions all agree. Finally
+seeds --history extra ledger entries and times the admin read both ways.
+
+    python -m benchmarks.analytics_rollups --users 200 --ops 5000 --history 50000
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+from app.core.analytics import CoinRollups
+from app.core.gift_batcher import GiftBatcher
+from app.core.ledger import InsufficientFunds, Ledger
+
+
+async def full_scan(transactions) -> dict:
+    # What an on-request aggregation has to do: read every ledger entry.
+    totals = defaultdict(int)
+    spent, earned = defaultdict(int), defaultdict(int)
+    async for entry in transactions.find({}):
+        kind, amount = entry["type"], entry["amount"]
+        if kind == "purchase":
+            totals["coins_purchased"] += amount
+        elif kind == "gift_sent":
+            totals["coins_spent"] -= amount
+            spent[entry["user_id"]] -= amount
+        elif kind == "gift_received":
+            earned[entry["user_id"]] += amount
+        elif kind == "payout_approved":
+            totals["coins_payout"] += amount
+    top = lambda board: sorted(board.items(), key=lambda kv: -kv[1])[:10]
+    return {**totals, "top_spenders": top(spent), "top_earners": top(earned)}
+
+
+def view(totals: dict, leaders: dict) -> dict:
+    return {
+        "coins_purchased": totals.get("coins_purchased", 0),
+        "coins_spent": totals.get("coins_spent", 0),
+        "coins_payout": totals.get("coins_payout", 0),
+        "top_spenders": [(row["user_id"], row["coins"]) for row in leaders.get("top_spenders", [])],
+        "top_earners": [(row["user_id"], row["coins"]) for row in leaders.get("top_earners", [])],
+    }
+
+
+def same_boards(a: list, b: list) -> bool:
+    # Users tied on coins may be listed in either order, so compare the coin column.
+    return [coins for _, coins in a] == [coins for _, coins in b]
+
+
+async def run(users: int, ops: int, history: int) -> bool:
+    db = AsyncMongoMockClient()["analytics_bench"]
+    ids = [f"user-{i}" for i in range(users)]
+    await db.users.insert_many([{"_id": uid, "email": f"{uid}@example.com", "coins": 0} for uid in ids])
+    rollups = CoinRollups(db.coin_rollups, db.coin_user_totals, db.users, flush_interval=0.05)
+    ledger = Ledger(db.users, db.coin_transactions, db.payout_requests, db.ledger_idempotency,
+                    on_commit=rollups.record)
+    batcher = GiftBatcher(ledger, db.gift_batches, window=0.01)
+    rollups.start()
+
+    async def one(i: int):
+        user, other = random.sample(ids, 2)
+        roll = random.random()
+        try:
+            if roll < 0.3:
+                await ledger.purchase(user, random.randint(10, 500))
+            elif roll < 0.6:
+                await ledger.gift(user, other, random.randint(1, 50))
+            elif roll < 0.95:
+                await batcher.gift(user, other, random.randint(1, 50), "stream-1")
+            else:
+                request = await db.payout_requests.insert_one(
+                    {"user_id": user, "amount": random.randint(1, 50), "status": "pending"}
+                )
+                await ledger.approve_payout(request.inserted_id)
+        except InsufficientFunds:
+            pass
+
+    await asyncio.gather(*(one(i) for i in range(ops)))
+    await batcher.close()
+    await ledger.close()
+    await rollups.close()
+
+    problems = []
+    expected = await full_scan(db.coin_transactions)
+    for label, actual in (
+        ("live", view(await rollups.summary(), await rollups.leaders())),
+        ("backfill", None),
+    ):
+        if actual is None:
+            rebuilt = CoinRollups(db.rebuilt_rollups, db.rebuilt_user_totals, db.users)
+            await rebuilt.backfill(db.coin_transactions, db.users, batch_size=500)
+            actual = view(await rebuilt.summary(), await rebuilt.leaders())
+        for key in ("coins_purchased", "coins_spent", "coins_payout"):
+            if actual[key] != expected.get(key, 0):
+                problems.append(f"{label} {key}={actual[key]} expected {expected.get(key, 0)}")
+        for board in ("top_spenders", "top_earners"):
+            if not same_boards(actual[board], expected[board]):
+                problems.append(f"{label} {board} {actual[board][:3]} expected {expected[board][:3]}")
+    print(f"{ops} ledger operations -> {await db.coin_transactions.count_documents({})} entries; "
+          f"live rollups and backfill checked against a full scan")
+
+    # Read cost once the ledger has real history behind it.
+    start = datetime.utcnow() - timedelta(days=90)
+    await db.coin_transactions.insert_many([
+        {"_id": ObjectId(), "user_id": random.choice(ids), "type": "purchase", "amount": random.randint(1, 500),
+         "timestamp": start + timedelta(seconds=i * 90 * 86400 // max(history, 1))}
+        for i in range(history)
+    ])
+    rounds = 20
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        await rollups.summary()
+        await rollups.leaders()
+        await rollups.days(7)
+    rollup_ms = (time.perf_counter() - t0) / rounds * 1000
+    t0 = time.perf_counter()
+    await full_scan(db.coin_transactions)
+    scan_ms = (time.perf_counter() - t0) * 1000
+    entries = await db.coin_transactions.count_documents({})
+    print(f"admin analytics read over {entries} entries: rollups {rollup_ms:.2f}ms, full scan {scan_ms:.0f}ms")
+    t0 = time.perf_counter()
+    rebuilt = CoinRollups(db.rebuilt_rollups, db.rebuilt_user_totals, db.users)
+    processed = await rebuilt.backfill(db.coin_transactions, db.users)
+    print(f"backfill: {processed} entries in {time.perf_counter() - t0:.1f}s")
+
+    for problem in problems:
+        print("FAIL:", problem)
+    print("PASS" if not problems else "FAIL")
+    return not problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--history", type=int, default=50000, help="extra ledger entries for the read comparison")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.users, args.ops, args.history)) else 1)
+
+
+if __name__ == "__main__":
+    main()
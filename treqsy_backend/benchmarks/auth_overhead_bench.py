@@ -0,0 +1,80 @@
+"""Per-request authentication overhead, before and after the token cache.
+
+Micro: the old get_current_user body (jose decode + pydantic User with
+EmailStr validation) against the cached Principal path. HTTP: sequential
+requests through the ASGI app to /users/me and /admin/dashboard (two stacked
+role dependencies) with the token cache disabled and enabled.
+
+    python -m benchmarks.auth_overhead_bench --iterations 20000 --requests 2000
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from app.core.dependencies import get_current_user
+from app.core.security import create_access_token, decode_access_token, token_cache
+from app.main import app
+from app.models.user import User
+
+
+def legacy_get_current_user(token: str) -> User:
+    payload = decode_access_token(token)
+    return User(id=payload.get("sub"), email=payload.get("email"), role=payload.get("role"), hashed_password="")
+
+
+async def micro(token: str, iterations: int):
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        legacy_get_current_user(token)
+    legacy = (time.perf_counter() - t0) / iterations
+
+    token_cache.clear()
+    saved, token_cache.maxsize = token_cache.maxsize, 0
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        await get_current_user(token)
+    uncached = (time.perf_counter() - t0) / iterations
+
+    token_cache.maxsize = saved
+    await get_current_user(token)
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        await get_current_user(token)
+    cached = (time.perf_counter() - t0) / iterations
+
+    print(f"get_current_user per call: legacy={legacy * 1e6:.1f}us "
+          f"decode+Principal={uncached * 1e6:.1f}us cached={cached * 1e6:.2f}us")
+
+
+async def http(token: str, requests: int):
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path in ("/users/me", "/admin/dashboard"):
+            for label, size in (("cache off", 0), ("cache on", 10000)):
+                token_cache.clear()
+                token_cache.maxsize = size
+                await client.get(path, headers=headers)
+                t0 = time.perf_counter()
+                for _ in range(requests):
+                    r = await client.get(path, headers=headers)
+                    assert r.status_code == 200, r.text
+                elapsed = time.perf_counter() - t0
+                print(f"{path:>17} {label:>9}: {requests / elapsed:8.0f} req/s "
+                      f"{elapsed / requests * 1e6:8.1f}us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    token = create_access_token({"sub": "bench-admin", "email": "admin@example.com", "role": "master_admin"})
+    asyncio.run(micro(token, args.iterations))
+    asyncio.run(http(token, args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Multi-process chat relay check and throughput benchmark.
+
+Starts the RESP stand-in (or uses --redis-url), then launches several worker
+processes, each with its own ConnectionManager + RedisBroker and a set of fake
+viewers in one room. Every worker broadcasts its share of messages; every viewer
+on every worker must receive all of them.
+
+    python -m benchmarks.broker_bench --workers 4 --viewers 50 --messages 20000
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import subprocess
+import sys
+import time
+
+from app.core.broker import RedisBroker
+from benchmarks.fanout_bench import offline_manager, percentile
+
+ROOM = "bench-room"
+
+
+class CountingWebSocket:
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    async def accept(self):
+        pass
+
+    async def send(self, message: dict):
+        self.stats["received"] += 1
+        sent = float(message["text"].split("|", 1)[0])
+        self.stats["latencies"].append(time.time() - sent)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def worker_main(index: int, url: str, viewers: int, messages: int, barrier, results):
+    manager = offline_manager(RedisBroker(url), queue_size=messages * barrier.parties + 1)
+    await manager.start()
+    stats = {"received": 0, "latencies": []}
+    for _ in range(viewers):
+        await manager.connect(CountingWebSocket(stats), ROOM)
+    await asyncio.sleep(0.5)  # let SUBSCRIBE reach the server
+    await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+
+    expected = viewers * messages * barrier.parties
+    started = time.perf_counter()
+    for seq in range(messages):
+        await manager.broadcast(f"{time.time()}|w{index}-{seq}", ROOM)
+        if seq % 256 == 0:
+            await asyncio.sleep(0)
+    deadline = time.perf_counter() + 30
+    while stats["received"] < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await manager.stop()
+    ms = [x * 1000 for x in stats["latencies"]]
+    results.put({
+        "worker": index,
+        "received": stats["received"],
+        "expected": expected,
+        "elapsed": elapsed,
+        "p50": percentile(ms, 50),
+        "p99": percentile(ms, 99),
+    })
+
+
+def run_worker(*args):
+    asyncio.run(worker_main(*args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--viewers", type=int, default=50, help="viewers per worker")
+    parser.add_argument("--messages", type=int, default=5000, help="messages broadcast by each worker")
+    parser.add_argument("--redis-url", default="", help="use a real Redis instead of the stand-in")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+
+    server = None
+    url = args.redis_url
+    if not url:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.resp_server", "--port", str(args.port)],
+            stdout=subprocess.PIPE, text=True,
+        )
+        server.stdout.readline()
+        url = f"redis://127.0.0.1:{args.port}"
+
+    try:
+        ctx = mp.get_context("spawn")
+        barrier = ctx.Barrier(args.workers)
+        results = ctx.Queue()
+        procs = [
+            ctx.Process(target=run_worker, args=(i, url, args.viewers, args.messages, barrier, results))
+            for i in range(args.workers)
+        ]
+        for p in procs:
+            p.start()
+        rows = [results.get(timeout=120) for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        if server is not None:
+            server.terminate()
+
+    ok = True
+    total_messages = args.messages * args.workers
+    for row in sorted(rows, key=lambda r: r["worker"]):
+        ok &= row["received"] == row["expected"]
+        print(
+            f"worker {row['worker']}: delivered {row['received']}/{row['expected']} "
+            f"in {row['elapsed']:.2f}s p50={row['p50']:.1f}ms p99={row['p99']:.1f}ms"
+        )
+    slowest = max(r["elapsed"] for r in rows)
+    print(f"cluster: {total_messages} messages across {args.workers} workers, "
+          f"{total_messages / slowest:.0f} msg/s relayed, "
+          f"{sum(r['received'] for r in rows) / slowest:.0f} deliveries/s")
+    print("PASS" if ok else "FAIL: messages missing across workers")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Chat history: write-behind persistence rate, and what history costs a broadcast.
+
+  * persist    --messages chat messages over --rooms rooms are published as
+               fast as possible; reports how long the write-behind buffer took
+               to save them all (messages/s persisted) and in how many batches;
+  * broadcast  --viewers viewers in one room receive --broadcasts chat
+               messages sent through ConnectionManager.chat every --interval,
+               --rounds times each with history off and on (sequencing, ring, queueing
+               and flushes in the background); reports the chat() call time
+               and delivery latency for each;
+  * join       the time to replay the ring to a joining viewer.
+
+Runs against mongomock unless --real, which uses MONGODB_URI (the
+chat_messages collection of a scratch database, dropped afterwards).
+
+    python -m benchmarks.chat_history_bench --messages 100000 --viewers 1000
+    python -m benchmarks.chat_history_bench --real --messages 500000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import time
+
+from app.api.streaming import ConnectionManager
+from app.core import database
+from app.core.chat_history import ChatHistory
+from app.core.presence import Presence
+from benchmarks.fanout_bench import NullCollection, percentile
+
+class Viewer:
+    def __init__(self, latencies: list):
+        self.latencies = latencies
+
+    async def accept(self):
+        pass
+
+    async def send(self, message: dict):
+        text = json.loads(message["text"])["text"]
+        if text.startswith("t="):
+            self.latencies.append(time.perf_counter() - float(text[2:]))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def persist(collection, messages: int, rooms: int, batch_size: int):
+    history = ChatHistory(collection, batch_size=batch_size)
+    history.start()
+    started = time.perf_counter()
+    for i in range(messages):
+        history.publish(f"room-{i % rooms}", f"message {i}")
+        if i % batch_size == 0:
+            await asyncio.sleep(0)
+    published = time.perf_counter() - started
+    while history.persisted + history.dropped < messages:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await history.close()
+    print(f"persist:   {messages} messages published in {published:.2f}s, all saved after {elapsed:.2f}s "
+          f"({history.persisted / elapsed:.0f} msg/s persisted, {history.batches} batches, "
+          f"{history.dropped} dropped)")
+
+
+async def broadcast(collection, room: str, enabled: bool, viewers: int, broadcasts: int, interval: float):
+    gc.collect()  # so the previous run's garbage isn't collected during this one
+    manager = ConnectionManager(history=ChatHistory(collection, enabled=enabled), presence=Presence(NullCollection()))
+    await manager.start()
+    latencies = []
+    sockets = [Viewer(latencies) for _ in range(viewers)]
+    for ws in sockets:
+        await manager.connect(ws, room)
+    await asyncio.sleep(0.1)  # the first join's background history load
+    calls = []
+    for _ in range(broadcasts):
+        t0 = time.perf_counter()
+        await manager.chat(f"t={t0}", room)
+        calls.append(time.perf_counter() - t0)
+        await asyncio.sleep(interval)
+    await asyncio.sleep(0.2)  # in-flight deliveries
+
+    join_us = 0.0
+    if enabled:
+        late = Viewer([])
+        t0 = time.perf_counter()
+        for _ in range(100):
+            await manager.connect(late, room)
+            manager.disconnect(late, room)
+        join_us = (time.perf_counter() - t0) / 100 * 1e6
+    for ws in sockets:
+        manager.disconnect(ws, room)
+    await manager.stop()
+
+    ms = [x * 1000 for x in latencies]
+    call_us = [x * 1e6 for x in calls]
+    print(f"history {'on ' if enabled else 'off'}: chat() p50={percentile(call_us, 50):.0f}us "
+          f"p99={percentile(call_us, 99):.0f}us; delivery p50={percentile(ms, 50):.2f}ms "
+          f"p99={percentile(ms, 99):.2f}ms ({len(latencies)}/{viewers * broadcasts} delivered)"
+          + (f"; join replay {join_us:.0f}us ({manager.history.size} frames)" if enabled else ""))
+
+
+async def run(args):
+    if args.real:
+        client = database.get_client()
+        collection = client["chat_history_bench"]["chat_messages"]
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+
+        client = AsyncMongoMockClient()
+        collection = client["bench"]["chat_messages"]
+    await persist(collection, args.messages, args.rooms, args.batch_size)
+    # Alternating, each in a room of its own, so drift hits both settings alike.
+    for run_index, enabled in enumerate((False, True) * args.rounds):
+        await broadcast(collection, f"bench-room-{run_index}", enabled, args.viewers, args.broadcasts, args.interval)
+    if args.real:
+        await client.drop_database("chat_history_bench")
+        database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--viewers", type=int, default=1000)
+    parser.add_argument("--broadcasts", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between chat messages")
+    parser.add_argument("--real", action="store_true", help="use MONGODB_URI instead of mongomock")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
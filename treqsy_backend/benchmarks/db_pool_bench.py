@@ -0,0 +1,102 @@
+"""Startup time and connections-per-worker for the shared Motor client.
+
+Compares the current setup (one pooled client from app.core.database) with the
+previous one (a separate default client per router module), against the
+database in MONGODB_URI. Each mode runs a burst of concurrent reads over the
+users, streams and coin_transactions collections and counts the pool
+connections it had to open.
+
+    MONGODB_URI=mongodb://localhost:27017 python -m benchmarks.db_pool_bench --concurrency 200
+"""
+import argparse
+import asyncio
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from app.core import database
+
+COLLECTIONS = ["users", "streams", "coin_transactions"]
+
+
+class PoolCounter(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.opened = 0
+        self.closed = 0
+        self.peak = 0
+
+    def connection_created(self, event):
+        self.opened += 1
+        self.peak = max(self.peak, self.opened - self.closed)
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): pass
+    def connection_checked_out(self, event): pass
+    def connection_checked_in(self, event): pass
+
+
+async def burst(collections: list, concurrency: int):
+    await asyncio.gather(*(
+        collections[i % len(collections)].find_one({"_id": f"missing-{i}"})
+        for i in range(concurrency)
+    ))
+
+
+async def run_legacy(concurrency: int):
+    counter = PoolCounter()
+    started = time.perf_counter()
+    clients = [AsyncIOMotorClient(database.MONGO_URI, event_listeners=[counter]) for _ in range(3)]
+    await asyncio.gather(*(c.admin.command("ping") for c in clients))
+    startup = time.perf_counter() - started
+    collections = [c[database.MONGO_DB_NAME][name] for c, name in zip(clients, COLLECTIONS)]
+    t0 = time.perf_counter()
+    await burst(collections, concurrency)
+    elapsed = time.perf_counter() - t0
+    for c in clients:
+        c.close()
+    return startup, elapsed, counter
+
+
+async def run_shared(concurrency: int):
+    counter = PoolCounter()
+    started = time.perf_counter()
+    database.connect(event_listeners=[counter])
+    await database.ping()
+    startup = time.perf_counter() - started
+    collections = [database.collection(name) for name in COLLECTIONS]
+    t0 = time.perf_counter()
+    await burst(collections, concurrency)
+    elapsed = time.perf_counter() - t0
+    database.close()
+    return startup, elapsed, counter
+
+
+async def main_async(concurrency: int):
+    print(f"MONGODB_URI={database.MONGO_URI} concurrency={concurrency}")
+    print(f"shared pool options: {database.client_options()}")
+    for label, runner in (("per-module clients", run_legacy), ("shared client", run_shared)):
+        startup, elapsed, counter = await runner(concurrency)
+        print(
+            f"{label:>20}: startup={startup * 1000:.1f}ms burst={elapsed * 1000:.1f}ms "
+            f"connections opened={counter.opened} peak open={counter.peak}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Export one user's full transaction history: NDJSON streaming vs. loading it.
+
+Seeds --count coin_transactions for one user, then exports them three ways
+and reports throughput and the growth of the process RSS during each:
+
+  * ndjson   GET /admin/coins/transactions/{user}?format=ndjson, driven
+             straight through the ASGI app so the body is consumed chunk by
+             chunk as a client would, never buffered;
+  * pages    the first keyset page (?limit=1000) and one 90% of the way
+             in (?cursor=...): with keyset pagination both cost the same;
+  * to_list  what the old handler did without its 100-row cap: load every
+             document, then encode one JSON array.
+
+Runs on mongomock by default, or against MONGODB_URI with --real. mongomock
+has no indexes and sorts in Python, so expect a few thousand docs/s there;
+the memory comparison holds either way.
+
+    python -m benchmarks.export_bench --count 1000000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.api import admin
+from app.core.database import get_coin_transactions_collection
+from app.core.indexes import ensure_indexes
+from app.core.pagination import encode_cursor
+from app.core.responses import json_default
+
+USER = "export-user"
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class RssSampler:
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.base = self.peak = rss_mb()
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, rss_mb())
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        self.base = self.peak = rss_mb()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        self.peak = max(self.peak, rss_mb())
+
+    @property
+    def growth(self) -> float:
+        return self.peak - self.base
+
+
+async def get(app, path: str, query: str = "", headers: Optional[dict] = None):
+    """Issue one GET through the ASGI app, yielding the body chunks as they are sent."""
+    queue: asyncio.Queue = asyncio.Queue()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("bench", 0), "server": ("bench", 80),
+    }
+
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # The client never disconnects; block like a quiet socket would.
+        await asyncio.Future()
+
+    async def send(message):
+        await queue.put(message)
+
+    task = asyncio.create_task(app(scope, receive, send))
+    start = await queue.get()
+    response_headers = {k.decode().lower(): v.decode() for k, v in start["headers"]}
+
+    async def body():
+        while True:
+            message = await queue.get()
+            yield message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        await task
+
+    return start["status"], response_headers, body()
+
+
+async def seed(collection, count: int):
+    start = datetime.utcnow() - timedelta(days=365)
+    batch = 10000
+    for offset in range(0, count, batch):
+        await collection.insert_many([
+            {"user_id": USER, "type": random.choice(("purchase", "gift_sent", "gift_received")),
+             "amount": random.randint(1, 500), "timestamp": start + timedelta(seconds=i * 30), "details": None}
+            for i in range(offset, min(offset + batch, count))
+        ])
+
+
+async def run(count: int, real: bool):
+    if real:
+        from app.core import database
+
+        client = database.connect()
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+
+        client = AsyncMongoMockClient()
+    db_name = f"export_bench_{uuid.uuid4().hex[:8]}"
+    db = client[db_name]
+    await ensure_indexes(db)
+    t0 = time.perf_counter()
+    await seed(db.coin_transactions, count)
+    print(f"seeded {count} transactions in {time.perf_counter() - t0:.1f}s, RSS {rss_mb():.0f}MB")
+
+    from fastapi import FastAPI
+
+    app = FastAPI()
+    app.include_router(admin.router)
+    app.dependency_overrides[get_coin_transactions_collection] = lambda: db.coin_transactions
+    path = f"/admin/coins/transactions/{USER}"
+
+    async with RssSampler() as rss:
+        t0 = time.perf_counter()
+        status, _, body = await get(app, path, "format=ndjson")
+        size = lines = 0
+        async for chunk in body:
+            size += len(chunk)
+            lines += chunk.count(b"\n")
+        elapsed = time.perf_counter() - t0
+    assert status == 200 and lines == count, (status, lines)
+    print(f"  ndjson: {lines} docs, {size / 2 ** 20:.0f}MB in {elapsed:.1f}s "
+          f"({lines / elapsed:.0f} docs/s), RSS growth {rss.growth:.0f}MB")
+
+    deep = await db.coin_transactions.find({"user_id": USER}).sort(admin.NEWEST_FIRST).skip(count * 9 // 10) \
+        .limit(1).to_list(1)
+    timings = []
+    async with RssSampler() as rss:
+        for query in ("limit=1000", f"limit=1000&cursor={encode_cursor(deep[0], admin.NEWEST_FIRST)}"):
+            t0 = time.perf_counter()
+            status, _, body = await get(app, path, query)
+            docs = len(json.loads(b"".join([chunk async for chunk in body])))
+            timings.append(f"{docs} docs in {(time.perf_counter() - t0) * 1000:.0f}ms")
+            assert status == 200, status
+    print(f"   pages: first page {timings[0]}, page at 90% {timings[1]}, RSS growth {rss.growth:.0f}MB")
+
+    async with RssSampler() as rss:
+        t0 = time.perf_counter()
+        everything = await db.coin_transactions.find({"user_id": USER}).sort("timestamp", -1).to_list(None)
+        payload = json.dumps(everything, default=json_default)
+        elapsed = time.perf_counter() - t0
+    print(f" to_list: {len(everything)} docs, {len(payload) / 2 ** 20:.0f}MB in {elapsed:.1f}s "
+          f"({len(everything) / elapsed:.0f} docs/s), RSS growth {rss.growth:.0f}MB")
+
+    await client.drop_database(db_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument("--real", action="store_true", help="use MONGODB_URI instead of mongomock")
+    args = parser.parse_args()
+    asyncio.run(run(args.count, args.real))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Fan-out load benchmark for the /ws/chat broadcast path.
+
+Drives many in-process fake WebSocket clients through ConnectionManager and
+reports the delay between a broadcast call and delivery on each socket.
+
+    python -m benchmarks.fanout_bench --viewers 20000 --messages 50 --slow 0.01
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from app.api.streaming import ConnectionManager
+from app.core.chat_history import ChatHistory
+from app.core.presence import Presence
+
+
+class FakeWebSocket:
+    def __init__(self, sent_at: dict, latencies: list, delay: float = 0.0):
+        self.sent_at = sent_at
+        self.latencies = latencies
+        self.delay = delay
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send(self, message: dict):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.latencies.append(time.perf_counter() - self.sent_at[message["text"]])
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+
+class NullCollection:
+    """Accepts every write and finds nothing: benchmarks measure the app, not a database."""
+
+    async def insert_many(self, documents, ordered=True):
+        pass
+
+    async def update_one(self, query, update):
+        pass
+
+    def find(self, *args, **kwargs):
+        return self
+
+    def sort(self, *args):
+        return self
+
+    def limit(self, count):
+        return self
+
+    async def to_list(self, length):
+        return []
+
+
+def offline_manager(*args, **kwargs) -> ConnectionManager:
+    """A ConnectionManager for benchmarks: no chat history, and presence writes go
+    nowhere, so nothing reaches the MONGODB_URI database."""
+    return ConnectionManager(*args, history=ChatHistory(enabled=False), presence=Presence(NullCollection()), **kwargs)
+
+
+def percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(viewers: int, messages: int, slow_ratio: float, slow_delay: float, interval: float):
+    manager = offline_manager()
+    sent_at, latencies = {}, []
+    sockets = []
+    for _ in range(viewers):
+        delay = slow_delay if random.random() < slow_ratio else 0.0
+        ws = FakeWebSocket(sent_at, latencies, delay)
+        sockets.append(ws)
+        await manager.connect(ws, "bench-room")
+
+    broadcast_times = []
+    started = time.perf_counter()
+    for seq in range(messages):
+        text = f"msg-{seq}"
+        sent_at[text] = time.perf_counter()
+        t0 = time.perf_counter()
+        await manager.broadcast(text, "bench-room")
+        broadcast_times.append(time.perf_counter() - t0)
+        await asyncio.sleep(interval)
+
+    # Give fast writers a moment to drain; slow ones are what the queue bounds protect against.
+    await asyncio.sleep(max(0.5, slow_delay * 2))
+    elapsed = time.perf_counter() - started
+
+    room = manager.active_connections.get("bench-room", {})
+    dropped = sum(c.dropped for c in room.values())
+    evicted = viewers - len(room)
+    for ws in sockets:
+        manager.disconnect(ws, "bench-room")
+
+    ms = [x * 1000 for x in latencies]
+    print(f"viewers={viewers} messages={messages} slow={slow_ratio:.1%} ({slow_delay * 1000:.0f}ms/send)")
+    print(f"deliveries={len(latencies)} dropped={dropped} evicted={evicted} elapsed={elapsed:.2f}s")
+    print(f"broadcast call: mean={statistics.mean(broadcast_times) * 1000:.2f}ms max={max(broadcast_times) * 1000:.2f}ms")
+    print(
+        "delivery latency: "
+        f"p50={percentile(ms, 50):.2f}ms p95={percentile(ms, 95):.2f}ms "
+        f"p99={percentile(ms, 99):.2f}ms max={max(ms, default=0):.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--slow", type=float, default=0.01, help="fraction of slow viewers")
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="seconds per send for slow viewers")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between broadcasts")
+    args = parser.parse_args()
+    asyncio.run(run(args.viewers, args.messages, args.slow, args.slow_delay, args.interval))
+
+
+if __name__ == "__main__":
+    main()
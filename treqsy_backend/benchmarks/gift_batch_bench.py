@@ -0,0 +1,121 @@
+"""Gift burst benchmark: database operations and ack latency per path.
+
+Many viewers gift the host of one stream at a steady rate. Compares the
+original handler (two $inc and an insert_many per gift), the per-request
+ledger path and the gift batcher, on mongomock with every collection call
+counted as one database operation.
+
+    python -m benchmarks.gift_batch_bench --viewers 500 --rate 2000 --seconds 3
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from app.core.gift_batcher import GiftBatcher
+from app.core.ledger import Ledger
+from app.models.coin_transaction import CoinTransaction
+from benchmarks.fanout_bench import percentile
+
+HOST = "host-1"
+STREAM = "stream-1"
+
+
+class CountingCollection:
+    def __init__(self, collection, counter: dict):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in ("database", "name") or not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self._counter["ops"] += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+async def setup(viewers: int):
+    db = AsyncMongoMockClient()["gift_bench"]
+    await db.users.insert_many(
+        [{"_id": HOST, "coins": 0}] + [{"_id": f"viewer-{i}", "coins": 10 ** 9} for i in range(viewers)]
+    )
+    counter = {"ops": 0}
+    wrap = lambda name: CountingCollection(db[name], counter)
+    return db, counter, wrap
+
+
+async def drive(send, viewers: int, rate: int, seconds: float):
+    latencies = []
+    total = int(rate * seconds)
+
+    async def one(i: int):
+        t0 = time.perf_counter()
+        await send(f"viewer-{i % viewers}", 1 + i % 5)
+        latencies.append(time.perf_counter() - t0)
+
+    tasks = []
+    started = time.perf_counter()
+    for i in range(total):
+        # Pace arrivals at the target rate.
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - started
+
+
+async def run_path(label: str, viewers: int, rate: int, seconds: float, window: float):
+    db, counter, wrap = await setup(viewers)
+    users, transactions = wrap("users"), wrap("coin_transactions")
+    closer = None
+
+    if label == "legacy":
+        async def send(sender, amount):
+            await users.update_one({"_id": sender}, {"$inc": {"coins": -amount}})
+            await users.update_one({"_id": HOST}, {"$inc": {"coins": amount}})
+            await transactions.insert_many([
+                CoinTransaction(user_id=sender, type="gift_sent", amount=-amount, timestamp=datetime.utcnow()).dict(),
+                CoinTransaction(user_id=HOST, type="gift_received", amount=amount, timestamp=datetime.utcnow()).dict(),
+            ])
+    else:
+        ledger = Ledger(users, transactions, wrap("payout_requests"), wrap("ledger_idempotency"))
+        if label == "ledger":
+            async def send(sender, amount):
+                await ledger.gift(sender, HOST, amount)
+            closer = ledger.close
+        else:
+            batcher = GiftBatcher(ledger, wrap("gift_batches"), window=window)
+
+            async def send(sender, amount):
+                await batcher.gift(sender, HOST, amount, STREAM)
+            closer = batcher.close
+
+    latencies, elapsed = await drive(send, viewers, rate, seconds)
+    if closer is not None:
+        await closer()
+    host = await db.users.find_one({"_id": HOST})
+    ms = [x * 1000 for x in latencies]
+    print(f"{label:>8}: gifts={len(ms)} db ops={counter['ops']} ({counter['ops'] / len(ms):.2f}/gift, "
+          f"{counter['ops'] / elapsed:.0f}/s) ack p50={percentile(ms, 50):.1f}ms p99={percentile(ms, 99):.1f}ms "
+          f"host coins={host['coins']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, default=500)
+    parser.add_argument("--rate", type=int, default=1000, help="gifts per second")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--window", type=float, default=0.05, help="batch window in seconds")
+    args = parser.parse_args()
+    for label in ("legacy", "ledger", "batched"):
+        asyncio.run(run_path(label, args.viewers, args.rate, args.seconds, args.window))
+
+
+if __name__ == "__main__":
+    main()
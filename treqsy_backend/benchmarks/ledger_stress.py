@@ -0,0 +1,115 @@
+"""Concurrency stress test for the coin ledger.
+
+Fires thousands of parallel gifts between a small pool of users (so many of
+them contend for the same balances and some would overdraw), replays a share
+of them with the same idempotency key, then checks that:
+
+  * the total number of coins is conserved and no balance went negative;
+  * every user's balance equals its starting balance plus its ledger entries;
+  * no idempotency key was applied twice.
+
+Runs on mongomock by default, or against MONGODB_URI with --real.
+
+    python -m benchmarks.ledger_stress --users 50 --gifts 5000 --concurrency 500
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import uuid
+
+from app.core.indexes import ensure_indexes
+from app.core.ledger import DuplicateRequest, InsufficientFunds, Ledger
+
+START_BALANCE = 1000
+
+
+async def run(users: int, gifts: int, concurrency: int, replay: float, real: bool, transactions: bool):
+    if real:
+        from app.core import database
+
+        client = database.connect()
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+
+        client = AsyncMongoMockClient()
+    db_name = f"ledger_stress_{uuid.uuid4().hex[:8]}"
+    db = client[db_name]
+    await ensure_indexes(db)
+    ids = [f"user-{i}" for i in range(users)]
+    await db.users.insert_many([{"_id": uid, "email": f"{uid}@example.com", "coins": START_BALANCE} for uid in ids])
+    ledger = Ledger(db.users, db.coin_transactions, db.payout_requests, db.ledger_idempotency,
+                    use_transactions=transactions)
+
+    outcomes = {"ok": 0, "insufficient": 0, "duplicate": 0}
+    slots = asyncio.Semaphore(concurrency)
+
+    async def gift(key: str, sender: str, recipient: str, amount: int):
+        async with slots:
+            try:
+                await ledger.gift(sender, recipient, amount, key)
+                outcomes["ok"] += 1
+            except InsufficientFunds:
+                outcomes["insufficient"] += 1
+            except DuplicateRequest:
+                outcomes["duplicate"] += 1
+
+    jobs = []
+    for _ in range(gifts):
+        sender, recipient = random.sample(ids, 2)
+        job = (uuid.uuid4().hex, sender, recipient, random.randint(1, 400))
+        jobs.append(job)
+        if random.random() < replay:
+            jobs.append(job)
+    random.shuffle(jobs)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(gift(*job) for job in jobs))
+    await ledger.close()
+    elapsed = time.perf_counter() - started
+
+    balances = {doc["_id"]: doc["coins"] async for doc in db.users.find({})}
+    ledger_sums = {uid: 0 for uid in ids}
+    async for entry in db.coin_transactions.find({}):
+        ledger_sums[entry["user_id"]] += entry["amount"]
+    keys = await db.coin_transactions.distinct("idempotency_key")
+    entries = await db.coin_transactions.count_documents({})
+
+    problems = []
+    if sum(balances.values()) != START_BALANCE * users:
+        problems.append(f"total coins {sum(balances.values())} != {START_BALANCE * users}")
+    if any(v < 0 for v in balances.values()):
+        problems.append("negative balance")
+    mismatched = [uid for uid in ids if balances[uid] != START_BALANCE + ledger_sums[uid]]
+    if mismatched:
+        problems.append(f"{len(mismatched)} balances disagree with their ledger entries")
+    if entries != 2 * len(keys) or len(keys) != outcomes["ok"]:
+        problems.append(f"{entries} entries for {len(keys)} keys and {outcomes['ok']} applied gifts")
+
+    await client.drop_database(db_name)
+    print(f"attempts={len(jobs)} applied={outcomes['ok']} insufficient={outcomes['insufficient']} "
+          f"duplicates rejected={outcomes['duplicate']}")
+    print(f"{len(jobs) / elapsed:.0f} transfers/s attempted, {outcomes['ok'] / elapsed:.0f} applied/s; "
+          f"ledger entries written in {ledger.writer.batches} insert_many calls")
+    for problem in problems:
+        print("FAIL:", problem)
+    print("PASS" if not problems else "FAIL")
+    return not problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--gifts", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--replay", type=float, default=0.05, help="share of gifts sent twice with one key")
+    parser.add_argument("--real", action="store_true", help="use MONGODB_URI instead of mongomock")
+    parser.add_argument("--transactions", action="store_true", help="use multi-document transactions")
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.users, args.gifts, args.concurrency, args.replay, args.real, args.transactions))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
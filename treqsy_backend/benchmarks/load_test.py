@@ -0,0 +1,395 @@
+"""Load test for the whole API: mixed workloads against a real server.
+
+Boots app.main:app under uvicorn in a child process, against mongomock
+seeded with app.core.seed (or, with --real, against MONGODB_URI, which is
+seeded the same way unless --no-seed), or drives an already running server
+given with --url. Scenarios, each run for --duration seconds:
+
+  * login    POST /auth/login as random seeded users (bcrypt-bound);
+  * me       GET /users/me polling with bearer tokens;
+  * streams  hosts starting and ending streams;
+  * active   GET /streams/active polling;
+  * gifts    bursts of POST /admin/coins/gift between seeded users;
+  * chat     --chat-clients WebSocket viewers over --chat-rooms rooms, a
+             share of them sending; reports connect time and delivery latency;
+  * mixed    all of the above at once.
+
+Each operation reports throughput and p50/p95/p99/max latency; non-2xx
+answers are counted by status (4xx such as 409 insufficient coins are
+expected under gifts; 429/503 mean the admission limits kicked in).
+Results are written as JSON with --out; --compare checks a run against an
+earlier one and exits 1 when an operation's p95 or throughput regressed by
+more than --tolerance.
+
+The spawned server runs with RATE_LIMIT_ENABLED=0 unless --keep-limits,
+since a load test is one client hammering a handful of accounts.
+
+    python -m benchmarks.load_test --scenarios all --duration 10 --out before.json
+    python -m benchmarks.load_test --scenarios all --duration 10 --compare before.json
+    python -m benchmarks.load_test serve --port 8100 --users 5000   # server only
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+from app.core.heartbeat import PONG
+from app.core.seed import HOST_EVERY, LOAD_PASSWORD, user_email, user_id
+from benchmarks.fanout_bench import percentile
+
+SCENARIOS = ("login", "me", "streams", "active", "gifts", "chat")
+
+
+# --- Server ---
+async def serve(args):
+    from app.core import database
+    from app.core.seed import seed
+
+    if not args.real:
+        from mongomock_motor import AsyncMongoMockClient
+
+        # connect() keeps an existing client, so the app's lifespan picks this one up.
+        database._client = AsyncMongoMockClient()
+    if not args.no_seed:
+        started = time.perf_counter()
+        inserted = await seed(database.get_database(), args.users, args.transactions, indexes=args.real)
+        print(f"Seeded {inserted} documents in {time.perf_counter() - started:.1f}s", flush=True)
+
+    import uvicorn
+
+    from app.main import app
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning",
+                            timeout_keep_alive=75)
+    await uvicorn.Server(config).serve()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def spawn_server(args) -> tuple:
+    port = free_port()
+    env = dict(os.environ)
+    if not args.keep_limits:
+        env["RATE_LIMIT_ENABLED"] = "0"
+    command = [sys.executable, "-W", "ignore", "-m", "benchmarks.load_test", "serve", "--port", str(port),
+               "--users", str(args.users), "--transactions", str(args.transactions)]
+    if args.real:
+        command.append("--real")
+    process = subprocess.Popen(command, env=env)
+    url = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient() as client:
+        deadline = time.perf_counter() + args.boot_timeout
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                sys.exit(f"server exited with {process.returncode}")
+            try:
+                if (await client.get(url + "/health/ready")).status_code == 200:
+                    return process, url
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    process.terminate()
+    sys.exit("server did not become ready")
+
+
+# --- Measurement ---
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, op: str, seconds: float, status="ok"):
+        self.latencies[op].append(seconds)
+        self.statuses[op][str(status)] += 1
+
+    async def timed(self, op: str, request):
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.record(op, time.perf_counter() - started, type(e).__name__)
+            return None
+        self.record(op, time.perf_counter() - started, response.status_code)
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        out = {}
+        for op, samples in self.latencies.items():
+            ms = [s * 1000 for s in samples]
+            out[op] = {
+                "count": len(ms),
+                "throughput": round(len(ms) / elapsed, 1),
+                "p50_ms": round(percentile(ms, 50), 2),
+                "p95_ms": round(percentile(ms, 95), 2),
+                "p99_ms": round(percentile(ms, 99), 2),
+                "max_ms": round(max(ms, default=0), 2),
+                "statuses": dict(self.statuses[op]),
+            }
+        return out
+
+
+class Context:
+    def __init__(self, url: str, client: httpx.AsyncClient, args):
+        self.url = url
+        self.client = client
+        self.args = args
+        self.users = args.users
+        self.user_tokens: List[str] = []
+        self.host_tokens: List[str] = []
+
+    async def login(self, index: int) -> Optional[str]:
+        response = await self.client.post("/auth/login", data={"username": user_email(index),
+                                                              "password": LOAD_PASSWORD})
+        return response.json()["access_token"] if response.status_code == 200 else None
+
+    async def prepare(self):
+        # A few sessions up front; the me/streams scenarios reuse them.
+        users = [i for i in range(min(self.users, self.args.sessions * 2)) if i % HOST_EVERY][:self.args.sessions]
+        hosts = list(range(0, self.users, HOST_EVERY))[:max(1, self.args.sessions // 4)]
+        tokens = await asyncio.gather(*(self.login(i) for i in users + hosts))
+        self.user_tokens = [t for t in tokens[:len(users)] if t]
+        self.host_tokens = [t for t in tokens[len(users):] if t]
+        if not self.user_tokens or not self.host_tokens:
+            sys.exit("could not log in as the seeded users; is the database seeded?")
+
+
+def auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+# --- Scenarios ---
+async def login_worker(ctx: Context, stats: Stats, deadline: float):
+    while time.perf_counter() < deadline:
+        await stats.timed("login", ctx.client.post(
+            "/auth/login", data={"username": user_email(random.randrange(ctx.users)), "password": LOAD_PASSWORD}))
+
+
+async def me_worker(ctx: Context, stats: Stats, deadline: float):
+    while time.perf_counter() < deadline:
+        await stats.timed("users_me", ctx.client.get("/users/me", headers=auth(random.choice(ctx.user_tokens))))
+
+
+async def streams_worker(ctx: Context, stats: Stats, deadline: float):
+    while time.perf_counter() < deadline:
+        headers = auth(random.choice(ctx.host_tokens))
+        response = await stats.timed("stream_start", ctx.client.post(
+            "/streams/start", params={"title": "load test"}, headers=headers))
+        if response is not None and response.status_code == 200:
+            await asyncio.sleep(random.uniform(0, 0.05))
+            stream_id = response.json()["_id"]
+            await stats.timed("stream_end", ctx.client.post(f"/streams/{stream_id}/end", headers=headers))
+
+
+async def active_worker(ctx: Context, stats: Stats, deadline: float):
+    while time.perf_counter() < deadline:
+        await stats.timed("streams_active", ctx.client.get("/streams/active"))
+
+
+async def gifts_worker(ctx: Context, stats: Stats, deadline: float):
+    # Bursts, as when a popular host gets a wave of gifts.
+    while time.perf_counter() < deadline:
+        to_user = user_id(random.randrange(0, ctx.users, HOST_EVERY))
+        burst = [ctx.client.post("/admin/coins/gift", json={
+            "from_user": user_id(random.randrange(ctx.users)), "to_user": to_user, "amount": 1,
+            "stream_id": "load-test",
+        }) for _ in range(ctx.args.gift_burst)]
+        await asyncio.gather(*(stats.timed("gift", request) for request in burst))
+
+
+async def chat_scenario(ctx: Context, stats: Stats, deadline: float):
+    import websockets
+
+    args = ctx.args
+    ws_url = ctx.url.replace("http", "ws", 1)
+    senders = int(args.chat_clients * args.chat_senders)
+
+    async def client(index: int):
+        room = f"load-room-{index % args.chat_rooms}"
+        started = time.perf_counter()
+        try:
+            ws = await websockets.connect(f"{ws_url}/ws/chat/{room}", max_queue=None, open_timeout=30)
+        except Exception as e:
+            stats.record("ws_connect", time.perf_counter() - started, type(e).__name__)
+            return
+        stats.record("ws_connect", time.perf_counter() - started)
+
+        async def receive():
+            async for message in ws:
+                frame = json.loads(message)
+                if frame.get("op") == "ping":
+                    await ws.send(PONG)
+                    continue
+                _, _, payload = frame["text"].partition("Client message: ")
+                # Messages sent before this client joined are history replay, not deliveries.
+                if payload.startswith("t=") and float(payload[2:]) >= started:
+                    stats.record("chat_delivery", time.perf_counter() - float(payload[2:]))
+
+        receiver = asyncio.create_task(receive())
+        try:
+            if index < senders:
+                while time.perf_counter() < deadline:
+                    await asyncio.sleep(random.expovariate(args.chat_rate))
+                    await ws.send(f"t={time.perf_counter()}")
+            else:
+                await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+            await asyncio.sleep(0.5)  # in-flight deliveries
+        finally:
+            receiver.cancel()
+            await ws.close()
+
+    # Ramp connections in so the connect storm doesn't overrun the listen backlog.
+    tasks = []
+    for i in range(args.chat_clients):
+        tasks.append(asyncio.create_task(client(i)))
+        if i % 100 == 99:
+            await asyncio.sleep(0.05)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+WORKERS = {
+    "login": login_worker,
+    "me": me_worker,
+    "streams": streams_worker,
+    "active": active_worker,
+    "gifts": gifts_worker,
+}
+
+
+async def run_scenario(name: str, ctx: Context) -> dict:
+    args = ctx.args
+    stats = Stats()
+    names = SCENARIOS if name == "mixed" else (name,)
+    # In the mixed run every scenario gets its share of the workers.
+    concurrency = max(1, args.concurrency // (len(names) - ("chat" in names))) if name == "mixed" else args.concurrency
+    started = time.perf_counter()
+    deadline = started + args.duration
+    tasks = []
+    for scenario in names:
+        if scenario == "chat":
+            tasks.append(chat_scenario(ctx, stats, deadline))
+        else:
+            tasks.extend(WORKERS[scenario](ctx, stats, deadline) for _ in range(concurrency))
+    await asyncio.gather(*tasks)
+    return stats.summary(time.perf_counter() - started)
+
+
+# --- Reporting ---
+def print_results(results: dict):
+    print(f"{'scenario':<8} {'operation':<15} {'count':>7} {'ops/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'max':>8}  statuses")
+    for scenario, ops in results.items():
+        for op, s in ops.items():
+            statuses = " ".join(f"{k}:{v}" for k, v in sorted(s["statuses"].items()))
+            print(f"{scenario:<8} {op:<15} {s['count']:>7} {s['throughput']:>8.1f} {s['p50_ms']:>7.1f}ms "
+                  f"{s['p95_ms']:>6.1f}ms {s['p99_ms']:>6.1f}ms {s['max_ms']:>6.1f}ms  {statuses}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    ok = True
+    print(f"\nagainst {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta']['started']}):")
+    for scenario, ops in results.items():
+        for op, s in ops.items():
+            before = baseline["results"].get(scenario, {}).get(op)
+            if not before or not before["count"]:
+                continue
+            p95 = s["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+            rate = s["throughput"] / before["throughput"] - 1 if before["throughput"] else 0.0
+            regressed = p95 > tolerance or rate < -tolerance
+            ok &= not regressed
+            print(f"  {scenario:<8} {op:<15} p95 {p95:+7.1%}  ops/s {rate:+7.1%}  {'REGRESSED' if regressed else ''}")
+    return ok
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args) -> bool:
+    process = None
+    url = args.url
+    if not url:
+        process, url = await spawn_server(args)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency * len(SCENARIOS),
+                              max_keepalive_connections=args.concurrency * len(SCENARIOS))
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+            ctx = Context(url, client, args)
+            await ctx.prepare()
+            names = SCENARIOS + ("mixed",) if args.scenarios == ["all"] else args.scenarios
+            results = {}
+            for name in names:
+                print(f"running {name} for {args.duration:g}s...", flush=True)
+                results[name] = await run_scenario(name, ctx)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print_results(results)
+    report = {
+        "meta": {"started": datetime.utcnow().isoformat(timespec="seconds"), "commit": git_commit(),
+                 "python": platform.python_version(), "target": args.url or ("mongod" if args.real else "mongomock"),
+                 "args": {k: v for k, v in vars(args).items() if k not in ("command", "out", "compare")}},
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            return compare(results, json.load(f), args.tolerance)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", choices=("run", "serve"), default="run")
+    parser.add_argument("--scenarios", nargs="+", default=["all"], choices=SCENARIOS + ("mixed", "all"))
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=16, help="workers per HTTP scenario")
+    parser.add_argument("--users", type=int, default=2000, help="seeded users")
+    parser.add_argument("--transactions", type=int, default=10000, help="seeded ledger operations")
+    parser.add_argument("--sessions", type=int, default=20, help="users logged in up front for token scenarios")
+    parser.add_argument("--gift-burst", type=int, default=20)
+    parser.add_argument("--chat-clients", type=int, default=1000)
+    parser.add_argument("--chat-rooms", type=int, default=10)
+    parser.add_argument("--chat-senders", type=float, default=0.05, help="share of chat clients that send")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="messages per second per sender")
+    parser.add_argument("--url", help="test this running server instead of spawning one")
+    parser.add_argument("--real", action="store_true", help="spawned server uses MONGODB_URI instead of mongomock")
+    parser.add_argument("--no-seed", action="store_true", help="serve: use the database as it is")
+    parser.add_argument("--keep-limits", action="store_true", help="leave the rate limits on in the spawned server")
+    parser.add_argument("--boot-timeout", type=float, default=300)
+    parser.add_argument("--port", type=int, default=8100, help="serve: port to listen on")
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    if args.command == "serve":
+        asyncio.run(serve(args))
+        return
+    sys.exit(0 if asyncio.run(main_async(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
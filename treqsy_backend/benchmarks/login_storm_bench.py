@@ -0,0 +1,107 @@
+"""/users/me latency while a login storm is running.
+
+Runs the app in-process (httpx ASGI transport, users collection on mongomock)
+and polls /users/me while concurrent logins hammer bcrypt, once with hashing
+inline on the event loop (the old behaviour) and once per executor kind.
+
+    python -m benchmarks.login_storm_bench --logins 40 --concurrency 8
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+from app.api import auth
+from app.core import rate_limit
+from app.core.database import get_users_collection
+from app.core.security import PasswordHasher, create_access_token, get_password_hash
+from app.main import app
+from benchmarks.fanout_bench import percentile
+
+EMAIL = "storm@example.com"
+PASSWORD = "Storm@123"
+
+# The storm is one client hammering one account; measure bcrypt, not the login limits.
+rate_limit.RATE_LIMIT_ENABLED = False
+
+
+async def run_scenario(mode: str, logins: int, concurrency: int, workers: int):
+    auth.password_hasher = hasher = PasswordHasher(mode, workers)
+    token = create_access_token({"sub": "storm-user", "email": EMAIL, "role": "user"})
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def poll():
+            # Latency is counted from when the poll was due, so time the loop
+            # spent blocked before the request could even start is included.
+            due = time.perf_counter()
+            while not done.is_set():
+                r = await client.get("/users/me", headers=headers)
+                finished = time.perf_counter()
+                latencies.append(finished - due)
+                assert r.status_code == 200, r.text
+                due = finished + 0.005
+                await asyncio.sleep(0.005)
+
+        remaining = iter(range(logins))
+
+        async def storm():
+            for _ in remaining:
+                r = await client.post("/auth/login", data={"username": EMAIL, "password": PASSWORD})
+                assert r.status_code == 200, r.text
+
+        poller = asyncio.create_task(poll())
+        started = time.perf_counter()
+        await asyncio.gather(*(storm() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await poller
+
+    hasher.shutdown()
+    ms = [x * 1000 for x in latencies]
+    stats = hasher.stats()
+    return (
+        f"{mode:>8}: logins/s={logins / elapsed:6.1f}  /users/me n={len(ms):4d} "
+        f"p50={percentile(ms, 50):7.1f}ms p99={percentile(ms, 99):7.1f}ms max={max(ms):7.1f}ms  "
+        f"peak waiting={stats['peak_waiting']}"
+    )
+
+
+async def main_async(logins: int, concurrency: int, workers: int, modes: list):
+    users = AsyncMongoMockClient()["treqsy"]["users"]
+    await users.insert_one({
+        "_id": "storm-user", "email": EMAIL, "hashed_password": get_password_hash(PASSWORD),
+        "role": "user", "is_active": True,
+    })
+
+    async def override():
+        return users
+
+    app.dependency_overrides[get_users_collection] = override
+    print(f"logins={logins} concurrency={concurrency} workers={workers}")
+    for mode in modes:
+        # The login handler prints every attempt; keep the report readable.
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = await run_scenario(mode, logins, concurrency, workers)
+        print(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", default="inline,thread,process")
+    args = parser.parse_args()
+    asyncio.run(main_async(args.logins, args.concurrency, args.workers, args.modes.split(",")))
+
+
+if __name__ == "__main__":
+    main()
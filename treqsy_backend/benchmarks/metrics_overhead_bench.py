@@ -0,0 +1,162 @@
+"""Cost of the /metrics instrumentation on the paths it instruments.
+
+  * primitives   one Histogram.observe / Counter.inc;
+  * mongo        one command through the pymongo listener (started + succeeded);
+  * http         MetricsMiddleware around a no-op ASGI endpoint, then a
+                 FastAPI route with a path parameter requested through the
+                 ASGI interface with and without it;
+  * fan-out      the fan-out timing as a share of one broadcast to --viewers;
+  * scrape       rendering /metrics with --routes routes, --collections
+                 collections and --rooms rooms worth of series.
+
+Overheads are best-of-rounds differences, so loop noise doesn't swamp them.
+
+    python -m benchmarks.metrics_overhead_bench --requests 5000 --viewers 1000
+"""
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+
+from app.core import metrics
+from app.core.metrics import CommandMetrics, Counter, Histogram, MetricsMiddleware
+from benchmarks.export_bench import get
+from benchmarks.fanout_bench import FakeWebSocket, offline_manager
+
+ROUNDS = 5
+
+
+def per_call_ns(fn, calls: int) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / calls * 1e9)
+    return best
+
+
+async def per_request_us(apps: list, path: str, requests: int) -> list:
+    # Rounds interleave the apps so drift in machine load hits them equally.
+    best = [float("inf")] * len(apps)
+    for _ in range(ROUNDS):
+        for i, app in enumerate(apps):
+            t0 = time.perf_counter()
+            for _ in range(requests):
+                status, _, body = await get(app, path)
+                async for _ in body:
+                    pass
+                assert status == 200, status
+            best[i] = min(best[i], (time.perf_counter() - t0) / requests * 1e6)
+    return best
+
+
+async def middleware_us(calls: int) -> float:
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/streams/abc", "route": SimpleNamespace(path="/streams/{id}")}
+    instrumented = MetricsMiddleware(endpoint)
+    best = [float("inf")] * 2
+    for _ in range(ROUNDS):
+        for i, app in enumerate((endpoint, instrumented)):
+            t0 = time.perf_counter()
+            for _ in range(calls):
+                await app(scope, receive, send)
+            best[i] = min(best[i], (time.perf_counter() - t0) / calls * 1e6)
+    return best[1] - best[0]
+
+
+def build_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/streams/{stream_id}")
+    async def stream(stream_id: str):
+        return {"_id": stream_id, "title": "bench"}
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def run(args):
+    histogram = Histogram("bench_seconds", "bench", ("route",))
+    counter = Counter("bench_total", "bench", ("route",))
+    print(f"Histogram.observe: {per_call_ns(lambda: histogram.observe(0.003, '/streams/{id}'), 200000):6.0f}ns")
+    print(f"Counter.inc:       {per_call_ns(lambda: counter.inc('/streams/{id}'), 200000):6.0f}ns")
+
+    listener = CommandMetrics()
+    started = SimpleNamespace(request_id=1, connection_id=("db", 27017), command_name="find",
+                              command={"find": "streams", "filter": {"is_active": True}})
+    succeeded = SimpleNamespace(request_id=1, connection_id=("db", 27017), command_name="find", duration_micros=850)
+
+    def command():
+        listener.started(started)
+        listener.succeeded(succeeded)
+    print(f"mongo listener:    {per_call_ns(command, 100000):6.0f}ns/command")
+
+    print(f"MetricsMiddleware: {await middleware_us(args.requests * 4):6.2f}us/request around a no-op endpoint")
+    bare_us, instrumented_us = await per_request_us([build_app(False), build_app(True)], "/streams/abc",
+                                                    args.requests // ROUNDS)
+    print(f"http request:      {bare_us:6.1f}us bare, {instrumented_us:.1f}us instrumented "
+          f"({(instrumented_us - bare_us) / bare_us:+.1%})")
+
+    manager = offline_manager()
+    sent_at, latencies = {}, []
+    sockets = [FakeWebSocket(sent_at, latencies) for _ in range(args.viewers)]
+    for ws in sockets:
+        await manager.connect(ws, "bench-room")
+    broadcasts = 200
+    t0 = time.perf_counter()
+    for seq in range(broadcasts):
+        sent_at[str(seq)] = time.perf_counter()
+        await manager.broadcast(str(seq), "bench-room")
+        await asyncio.sleep(0)
+    broadcast_us = (time.perf_counter() - t0) / broadcasts * 1e6
+    for ws in sockets:
+        manager.disconnect(ws, "bench-room")
+    observe_ns = per_call_ns(lambda: metrics.FANOUT_SECONDS.observe(0.0004), 100000)
+    timing_ns = per_call_ns(time.perf_counter, 100000) * 2 + observe_ns
+    print(f"fan-out:           {timing_ns:6.0f}ns of timing per broadcast to {args.viewers} viewers "
+          f"({broadcast_us:.0f}us each, {timing_ns / 1000 / broadcast_us:.3%})")
+
+    registry = metrics.Registry()
+    http = registry.register(Histogram("http_request_duration_seconds", "x", ("method", "route", "status")))
+    mongo = registry.register(Histogram("mongo_command_duration_seconds", "x", ("collection", "command"),
+                                        metrics.FAST_BUCKETS))
+    for route in range(args.routes):
+        for status in ("200", "401", "500"):
+            http.observe(0.01, "GET", f"/route/{route}", status)
+    for collection in range(args.collections):
+        for command in ("find", "insert", "update", "aggregate", "getMore"):
+            mongo.observe(0.001, f"collection{collection}", command)
+    rooms = [((f"room-{i}",), i) for i in range(args.rooms)]
+    registry.register(metrics.Gauge("ws_connections", "x", ("room",), lambda: rooms))
+    t0 = time.perf_counter()
+    body = registry.render()
+    print(f"scrape:            {(time.perf_counter() - t0) * 1000:6.1f}ms for {body.count(chr(10))} lines "
+          f"({len(body) // 1024}KB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--viewers", type=int, default=1000)
+    parser.add_argument("--routes", type=int, default=40)
+    parser.add_argument("--collections", type=int, default=8)
+    parser.add_argument("--rooms", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Viewer presence under join churn: cost, database writes and accuracy.
+
+--viewers fake sockets join and leave --streams streams through
+ConnectionManager at about --rate joins per second for --seconds, with
+presence flushed every --flush-interval to mongomock. Reports:
+
+  * the cost of Presence.join + leave, and of a connect/disconnect pair
+    through the manager;
+  * joins handled per second, and database writes per flush (which should
+    track the number of watched streams, not the join rate);
+  * accuracy: the flushed viewer_joins, peak_viewers and watch_seconds on the
+    stream documents against exact values kept per viewer by the benchmark.
+
+    python -m benchmarks.presence_bench --streams 50 --rate 5000 --seconds 5
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+from mongomock_motor import AsyncMongoMockClient
+
+from app.api.streaming import ConnectionManager
+from app.core.chat_history import ChatHistory
+from app.core.presence import Presence
+from benchmarks.fanout_bench import FakeWebSocket, offline_manager
+
+
+def per_call_us(fn, calls: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - t0) / calls * 1e6
+
+
+async def connect_cost_us(calls: int) -> float:
+    manager = offline_manager()
+    ws = FakeWebSocket({}, [])
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        await manager.connect(ws, "cost-room")
+        manager.disconnect(ws, "cost-room")
+    elapsed = time.perf_counter() - t0
+    await asyncio.sleep(0)  # let the cancelled writers finish
+    return elapsed / calls * 1e6
+
+
+async def churn(args):
+    streams = AsyncMongoMockClient()["bench"]["streams"]
+    stream_ids = [f"stream-{i}" for i in range(args.streams)]
+    await streams.insert_many([{"_id": stream_id, "is_active": True} for stream_id in stream_ids])
+    presence = Presence(streams, flush_interval=args.flush_interval)
+    manager = ConnectionManager(history=ChatHistory(enabled=False), presence=presence)
+    await manager.start()
+
+    # Exact values, per viewer: what presence approximates without per-viewer state.
+    joined_at, watched = {}, defaultdict(float)
+    joins, live, peak = defaultdict(int), defaultdict(int), defaultdict(int)
+    sockets = [FakeWebSocket({}, []) for _ in range(args.viewers)]
+    rooms = {}
+
+    async def leave(ws):
+        room = rooms.pop(ws)
+        manager.disconnect(ws, room)
+        watched[room] += time.monotonic() - joined_at.pop(ws)
+        live[room] -= 1
+
+    started = time.perf_counter()
+    deadline = started + args.seconds
+    handled = operations = 0
+    while time.perf_counter() < deadline:
+        operations += 1
+        if operations % 100 == 0:
+            # Paced to --rate, yielding so the flush loop runs alongside.
+            await asyncio.sleep(max(0.0, started + operations / args.rate - time.perf_counter()))
+        ws = random.choice(sockets)
+        if ws in rooms:
+            await leave(ws)
+        else:
+            room = random.choice(stream_ids)
+            await manager.connect(ws, room)
+            rooms[ws] = room
+            joined_at[ws] = time.monotonic()
+            joins[room] += 1
+            live[room] += 1
+            peak[room] = max(peak[room], live[room])
+            handled += 1
+    for ws in list(rooms):
+        await leave(ws)
+    elapsed = time.perf_counter() - started
+    flushes_during = presence.flushes
+    writes_during = presence.writes
+    await manager.stop()
+
+    docs = {doc["_id"]: doc async for doc in streams.find()}
+    joins_error = sum(abs(docs[s].get("viewer_joins", 0) - joins[s]) for s in stream_ids)
+    peak_error = sum(abs(docs[s].get("peak_viewers", 0) - peak[s]) for s in stream_ids)
+    exact = sum(watched.values())
+    flushed = sum(docs[s].get("watch_seconds", 0) for s in stream_ids)
+    print(f"churn:    {handled} joins in {elapsed:.1f}s ({handled / elapsed:.0f}/s) over {args.streams} streams; "
+          f"{writes_during} writes in {flushes_during} flushes "
+          f"({writes_during / max(1, flushes_during):.0f}/flush, {presence.writes} with the final flush)")
+    print(f"accuracy: viewer_joins off by {joins_error}, peak_viewers off by {peak_error}, "
+          f"watch_seconds {flushed:.1f} vs exact {exact:.1f} ({(flushed - exact) / max(exact, 1e-9):+.4%})")
+
+
+async def run(args):
+    presence = Presence()
+    print(f"Presence.join+leave: {per_call_us(lambda i: (presence.join('s'), presence.leave('s')), 200000):.2f}us")
+    print(f"connect+disconnect:  {await connect_cost_us(20000):.2f}us through ConnectionManager")
+    await churn(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--viewers", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=5000, help="joins and leaves per second")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
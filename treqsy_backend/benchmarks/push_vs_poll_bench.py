@@ -0,0 +1,206 @@
+"""Polling versus pushed events for a fleet of dashboard clients.
+
+--clients simulated clients each watch the live stream list and their own
+coin balance for --seconds, while streams start and end and balances change
+at --changes per second in total:
+
+  * poll  every client GETs /streams/active and /admin/coins/balance through
+          the ASGI app every --poll-interval (the stream directory is off
+          unless --directory);
+  * push  every client holds one EventHub socket subscribed to "streams" and
+          its wallet, and is sent the changes as they happen.
+
+Reports, per mode, requests or frames per second, bytes sent to clients,
+process CPU time (clients included, in both modes), database reads, and
+staleness: how long after a balance changed its client saw it.
+
+    python -m benchmarks.push_vs_poll_bench --clients 500 --poll-interval 1 --changes 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime
+
+from fastapi import FastAPI
+from mongomock_motor import AsyncMongoMockClient
+
+from app.api import admin, streams
+from app.api.streaming import manager
+from app.core.database import get_streams_collection, get_users_collection
+from app.core.events import STREAMS_TOPIC, EventHub, wallet_topic
+from app.core.security import create_access_token
+from app.core.stream_directory import StreamDirectory
+from app.models.user import Role
+from benchmarks.export_bench import get
+from benchmarks.fanout_bench import percentile
+from benchmarks.gift_batch_bench import CountingCollection
+
+
+class Fleet:
+    """What the clients saw: bytes, messages and balance staleness."""
+
+    def __init__(self, clients: int):
+        self.user_ids = [f"client-{i}" for i in range(clients)]
+        self.changed_at = {}
+        self.latencies = []
+        self.messages = 0
+        self.bytes = 0
+
+    def saw_balance(self, user_id: str):
+        changed_at = self.changed_at.pop(user_id, None)
+        if changed_at is not None:
+            self.latencies.append(time.perf_counter() - changed_at)
+
+    def report(self, label: str, elapsed: float, cpu: float, reads: int):
+        ms = [x * 1000 for x in self.latencies]
+        unit = "req" if label == "poll" else "frames"
+        print(f"{label}: {self.messages / elapsed:8.0f} {unit}/s, {self.bytes / elapsed / 1024:8.1f} KiB/s to clients, "
+              f"CPU {cpu / elapsed:5.1%}, {reads} db reads; balance staleness "
+              f"p50={percentile(ms, 50):.1f}ms p99={percentile(ms, 99):.1f}ms ({len(ms)} changes seen)")
+
+
+class Subscriber:
+    def __init__(self, fleet: Fleet, user_id: str):
+        self.fleet = fleet
+        self.user_id = user_id
+
+    async def accept(self):
+        pass
+
+    async def send(self, message: dict):
+        text = message["text"]
+        self.fleet.messages += 1
+        self.fleet.bytes += len(text)
+        if "delta" in json.loads(text):
+            self.fleet.saw_balance(self.user_id)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def changes(fleet: Fleet, rate: float, deadline: float, users, streams_collection, hub=None):
+    # The same writes in both modes; with a hub they are also published, as the API does.
+    live = []
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(1 / rate)
+        if random.random() < 0.2:
+            if live and random.random() < 0.5:
+                stream_id = live.pop(random.randrange(len(live)))
+                await streams_collection.update_one({"_id": stream_id}, {"$set": {"is_active": False}})
+                if hub is not None:
+                    hub.stream_ended(stream_id)
+            else:
+                session = {"_id": str(uuid.uuid4()), "host_email": "host@example.com", "title": "Live",
+                           "start_time": datetime.utcnow(), "end_time": None, "is_active": True}
+                await streams_collection.insert_one(session)
+                live.append(session["_id"])
+                if hub is not None:
+                    hub.stream_started(session)
+            continue
+        user_id = random.choice(fleet.user_ids)
+        await users.update_one({"_id": user_id}, {"$inc": {"coins": 10}})
+        fleet.changed_at.setdefault(user_id, time.perf_counter())
+        if hub is not None:
+            hub.ledger_committed([{"user_id": user_id, "type": "purchase", "amount": 10}])
+
+
+async def seed(clients: int, active: int):
+    db = AsyncMongoMockClient()["push_bench"]
+    await db.users.insert_many([{"_id": f"client-{i}", "coins": 0} for i in range(clients)])
+    now = datetime.utcnow()
+    await db.streams.insert_many([
+        {"_id": str(uuid.uuid4()), "host_email": f"host{i}@example.com", "title": f"Stream {i}",
+         "start_time": now, "end_time": None, "is_active": True}
+        for i in range(active)
+    ])
+    return db
+
+
+async def poll(args):
+    db = await seed(args.clients, args.active)
+    fleet = Fleet(args.clients)
+    counter = {"ops": 0}
+    users, streams_collection = CountingCollection(db.users, counter), CountingCollection(db.streams, counter)
+
+    app = FastAPI()
+    app.include_router(streams.router)
+    app.include_router(admin.router)
+    app.dependency_overrides[get_streams_collection] = lambda: streams_collection
+    app.dependency_overrides[get_users_collection] = lambda: users
+    streams.STREAM_DIRECTORY = args.directory
+    streams.directory = StreamDirectory(manager.viewer_count, streams_collection)
+    if args.directory:
+        await streams.directory.start()
+
+    async def client(user_id: str, deadline: float):
+        # Dashboards poll as admins: /admin/coins/balance is admin-only.
+        headers = {"Authorization": "Bearer " + create_access_token(
+            {"sub": user_id, "email": f"{user_id}@example.com", "role": Role.ADMIN.value})}
+        await asyncio.sleep(random.random() * args.poll_interval)  # spread out, as real clients are
+        balance = None
+        while time.perf_counter() < deadline:
+            for path in ("/streams/active", "/admin/coins/balance"):
+                _, _, body = await get(app, path, "", headers)
+                data = b"".join([chunk async for chunk in body])
+                fleet.messages += 1
+                fleet.bytes += len(data)
+                if path == "/admin/coins/balance":
+                    coins = json.loads(data)["coins"]
+                    if coins != balance:
+                        fleet.saw_balance(user_id)
+                        balance = coins
+                else:
+                    json.loads(data)
+            await asyncio.sleep(args.poll_interval)
+
+    counter["ops"] = 0
+    fleet.changed_at.clear()
+    deadline = time.perf_counter() + args.seconds
+    cpu, started = time.process_time(), time.perf_counter()
+    await asyncio.gather(changes(fleet, args.changes, deadline, db.users, db.streams),
+                         *(client(user_id, deadline) for user_id in fleet.user_ids))
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu
+    await streams.directory.stop()
+    fleet.report("poll", elapsed, cpu, counter["ops"])
+
+
+async def push(args):
+    db = await seed(args.clients, args.active)
+    fleet = Fleet(args.clients)
+    hub = EventHub()
+    await hub.start()
+    for user_id in fleet.user_ids:
+        ws = Subscriber(fleet, user_id)
+        await hub.connect(ws)
+        hub.subscribe(ws, STREAMS_TOPIC)
+        hub.subscribe(ws, wallet_topic(user_id))
+    # Each client loads the full state once, on connect; that is its only read.
+    reads = 2 * args.clients
+
+    deadline = time.perf_counter() + args.seconds
+    cpu, started = time.process_time(), time.perf_counter()
+    await changes(fleet, args.changes, deadline, db.users, db.streams, hub)
+    await asyncio.sleep(0.05)  # in-flight frames
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu
+    await hub.stop()
+    fleet.report("push", elapsed, cpu, reads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--active", type=int, default=50, help="live streams seeded")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--changes", type=float, default=20, help="stream and balance changes per second")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--directory", action="store_true", help="serve polls from the stream directory")
+    args = parser.parse_args()
+    asyncio.run(poll(args))
+    asyncio.run(push(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Fail if any router query would scan a whole collection.
+
+Applies the index registry to a scratch database and explains every entry in
+app.core.indexes.HOT_QUERIES. Against a real mongod the server's winning plan
+is checked; with --mongomock (no explain support) a static planner stand-in
+checks that some created index leads with a filtered field.
+
+    MONGODB_URI=mongodb://localhost:27017 python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --mongomock
+"""
+import argparse
+import asyncio
+import sys
+
+from app.core import database
+from app.core.indexes import HOT_QUERIES, ensure_indexes, explain_stages, static_stages
+
+
+async def check(use_mongomock: bool, db_name: str, keep: bool) -> bool:
+    if use_mongomock:
+        from mongomock_motor import AsyncMongoMockClient
+
+        client = AsyncMongoMockClient()
+    else:
+        client = database.connect()
+    db = client[db_name]
+    await ensure_indexes(db)
+
+    ok = True
+    for query in HOT_QUERIES:
+        if use_mongomock:
+            stages = static_stages(await db[query.collection].index_information(), query)
+        else:
+            stages = await explain_stages(db, query)
+        scan = "COLLSCAN" in stages
+        ok &= not scan
+        print(f"{'FAIL' if scan else 'ok':>4}  {query.name:<32} {query.collection:<18} {' > '.join(stages)}")
+
+    if not keep:
+        await client.drop_database(db_name)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongomock", action="store_true", help="check against mongomock instead of MONGODB_URI")
+    parser.add_argument("--db", default="treqsy_plan_check", help="scratch database to build indexes in")
+    parser.add_argument("--keep", action="store_true", help="do not drop the scratch database afterwards")
+    args = parser.parse_args()
+    ok = asyncio.run(check(args.mongomock, args.db, args.keep))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
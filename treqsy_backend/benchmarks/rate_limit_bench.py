@@ -0,0 +1,186 @@
+"""Rate limiter overhead, and how well the chat limit shields a room from a flood.
+
+Overhead: the cost of one limiter check per store (in-process memory, and
+Redis: the RESP stand-in, or --redis-url), and the per-request cost of the
+admission middleware around a no-op ASGI endpoint.
+
+Flood: one client floods /ws/chat/{room} as fast as the loop lets it while a
+regular chatter sends a message every --interval, and --viewers sockets
+watch the room for --seconds. Runs once with limits off and once on, and
+reports what the viewers received: total chat volume, how many of the
+regular chatter's messages made it, and their delivery latency, plus event
+loop lag on the worker.
+
+    python -m benchmarks.rate_limit_bench --viewers 200 --seconds 3
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from starlette.websockets import WebSocketDisconnect
+
+from app.api import streaming
+from app.core import rate_limit
+from app.core.rate_limit import (
+    LoadSheddingMiddleware, MemoryStore, MessageThrottle, Rate, RateLimiter, RateLimitMiddleware, RedisStore,
+)
+from benchmarks.fanout_bench import offline_manager, percentile
+from benchmarks.resp_server import RespServer
+
+ROOM = "flood-room"
+
+
+async def per_call_us(fn, calls: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(calls):
+        await fn(i)
+    return (time.perf_counter() - t0) / calls * 1e6
+
+
+async def overhead(calls: int, redis_url: str):
+    rate = Rate(1_000_000_000, 1)
+    memory = RateLimiter("bench", rate, MemoryStore())
+    print(f"memory limiter:   {await per_call_us(lambda i: memory.hit(str(i % 10000)), calls):7.2f}us/check")
+
+    throttle = MessageThrottle(rate)
+
+    async def allow(i):
+        throttle.allow()
+    print(f"chat throttle:    {await per_call_us(allow, calls):7.2f}us/check")
+
+    server = None
+    if not redis_url:
+        server = RespServer()
+        redis_url = f"redis://127.0.0.1:{await server.start()}"
+    store = RedisStore(redis_url)
+    shared = RateLimiter("bench", rate, store)
+    redis_calls = max(1, calls // 10)
+    print(f"redis limiter:    {await per_call_us(lambda i: shared.hit(str(i % 10000)), redis_calls):7.2f}us/check "
+          f"({'stand-in' if server else redis_url})")
+    await store.close()
+    if server is not None:
+        await server.stop()
+
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    guarded = RateLimitMiddleware(
+        LoadSheddingMiddleware(endpoint, limit=1024),
+        rules={("POST", "/ping"): RateLimiter("ping", rate, MemoryStore())},
+    )
+    scope = {"type": "http", "method": "POST", "path": "/ping", "client": ("10.0.0.1", 1234)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    # Interleaved rounds, best of each, so loop noise doesn't swamp a few microseconds.
+    bare_us = guarded_us = float("inf")
+    for _ in range(5):
+        bare_us = min(bare_us, await per_call_us(lambda i: endpoint(scope, receive, send), calls // 5))
+        guarded_us = min(guarded_us, await per_call_us(lambda i: guarded(scope, receive, send), calls // 5))
+    print(f"HTTP middleware:  {guarded_us - bare_us:7.2f}us/request (rate limit rule + load shedding)")
+
+
+class Viewer:
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    async def accept(self):
+        pass
+
+    async def send(self, message: dict):
+        text = json.loads(message["text"])["text"]
+        self.stats["received"] += 1
+        if "regular|" in text:
+            self.stats["regular"] += 1
+            self.stats["latencies"].append(time.perf_counter() - float(text.rsplit("|", 1)[1]))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class Sender(Viewer):
+    """A chat client whose receive_text produces its outgoing messages."""
+
+    def __init__(self, stats: dict, deadline: float, interval: float = 0.0):
+        super().__init__(stats)
+        self.deadline = deadline
+        self.interval = interval
+        self.sent = 0
+        self.close_code = None
+
+    async def receive_text(self) -> str:
+        await asyncio.sleep(self.interval)
+        if self.close_code is not None or time.perf_counter() >= self.deadline:
+            raise WebSocketDisconnect()
+        self.sent += 1
+        return f"regular|{time.perf_counter()}" if self.interval else "spam"
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+async def flood(enabled: bool, viewers: int, seconds: float, interval: float):
+    rate_limit.RATE_LIMIT_ENABLED = enabled
+    streaming.manager = manager = offline_manager()
+    stats = {"received": 0, "regular": 0, "latencies": []}
+    for _ in range(viewers):
+        await manager.connect(Viewer(stats), ROOM)
+
+    deadline = time.perf_counter() + seconds
+    spammer = Sender({"received": 0, "regular": 0, "latencies": []}, deadline)
+    regular = Sender({"received": 0, "regular": 0, "latencies": []}, deadline, interval)
+    lags = []
+
+    async def probe():
+        # How late a 10ms timer fires: what everything else on this worker feels.
+        while time.perf_counter() < deadline:
+            due = time.perf_counter() + 0.01
+            await asyncio.sleep(0.01)
+            lags.append((time.perf_counter() - due) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        streaming.websocket_endpoint(spammer, ROOM),
+        streaming.websocket_endpoint(regular, ROOM),
+        probe(),
+    )
+    await asyncio.sleep(0.2)  # let the writers drain
+    elapsed = time.perf_counter() - started
+    for connection in list(manager.active_connections.get(ROOM, {}).values()):
+        manager.disconnect(connection.websocket, ROOM)
+
+    expected = regular.sent * viewers
+    ms = [x * 1000 for x in stats["latencies"]]
+    print(f"limits {'on ' if enabled else 'off'}: spammer sent {spammer.sent} "
+          f"({'closed ' + str(spammer.close_code) if spammer.close_code else 'never closed'}); "
+          f"viewers got {stats['received'] / viewers / elapsed:.0f} msg/s each, "
+          f"regular messages {stats['regular']}/{expected} ({stats['regular'] / max(1, expected):.0%}), "
+          f"latency p50={percentile(ms, 50):.1f}ms p99={percentile(ms, 99):.1f}ms; "
+          f"loop lag p99={percentile(lags, 99):.1f}ms")
+
+
+async def run(args):
+    await overhead(args.calls, args.redis_url)
+    for enabled in (False, True):
+        await flood(enabled, args.viewers, args.seconds, args.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--redis-url", default="", help="use this Redis instead of the in-process stand-in")
+    parser.add_argument("--viewers", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--interval", type=float, default=0.25, help="seconds between the regular chatter's messages")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
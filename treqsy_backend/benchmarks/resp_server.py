@@ -0,0 +1,169 @@
+"""Minimal Redis stand-in for local testing of the Redis-backed components.
+
+Speaks enough RESP2 for redis-py: PING, PUBLISH, SUBSCRIBE, UNSUBSCRIBE,
+GET, SET (with PX), TIME, and SCRIPT LOAD/EVALSHA/EVAL for the scripts it
+knows (the rate limiter's GCRA script, run as Python), answering +OK to
+connection setup commands such as CLIENT SETINFO.
+
+    python -m benchmarks.resp_server --port 6399
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+from collections import defaultdict
+
+from app.core.rate_limit import GCRA_SCRIPT_SHA, gcra
+
+
+def encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+
+
+class RespServer:
+    def __init__(self):
+        self.channels: dict[bytes, set] = defaultdict(set)
+        self.data: dict[bytes, tuple] = {}  # key -> (value, expires at or None)
+        self.scripts = {GCRA_SCRIPT_SHA: self._gcra}
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _read_command(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    def execute(self, writer: asyncio.StreamWriter, subscriptions: set, args: list) -> bytes:
+        command = args[0].upper()
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command == b"PUBLISH":
+            channel, payload = args[1], args[2]
+            frame = encode([b"message", channel, payload])
+            receivers = self.channels.get(channel, ())
+            for subscriber in receivers:
+                subscriber.write(frame)
+            return encode(len(receivers))
+        if command == b"SUBSCRIBE":
+            out = []
+            for channel in args[1:]:
+                subscriptions.add(channel)
+                self.channels[channel].add(writer)
+                out.append(encode([b"subscribe", channel, len(subscriptions)]))
+            return b"".join(out)
+        if command == b"UNSUBSCRIBE":
+            out = []
+            for channel in args[1:] or list(subscriptions):
+                subscriptions.discard(channel)
+                self._leave(channel, writer)
+                out.append(encode([b"unsubscribe", channel, len(subscriptions)]))
+            return b"".join(out)
+        if command == b"GET":
+            return encode(self._get(args[1]))
+        if command == b"SET":
+            expires = None
+            if len(args) > 4 and args[3].upper() == b"PX":
+                expires = time.time() + int(args[4]) / 1000
+            self.data[args[1]] = (args[2], expires)
+            return b"+OK\r\n"
+        if command == b"TIME":
+            now = time.time()
+            return encode([str(int(now)), str(int(now % 1 * 1e6))])
+        if command == b"SCRIPT" and args[1].upper() == b"LOAD":
+            sha = hashlib.sha1(args[2]).hexdigest()
+            if sha not in self.scripts:
+                return b"-ERR script not supported by the stand-in\r\n"
+            return encode(sha)
+        if command in (b"EVALSHA", b"EVAL"):
+            sha = args[1].decode() if command == b"EVALSHA" else hashlib.sha1(args[1]).hexdigest()
+            script = self.scripts.get(sha)
+            if script is None:
+                return b"-NOSCRIPT No matching script.\r\n"
+            numkeys = int(args[2])
+            return encode(script(args[3:3 + numkeys], args[3 + numkeys:]))
+        return b"+OK\r\n"
+
+    def _get(self, key: bytes):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def _gcra(self, keys: list, args: list) -> list:
+        interval, tolerance, cost = float(args[0]), float(args[1]), int(args[2])
+        now = time.time() * 1000
+        tat = self._get(keys[0])
+        allowed, value = gcra(float(tat) if tat is not None else None, now, interval, tolerance, cost)
+        if not allowed:
+            return [0, repr(value)]
+        self.data[keys[0]] = (repr(value).encode(), time.time() + max(1, value - now) / 1000)
+        return [1, "0"]
+
+    def _leave(self, channel: bytes, writer):
+        members = self.channels.get(channel)
+        if members is not None:
+            members.discard(writer)
+            if not members:
+                del self.channels[channel]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriptions: set = set()
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if args:
+                    writer.write(self.execute(writer, subscriptions, args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscriptions:
+                self._leave(channel, writer)
+            writer.close()
+
+
+async def serve(host: str, port: int):
+    server = RespServer()
+    port = await server.start(host, port)
+    print(f"RESP stand-in listening on {host}:{port}", flush=True)
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
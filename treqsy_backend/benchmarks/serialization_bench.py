@@ -0,0 +1,102 @@
+"""Response serialization cost: FastAPI's default path vs. FastJSONResponse.
+
+Serves three typical payloads from a throwaway app and requests each one
+--requests times through the ASGI interface (no network, no database):
+
+  * streams       --streams active StreamSession documents behind
+                  response_model=List[StreamSession], as /streams/active;
+  * transactions  a --rows entry transaction history, as
+                  /admin/coins/transactions;
+  * users         a --rows user list, as /admin/users.
+
+"default" returns the documents and lets FastAPI validate/encode them;
+"fast" returns FastJSONResponse (orjson when installed).
+
+    python -m benchmarks.serialization_bench --streams 500 --rows 1000
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+from fastapi import FastAPI
+
+from app.core.responses import FastJSONResponse, orjson
+from app.models.stream import StreamSession
+from benchmarks.export_bench import get
+
+
+def payloads(streams: int, rows: int) -> dict:
+    now = datetime.utcnow()
+    return {
+        "streams": [
+            {"_id": str(uuid.uuid4()), "host_email": f"host{i}@example.com", "title": f"Stream {i}",
+             "start_time": now - timedelta(seconds=i), "end_time": None, "is_active": True}
+            for i in range(streams)
+        ],
+        "transactions": [
+            {"_id": str(ObjectId()), "user_id": "user-1", "type": random.choice(("purchase", "gift_sent")),
+             "amount": random.randint(1, 500), "timestamp": now - timedelta(seconds=i), "details": None}
+            for i in range(rows)
+        ],
+        "users": [
+            {"_id": str(ObjectId()), "email": f"user{i}@example.com", "role": "user", "is_active": True,
+             "is_vip": i % 10 == 0, "coins": random.randint(0, 10000)}
+            for i in range(rows)
+        ],
+    }
+
+
+def build_app(data: dict) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/default/streams", response_model=List[StreamSession])
+    async def default_streams():
+        return data["streams"]
+
+    @app.get("/fast/streams", response_model=List[StreamSession])
+    async def fast_streams():
+        return FastJSONResponse(data["streams"])
+
+    for name in ("transactions", "users"):
+        app.add_api_route(f"/default/{name}", lambda name=name: data[name])
+        app.add_api_route(f"/fast/{name}", lambda name=name: FastJSONResponse(data[name]))
+    return app
+
+
+async def timed(app: FastAPI, path: str, requests: int) -> tuple:
+    size = 0
+    t0 = time.perf_counter()
+    for _ in range(requests):
+        status, _, body = await get(app, path)
+        size = sum([len(chunk) async for chunk in body])
+        assert status == 200, (path, status)
+    return (time.perf_counter() - t0) / requests * 1000, size
+
+
+async def run(streams: int, rows: int, requests: int):
+    data = payloads(streams, rows)
+    app = build_app(data)
+    print(f"encoder: {'orjson ' + orjson.__version__ if orjson else 'json (orjson not installed)'}")
+    for name in ("streams", "transactions", "users"):
+        default_ms, default_size = await timed(app, f"/default/{name}", requests)
+        fast_ms, fast_size = await timed(app, f"/fast/{name}", requests)
+        print(f"{name:>13}: default {default_ms:6.2f}ms  fast {fast_ms:6.2f}ms  "
+              f"({default_ms / fast_ms:.1f}x, {default_size // 1024}KB / {fast_size // 1024}KB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.streams, args.rows, args.requests))
+
+
+if __name__ == "__main__":
+    main()
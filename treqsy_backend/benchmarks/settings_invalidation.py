@@ -0,0 +1,95 @@
+"""Check that a settings change reaches every worker within the poll interval.
+
+Starts --workers independent AppSettings caches (one per simulated worker,
+each with its own client when --real) over one settings collection. Each
+round, a random worker changes the coin price, and every other worker is
+watched until it serves the new value. Fails if any worker took longer than
+the poll interval plus --slack. Also compares a cached read with the
+find_one it replaces.
+
+Runs on mongomock by default, or against MONGODB_URI with --real.
+
+    python -m benchmarks.settings_invalidation --workers 4 --rounds 10 --interval 0.5
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import uuid
+
+from app.core.app_settings import AppSettings
+
+
+async def run(workers: int, rounds: int, interval: float, slack: float, real: bool) -> bool:
+    db_name = f"settings_check_{uuid.uuid4().hex[:8]}"
+    if real:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        from app.core.database import MONGO_URI, client_options
+
+        clients = [AsyncIOMotorClient(MONGO_URI, **client_options()) for _ in range(workers)]
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+
+        clients = [AsyncMongoMockClient()] * workers
+    caches = [AppSettings(client[db_name]["settings"], poll_interval=interval) for client in clients]
+    for cache in caches:
+        await cache.start()
+
+    delays = []
+    for i in range(rounds):
+        writer = random.choice(caches)
+        price = i + 2.5
+        # Land the write at a random point of the readers' poll cycle.
+        await asyncio.sleep(random.uniform(0, interval))
+        started = time.perf_counter()
+        await writer.set("coin_settings", {"coin_price": price, "bonus_rate": 0.1})
+        assert writer.coin_settings.coin_price == price
+
+        async def seen(cache: AppSettings) -> float:
+            while cache.coin_settings.coin_price != price:
+                await asyncio.sleep(0.005)
+            return time.perf_counter() - started
+
+        delays.extend(await asyncio.gather(*(seen(cache) for cache in caches if cache is not writer)))
+
+    reads = 100000
+    t0 = time.perf_counter()
+    for _ in range(reads):
+        caches[0].coin_settings.coin_price
+    cached_us = (time.perf_counter() - t0) / reads * 1e6
+    collection = caches[0].collection
+    t0 = time.perf_counter()
+    for _ in range(200):
+        await collection.find_one({"key": "coin_settings"})
+    query_us = (time.perf_counter() - t0) / 200 * 1e6
+
+    for cache in caches:
+        await cache.stop()
+    await clients[0].drop_database(db_name)
+
+    bound = interval + slack
+    worst = max(delays)
+    print(f"{len(delays)} propagations across {workers} workers: "
+          f"mean {sum(delays) / len(delays) * 1000:.0f}ms, max {worst * 1000:.0f}ms (bound {bound * 1000:.0f}ms)")
+    print(f"coin price read: cached {cached_us:.2f}us, find_one {query_us:.0f}us")
+    ok = worst <= bound
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=0.5, help="poll interval in seconds")
+    parser.add_argument("--slack", type=float, default=0.1, help="allowed delay beyond one poll interval")
+    parser.add_argument("--real", action="store_true", help="use MONGODB_URI instead of mongomock")
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.workers, args.rounds, args.interval, args.slack, args.real))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""GET /streams/active throughput with and without the stream directory.
+
+Seeds --active live streams (plus as many ended ones) on mongomock and has
+--clients concurrent pollers hit /streams/active through the ASGI app for
+--seconds each run:
+
+  * query        STREAM_DIRECTORY off: one streams query per request;
+  * directory    the in-memory snapshot (the poll reload is the only DB work);
+  * conditional  the snapshot, with clients sending back the ETag they got,
+                 so unchanged lists cost a 304 and no body.
+
+Every streams collection call counts as one database operation.
+
+    python -m benchmarks.stream_directory_bench --active 200 --clients 50 --seconds 3
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI
+from mongomock_motor import AsyncMongoMockClient
+
+from app.api import streams
+from app.api.streaming import manager
+from app.core.database import get_streams_collection
+from app.core.stream_directory import StreamDirectory
+from benchmarks.export_bench import get
+from benchmarks.gift_batch_bench import CountingCollection
+
+
+async def run(label: str, active: int, clients: int, seconds: float):
+    db = AsyncMongoMockClient()["directory_bench"]
+    now = datetime.utcnow()
+    await db.streams.insert_many([
+        {"_id": str(uuid.uuid4()), "host_email": f"host{i}@example.com", "title": f"Stream {i}",
+         "start_time": now - timedelta(seconds=i), "end_time": None, "is_active": i < active}
+        for i in range(active * 2)
+    ])
+    counter = {"ops": 0}
+    collection = CountingCollection(db.streams, counter)
+
+    app = FastAPI()
+    app.include_router(streams.router)
+    app.dependency_overrides[get_streams_collection] = lambda: collection
+    streams.STREAM_DIRECTORY = label != "query"
+    streams.directory = StreamDirectory(manager.viewer_count, collection)
+    if streams.STREAM_DIRECTORY:
+        await streams.directory.start()
+    counter["ops"] = 0
+
+    requests = not_modified = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        nonlocal requests, not_modified
+        etag = None
+        while time.perf_counter() < deadline:
+            headers = {"If-None-Match": etag} if label == "conditional" and etag else None
+            status, response_headers, body = await get(app, "/streams/active", "", headers)
+            async for _ in body:
+                pass
+            requests += 1
+            not_modified += status == 304
+            etag = response_headers.get("etag", etag)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    await streams.directory.stop()
+    print(f"{label:>11}: {requests / elapsed:7.0f} req/s, {counter['ops']} db ops "
+          f"({counter['ops'] / requests:.4f}/request), 304s={not_modified}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--active", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+    for label in ("query", "directory", "conditional"):
+        asyncio.run(run(label, args.active, args.clients, args.seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Chat socket churn soak: does memory stay flat over a million connections?
+
+Opens --connections chat sockets in total through the /ws/chat endpoint
+itself (in-process fake sockets, no network), spread over --rooms rooms with
+about --live open at a time, and ends each one of these ways:
+
+  * leave      the client disconnects (most of them);
+  * chatter    as leave, after sending one chat message;
+  * broken     its next send fails, as on a reset connection;
+  * crash      its receive raises something other than a disconnect;
+  * half-open  it goes quiet and never answers a ping, so only the
+               heartbeat (run at --heartbeat / --idle-timeout) ends it.
+
+Everyone else answers pings. RSS is sampled every --sample connections after
+a gc; the run fails (exit status 1) if RSS grew by more than --max-growth-mb
+between the end of the first tenth and the end, or if rooms, presence,
+history rings or broker subscriptions are left behind once everyone has gone.
+Chat history and presence write to a collection that discards everything, so
+only the app's own memory is measured.
+
+    python -m benchmarks.ws_soak --connections 1000000 --live 10000
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+from collections import Counter, deque
+
+from starlette.websockets import WebSocketDisconnect
+
+from app.api import streaming
+from app.api.streaming import ConnectionManager, websocket_endpoint
+from app.core.chat_history import ChatHistory
+from app.core.heartbeat import PING, PONG, WS_IDLE_CLOSE
+from app.core.presence import Presence
+from benchmarks.fanout_bench import NullCollection
+
+KINDS = ("leave", "chatter", "broken", "crash", "half-open")
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+class Client:
+    def __init__(self, kind: str, outcomes: Counter):
+        self.kind = kind
+        self.outcomes = outcomes
+        self.backlog = deque()
+        self.waiter = None
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self) -> str:
+        while not self.backlog:
+            self.waiter = asyncio.get_running_loop().create_future()
+            await self.waiter
+        item = self.backlog.popleft()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def deliver(self, item):
+        self.backlog.append(item)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def send(self, message: dict):
+        if self.kind == "broken":
+            self.deliver(WebSocketDisconnect(1006))
+            raise ConnectionResetError("reset by peer")
+        if message["text"] == PING and self.kind != "half-open":
+            self.deliver(PONG)
+
+    async def close(self, code: int = 1000):
+        self.outcomes["idle-closed" if code == WS_IDLE_CLOSE else f"closed-{code}"] += 1
+        # The server's close frame; the endpoint's receive then sees the disconnect.
+        self.deliver(WebSocketDisconnect(code))
+
+    def end(self):
+        if self.kind == "crash":
+            self.deliver(RuntimeError("receive failed"))
+        elif self.kind == "broken":
+            self.deliver("trigger a send")
+        elif self.kind != "half-open":
+            self.deliver(WebSocketDisconnect(1000))
+
+
+def leftovers(manager: ConnectionManager) -> dict:
+    return {
+        "rooms": len(manager.active_connections),
+        "presence": len(manager.presence._presence),
+        "history rooms": len(manager.history._rooms),
+        "broker subscriptions": len(manager.broker.hub),
+        "backfills": len(manager._backfills),
+    }
+
+
+async def soak(args) -> bool:
+    null = NullCollection()
+    manager = ConnectionManager(history=ChatHistory(null), presence=Presence(null, flush_interval=1.0))
+    manager.heartbeat.interval = args.heartbeat
+    manager.heartbeat.idle_timeout = args.idle_timeout
+    streaming.manager = manager  # the endpoint's module-level manager
+    await manager.start()
+
+    outcomes, errors = Counter(), Counter()
+    weights = (85, 5, 4, 3, 3)
+    tasks = set()
+
+    def finished(task: asyncio.Task):
+        tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            errors[type(task.exception()).__name__] += 1
+    open_clients = deque()
+    samples = []
+    started = time.perf_counter()
+
+    async def sample(count: int):
+        await asyncio.sleep(0.01)
+        gc.collect()
+        samples.append((count, rss_mb()))
+        print(f"{count:>9} connections, {time.perf_counter() - started:6.1f}s: RSS {samples[-1][1]:7.1f} MiB, "
+              f"{len(tasks)} open, {len(manager.active_connections)} rooms", flush=True)
+
+    for i in range(args.connections):
+        while len(open_clients) >= args.live:
+            open_clients.popleft().end()
+        kind = random.choices(KINDS, weights)[0]
+        outcomes[kind] += 1
+        client = Client(kind, outcomes)
+        task = asyncio.ensure_future(websocket_endpoint(client, f"room-{random.randrange(args.rooms)}"))
+        tasks.add(task)
+        task.add_done_callback(finished)
+        if kind == "chatter":
+            client.deliver(f"hello from {i}")
+        if kind != "half-open":
+            open_clients.append(client)
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+        if (i + 1) % args.sample == 0:
+            await sample(i + 1)
+    if args.connections % args.sample:
+        await sample(args.connections)
+
+    while open_clients:
+        open_clients.popleft().end()
+    # What is left is half-open; wait for the heartbeat to reap it.
+    deadline = time.perf_counter() + args.idle_timeout + args.heartbeat * 4 + 5
+    while tasks and time.perf_counter() < deadline:
+        await asyncio.sleep(args.heartbeat)
+    await manager.stop()
+    await asyncio.sleep(0.01)
+
+    left = leftovers(manager)
+    gc.collect()
+    baseline = next((rss for count, rss in samples if count >= args.connections // 10), samples[0][1])
+    growth = samples[-1][1] - baseline
+    print(f"outcomes: {dict(outcomes)}; heartbeat pings={manager.heartbeat.pings} reaped={manager.heartbeat.reaped}")
+    print(f"left behind: {left}, endpoint tasks still running: {len(tasks)}, endpoint errors: {dict(errors)}")
+    print(f"RSS after warm-up {baseline:.1f} MiB, at the end {samples[-1][1]:.1f} MiB ({growth:+.1f} MiB)")
+    return growth <= args.max_growth_mb and not any(left.values()) and not tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=1_000_000)
+    parser.add_argument("--live", type=int, default=10000, help="sockets open at a time")
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--sample", type=int, default=50000, help="connections between RSS samples")
+    parser.add_argument("--heartbeat", type=float, default=0.2, help="heartbeat interval, seconds")
+    parser.add_argument("--idle-timeout", type=float, default=1.0)
+    parser.add_argument("--max-growth-mb", type=float, default=16)
+    args = parser.parse_args()
+    for name in ("connections", "live", "rooms", "sample", "heartbeat", "idle_timeout"):
+        if getattr(args, name) <= 0:
+            parser.error(f"--{name.replace('_', '-')} must be positive")
+    if args.sample > args.connections // 2:
+        parser.error("--sample must be at most half of --connections, to measure growth between two samples")
+    ok = asyncio.run(soak(args))
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
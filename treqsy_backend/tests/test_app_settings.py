@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+from pydantic import ValidationError
+
+from app.core.app_settings import AppSettings
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+INTERVAL = 0.05
+# Scheduling slack on top of one poll interval.
+SLACK = 0.1
+
+
+async def workers(count: int):
+    # One settings collection shared by independent caches, as the app's workers share the database.
+    collection = mongomock_motor.AsyncMongoMockClient()["settings_test"]["settings"]
+    caches = [AppSettings(collection, poll_interval=INTERVAL) for _ in range(count)]
+    for cache in caches:
+        await cache.start()
+    return caches
+
+
+async def propagation(cache: AppSettings, price: float, started: float) -> float:
+    deadline = started + 5
+    while cache.coin_settings.coin_price != price and time.perf_counter() < deadline:
+        await asyncio.sleep(0.005)
+    return time.perf_counter() - started
+
+
+def test_change_reaches_other_worker_within_poll_interval():
+    async def run():
+        writer, reader = await workers(2)
+        try:
+            for price in (2.5, 3.5, 4.5):
+                started = time.perf_counter()
+                await writer.set("coin_settings", {"coin_price": price, "bonus_rate": 0.1})
+                assert writer.coin_settings.coin_price == price
+                delay = await propagation(reader, price, started)
+                assert reader.coin_settings.coin_price == price
+                assert delay <= INTERVAL + SLACK
+                assert reader.version == writer.version
+        finally:
+            for cache in (writer, reader):
+                await cache.stop()
+
+    asyncio.run(run())
+
+
+def test_concurrent_writes_converge():
+    async def run():
+        first, second = await workers(2)
+        try:
+            await asyncio.gather(first.set("app_name", "First"),
+                                 second.set("coin_settings", {"coin_price": 7, "bonus_rate": 0}))
+            await asyncio.sleep(INTERVAL + SLACK)
+            for cache in (first, second):
+                assert cache.app_name == "First"
+                assert cache.coin_settings.coin_price == 7
+                assert cache.version == 2
+        finally:
+            for cache in (first, second):
+                await cache.stop()
+
+    asyncio.run(run())
+
+
+def test_invalid_value_is_not_written():
+    async def run():
+        writer, reader = await workers(2)
+        try:
+            with pytest.raises(ValidationError):
+                await writer.set("coin_settings", {"coin_price": "not a number"})
+            await asyncio.sleep(INTERVAL + SLACK)
+            assert writer.version == reader.version == 0
+            assert reader.coin_settings.coin_price == 1
+        finally:
+            for cache in (writer, reader):
+                await cache.stop()
+
+    asyncio.run(run())
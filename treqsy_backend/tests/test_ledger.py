@@ -0,0 +1,79 @@
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from app.api import admin, auth
+from app.core.database import get_coin_transactions_collection, get_users_collection
+from app.core.gift_batcher import GiftBatcher, get_gift_batcher
+from app.core.ledger import Ledger, get_ledger
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+@pytest.fixture(params=[False, True], ids=["ledger", "batched"])
+def client(request, monkeypatch):
+    monkeypatch.setattr(admin, "GIFT_BATCHING", request.param)
+    db = mongomock_motor.AsyncMongoMockClient()["ledger_test"]
+    ledger = Ledger(db.users, db.coin_transactions, db.payout_requests, db.ledger_idempotency,
+                    use_transactions=False)
+    app = FastAPI()
+    app.include_router(auth.router)
+    app.include_router(admin.router)
+    app.dependency_overrides[get_users_collection] = lambda: db.users
+    app.dependency_overrides[get_coin_transactions_collection] = lambda: db.coin_transactions
+    app.dependency_overrides[get_ledger] = lambda: ledger
+    app.dependency_overrides[get_gift_batcher] = lambda: GiftBatcher(ledger, db.gift_batches, window=0.01)
+    with TestClient(app) as client:
+        client.db = db
+        yield client
+
+
+def register(client: TestClient, email: str) -> str:
+    response = client.post("/auth/register", json={"email": email, "password": "Secret@123"})
+    assert response.status_code == 201
+    user = client.portal.call(client.db.users.find_one, {"email": email})
+    # Registered users get ObjectId ids; the API takes them as strings.
+    assert isinstance(user["_id"], ObjectId)
+    return str(user["_id"])
+
+
+def coins(client: TestClient, user_id: str) -> int:
+    return client.portal.call(client.db.users.find_one, {"_id": ObjectId(user_id)})["coins"]
+
+
+def test_purchase_and_gift_between_registered_users(client):
+    sender = register(client, "sender@example.com")
+    recipient = register(client, "recipient@example.com")
+
+    response = client.post("/admin/coins/purchase", json={"user_id": sender, "amount": 100})
+    assert response.status_code == 200, response.text
+    response = client.post("/admin/coins/gift", json={"from_user": sender, "to_user": recipient, "amount": 30})
+    assert response.status_code == 200, response.text
+
+    assert coins(client, sender) == 70
+    assert coins(client, recipient) == 30
+    response = client.get(f"/admin/coins/transactions/{recipient}")
+    assert [entry["type"] for entry in response.json()] == ["gift_received"]
+
+
+def test_gift_beyond_balance_is_refused(client):
+    sender = register(client, "sender@example.com")
+    recipient = register(client, "recipient@example.com")
+    client.post("/admin/coins/purchase", json={"user_id": sender, "amount": 10})
+
+    response = client.post("/admin/coins/gift", json={"from_user": sender, "to_user": recipient, "amount": 30})
+    assert response.status_code == 409
+    assert coins(client, sender) == 10
+    assert coins(client, recipient) == 0
+
+
+def test_history_hides_unsettled_transfers(client):
+    user = register(client, "buyer@example.com")
+    client.post("/admin/coins/purchase", json={"user_id": user, "amount": 10})
+    # What a crash between writing a transfer's entries and settling it leaves behind.
+    client.portal.call(client.db.coin_transactions.insert_one,
+                       {"user_id": user, "type": "purchase", "amount": 5, "pending": "crashed"})
+
+    response = client.get(f"/admin/coins/transactions/{user}")
+    assert [entry["amount"] for entry in response.json()] == [10]